@@ -5,7 +5,7 @@ from setuptools import setup
 reqs = ['numpy>=1.13.1',
         'munkres>=1.0.8',
         'scikit_image>=0.12.3',
-        'pyilastik>=0.0.9',
+        'pyilastik>=0.0.9,<0.1',
         'tifffile',
         'sparse>=0.12.0']
 
@@ -26,5 +26,6 @@ setup(name='yapic_io',
       packages=['yapic_io'],
       zip_safe=False,
       install_requires=reqs,
+      extras_require={'zarr': ['zarr']},
       test_suite='nose.collector',
       tests_require=['coverage', 'nose-timer', 'nose'])
@@ -0,0 +1,296 @@
+'''
+Caches for opened image files and decoded image data.
+'''
+import collections
+import os
+import threading
+import time
+import numpy as np
+
+
+class LRUByteCache(object):
+    '''
+    Least recently used cache with a memory budget in bytes.
+
+    Values must be numpy arrays (or provide an ``nbytes`` attribute).
+    If adding a value exceeds the budget, least recently used values are
+    evicted until the total size fits again. Values larger than the whole
+    budget are not cached.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Memory budget in bytes.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.cache import LRUByteCache
+    >>> c = LRUByteCache(max_bytes=16)
+    >>> c.put('a', np.zeros(8, dtype='uint8'))
+    >>> c.put('b', np.zeros(8, dtype='uint8'))
+    >>> c.put('c', np.zeros(8, dtype='uint8'))  # evicts 'a'
+    >>> c.get('a') is None, c.get('c') is None
+    (True, False)
+    >>> c.hits, c.misses
+    (1, 1)
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return ('LRUByteCache ({} entries, {} of {} bytes, '
+                '{} hits, {} misses)').format(len(self), self.nbytes,
+                                              self.max_bytes, self.hits,
+                                              self.misses)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = value.nbytes
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= self._data.pop(key).nbytes
+            if size > self.max_bytes:
+                return
+            self._data[key] = value
+            self.nbytes += size
+            self._evict()
+
+    def resize(self, max_bytes):
+        '''
+        Sets a new memory budget and evicts values if necessary.
+        '''
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes:
+            _, value = self._data.popitem(last=False)
+            self.nbytes -= value.nbytes
+
+
+def handle_cost(handle):
+    '''
+    Returns number of open files and memory mapped bytes of an opened
+    image (a memory map or a lazy array).
+    '''
+    if isinstance(handle, np.memmap):
+        return 1, handle.nbytes
+    inner = getattr(handle, 'array', None)  # e.g. ZYXCView
+    if inner is not None:
+        return handle_cost(inner)
+    if hasattr(handle, 'close'):  # e.g. TiffSegmentArray
+        return 1, 0
+    return 0, 0
+
+
+class HandleCache(object):
+    '''
+    Least recently used cache for opened image files (memory maps and
+    lazy arrays), shared by connectors.
+
+    Opening a file (memory mapping and parsing the tiff header) is
+    expensive, so handles are kept open as long as the limits allow.
+    If a limit is exceeded, least recently used handles are dropped.
+    Dropped handles are closed as soon as they are not referenced
+    anymore.
+
+    Parameters
+    ----------
+    max_entries : int, optional
+        Maximum number of cached handles.
+    max_open_files : int, optional
+        Maximum number of open file descriptors held by cached handles.
+    max_bytes : int, optional
+        Maximum number of memory mapped bytes.
+    check_interval : float, optional
+        Minimum time in seconds between two checks of a file for
+        modifications (see get_file). With 0, files are checked on every
+        access. With None, files are checked only when opened first.
+
+    Notes
+    -----
+    Limits set to None are not enforced.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.cache import HandleCache
+    >>> c = HandleCache(max_entries=2)
+    >>> a = c.get('a', lambda: np.zeros(3))
+    >>> a = c.get('a', lambda: np.zeros(3))
+    >>> b = c.get('b', lambda: np.zeros(3))
+    >>> d = c.get('d', lambda: np.zeros(3))  # drops 'a'
+    >>> len(c), 'a' in c, c.hits, c.misses
+    (2, False, 1, 3)
+    '''
+
+    def __init__(self, max_entries=512, max_open_files=256, max_bytes=None,
+                 check_interval=5.):
+        self.max_entries = max_entries
+        self.max_open_files = max_open_files
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.n_open_files = 0
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._file_stats = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return ('HandleCache ({} entries, {} open files, {} mapped bytes, '
+                '{} hits, {} misses)').format(len(self), self.n_open_files,
+                                              self.nbytes, self.hits,
+                                              self.misses)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, opener):
+        '''
+        Returns cached handle for key. If not cached, the handle is created
+        with `opener()` and cached.
+        '''
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key][0]
+            self.misses += 1
+
+        # opening is done without lock to allow concurrent opening of files
+        handle = opener()
+        cost = handle_cost(handle)
+
+        with self._lock:
+            if key in self._data:  # opened concurrently by another thread
+                return self._data[key][0]
+            self._data[key] = (handle, cost)
+            self.n_open_files += cost[0]
+            self.nbytes += cost[1]
+            self._evict()
+        return handle
+
+    def get_file(self, path, opener, *key):
+        '''
+        Returns cached handle for a file. Handles of files that were
+        modified since opening (size or modification time changed)
+        are not reused.
+
+        To avoid a metadata request on every access (slow on network
+        filesystems), file size and modification time are only checked
+        again after `check_interval` seconds or after expire_file_stats().
+
+        Parameters
+        ----------
+        path : str or Path
+            File path.
+        opener : callable
+            Returns a new handle for the file.
+        *key
+            Further hashable values identifying the handle (e.g. opening
+            parameters).
+        '''
+        path = str(path)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._file_stats.get(path)
+        if (entry is None or (self.check_interval is not None and
+                              now - entry[1] >= self.check_interval)):
+            st = os.stat(path)
+            entry = ((st.st_size, st.st_mtime_ns), now)
+            with self._lock:
+                self._file_stats[path] = entry
+        return self.get((path,) + entry[0] + key, opener)
+
+    def expire_file_stats(self):
+        '''
+        Forces a check for modifications on next access of each file
+        (e.g. once per training epoch).
+        '''
+        with self._lock:
+            self._file_stats.clear()
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def configure(self, max_entries=None, max_open_files=None,
+                  max_bytes=None):
+        '''
+        Sets new limits (None for no limit) and drops handles if
+        necessary.
+        '''
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_open_files = max_open_files
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._file_stats.clear()
+            self.n_open_files = 0
+            self.nbytes = 0
+
+    def _remove(self, key):
+        _, (n_files, nbytes) = self._data.pop(key)
+        self.n_open_files -= n_files
+        self.nbytes -= nbytes
+
+    def _exceeded(self):
+        return ((self.max_entries is not None and
+                 len(self._data) > self.max_entries) or
+                (self.max_open_files is not None and
+                 self.n_open_files > self.max_open_files) or
+                (self.max_bytes is not None and
+                 self.nbytes > self.max_bytes))
+
+    def _evict(self):
+        # the most recently used handle is always kept
+        while len(self._data) > 1 and self._exceeded():
+            self._remove(next(iter(self._data)))
+
+
+# opened image, label and probability map files of all connectors
+# (see yapic_io.tiff_connector.TiffConnector)
+handle_cache = HandleCache()
+
+# decoded strips and tiles of compressed or tiled tiff files
+# (see yapic_io.lazy_array.TiffSegmentArray)
+decoded_segment_cache = LRUByteCache(max_bytes=256 * 2**20)
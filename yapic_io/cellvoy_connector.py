@@ -1,8 +1,6 @@
-from yapic_io.tiff_connector import TiffConnector
+from yapic_io.tiff_connector import TiffConnector, tiff_metadata
 from yapic_io.ilastik_connector import IlastikConnector
-from skimage import io
-from functools import lru_cache
-import numpy as np
+from yapic_io.lazy_array import ChannelStackArray
 from glob import glob
 import os
 
@@ -28,11 +26,28 @@ class CellvoyConnector(IlastikConnector):
         idx = [pxnames_cellvoy.index(e) for e in pxnames_tiff_connector]
         self.names_all_channels = [self.names_all_channels[i] for i in idx]
 
-    @lru_cache(maxsize=10)
+    def _view(self, image_nrs):
+        view = super()._view(image_nrs)
+        view.names_all_channels = [self.names_all_channels[i]
+                                   for i in image_nrs]
+        return view
+
+    def _image_file_shape(self, image_nr):
+        img_names = self.names_all_channels[image_nr]
+        Z, Y, X, _ = tiff_metadata(img_names[0]).zyxc_shape
+        return (Z, Y, X, len(img_names))
+
     def _open_image_file(self, image_nr):
+        '''
+        Returns lazy array with shape: z, y, x, c
 
+        Channel files are memory mapped (or decoded on demand if
+        compressed), only requested regions and channels are read.
+        '''
         img_names = self.names_all_channels[image_nr]
-        pixels = np.stack([io.imread(img_name) for img_name in img_names], axis = -1)
-        if len(pixels.shape) == 3:
-            pixels = np.expand_dims(pixels, axis=0)
-        return pixels
\ No newline at end of file
+        return ChannelStackArray([self._open_channel_file(name)
+                                  for name in img_names])
+
+    def _open_channel_file(self, path):
+        return self.handle_cache.get_file(
+            path, lambda: TiffConnector._open_tiff(path))
@@ -6,27 +6,32 @@ logger = logging.getLogger(os.path.basename(__file__))
 
 def io_connector(image_path, label_path, *args, **kwds):
     '''
-    Returns either a TiffConnector or an IlastikConnector, depending on
-    input files.
+    Returns either a TiffConnector, an IlastikConnector, a NapariConnector
+    or a ZarrConnector, depending on input files.
 
     Parameters
     ----------
     image_path : str or list of str
         Either wildcard or list of paths to pixel data in tiff format.
+        For Napari projects, None reads pixel data from the image layers
+        of the project.
     label_path : str of list of str
         Either wildcard or list of paths to pixel data in tiff format
         returns a TiffConnector. If a path to a single Ilastik ilp
-        file is given, an IlastikConnector is returned.
+        file is given, an IlastikConnector is returned. For paths to
+        zarr or n5 stores, a ZarrConnector is returned.
 
     Returns
     -------
     Connector
-        Either IlastikConnector or TiffConnector
+        Either IlastikConnector, NapariConnector, ZarrConnector or
+        TiffConnector
 
     See Also
     --------
     yapic_io.tiff_connector.TiffConnector
     yapic_io.ilastik_connector.IlastikConnector
+    yapic_io.zarr_connector.ZarrConnector
     '''
     from yapic_io.tiff_connector import TiffConnector
     from yapic_io.napari_connector import NapariConnector
@@ -37,7 +42,11 @@ def io_connector(image_path, label_path, *args, **kwds):
         return IlastikConnector(image_path, label_path, *args, **kwds)
     elif label_path.endswith('.h5'):
         logger.info('Napari project file detected')
-        return NapariConnector(image_path, label_path)
+        return NapariConnector(image_path, label_path, *args, **kwds)
+    elif label_path.rstrip('/').endswith(('.zarr', '.n5')):
+        from yapic_io.zarr_connector import ZarrConnector
+        logger.info('Zarr/N5 stores detected.')
+        return ZarrConnector(image_path, label_path, *args, **kwds)
     else:
         logger.info('Tiff files detected.')
         return TiffConnector(image_path, label_path, *args, **kwds)
@@ -81,6 +90,15 @@ class Connector(metaclass=ABCMeta):
         '''
 
 
+    def has_label_coordinates(self):
+        '''
+        Returns True if the connector provides label coordinates
+        (see CoordinateConnector.label_index_to_coordinate). In this case,
+        training tiles are fetched by label coordinate instead of random
+        polling.
+        '''
+        return hasattr(self, 'label_index_to_coordinate')
+
     @abstractmethod
     def image_count(self):
         '''
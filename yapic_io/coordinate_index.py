@@ -0,0 +1,191 @@
+'''
+Index of label coordinates for by-coordinate sampling of training tiles,
+optionally persisted in npz sidecar files.
+'''
+import collections
+import logging
+import os
+from pathlib import Path
+import numpy as np
+import yapic_io.utils as ut
+from yapic_io.stats_cache import _fingerprint
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+DEFAULT_DIRNAME = '.yapic_io_coordinates'
+
+
+class LabelCoordinateIndex(object):
+    '''
+    Coordinates of all labeled voxels of a label image, grouped by label
+    channel and label value.
+
+    Coordinates are stored as int32 arrays of shape (n, 3) in dimension
+    order (z, y, x), sorted in storage order of the label image.
+
+    Parameters
+    ----------
+    coordinates : dict
+        Keys are tuples (channel, label_value), values are arrays of zyx
+        coordinates.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.coordinate_index import LabelCoordinateIndex
+    >>> lbl = np.zeros((1, 3, 4, 1), dtype='uint8')  # z, y, x, c
+    >>> lbl[0, 1, 2:, 0] = 5
+    >>> lbl[0, 2, 0, 0] = 2
+    >>> index = LabelCoordinateIndex.from_label_data(lbl)
+    >>> index.label_histogram()
+    [{2: 1, 5: 2}]
+    >>> index.coordinates(0, 5)
+    array([[0, 1, 2],
+           [0, 1, 3]], dtype=int32)
+    '''
+
+    def __init__(self, coordinates):
+        self._coordinates = {(int(c), l): np.asarray(coords, np.int32)
+                             for (c, l), coords in coordinates.items()}
+        self.n_channels = 1 + max([c for c, _ in self._coordinates],
+                                  default=0)
+
+    def __repr__(self):
+        return 'LabelCoordinateIndex ({} labels, {} bytes)'.format(
+            len(self._coordinates), self.nbytes)
+
+    @property
+    def nbytes(self):
+        return sum(coords.nbytes for coords in self._coordinates.values())
+
+    @classmethod
+    def from_label_data(cls, label_data, n_channels=None,
+                        max_block_bytes=2**26):
+        '''
+        Collects label coordinates of a label image in one pass (block by
+        block, see utils.iter_zy_blocks).
+
+        Parameters
+        ----------
+        label_data : array_like
+            4D label array with dimension order (z, y, x, c).
+        max_block_bytes : int
+            Approximate maximum size of blocks read at once.
+        '''
+        C = label_data.shape[-1]
+        parts = collections.defaultdict(list)
+
+        for (z, y), block in ut.iter_zy_blocks_with_offsets(label_data,
+                                                            max_block_bytes):
+            for c in range(C):
+                lbl = block[..., c]
+                coords = np.argwhere(lbl != 0)  # same as label_histogram
+                if len(coords) == 0:
+                    continue
+                values = lbl[tuple(coords.T)]
+                order = np.argsort(values, kind='stable')
+                values, coords = values[order], coords[order]
+                coords = (coords + (z, y, 0)).astype(np.int32)
+
+                labels, starts = np.unique(values, return_index=True)
+                for l, part in zip(labels.tolist(),
+                                   np.split(coords, starts[1:])):
+                    parts[(c, l)].append(part)
+
+        index = cls({key: np.concatenate(p) for key, p in parts.items()})
+        index.n_channels = C
+        return index
+
+    @classmethod
+    def load(cls, path, label_path):
+        '''
+        Reads an index from an npz file. Returns None if the file does not
+        exist or if the label file was modified after the index was
+        created.
+        '''
+        path = Path(path)
+        if not path.exists():
+            return None
+        try:
+            with np.load(str(path)) as f:
+                if f['fingerprint'].tolist() != _fingerprint(label_path):
+                    logger.info('Ignoring outdated coordinate index %s',
+                                path)
+                    return None
+                keys = zip(f['channels'].tolist(),
+                           f['label_values'].tolist())
+                coordinates = {(c, l): f['coords_{}'.format(i)]
+                               for i, (c, l) in enumerate(keys)}
+                n_channels = int(f['n_channels'])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning('Could not read coordinate index %s: %s', path, e)
+            return None
+
+        index = cls(coordinates)
+        index.n_channels = n_channels
+        return index
+
+    def save(self, path, label_path):
+        '''
+        Writes the index to an npz file, together with the fingerprint
+        (size and modification time) of the label file.
+        '''
+        path = Path(path)
+        keys = sorted(self._coordinates.keys())
+        arrays = {'coords_{}'.format(i): self._coordinates[key]
+                  for i, key in enumerate(keys)}
+        tmp_path = path.with_name(path.name + '.tmp.npz')
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            np.savez(str(tmp_path),
+                     fingerprint=np.array(_fingerprint(label_path)),
+                     channels=np.array([c for c, _ in keys], dtype=np.int64),
+                     label_values=np.array([l for _, l in keys]),
+                     n_channels=self.n_channels,
+                     **arrays)
+            os.replace(str(tmp_path), str(path))
+        except OSError as e:
+            logger.warning('Could not write coordinate index %s: %s',
+                           path, e)
+
+    def coordinates(self, channel, label_value):
+        '''
+        Returns zyx coordinates of a label value in a label channel as
+        array of shape (n, 3).
+        '''
+        coords = self._coordinates.get((channel, label_value))
+        if coords is None:
+            return np.zeros((0, 3), dtype=np.int32)
+        return coords
+
+    def label_histogram(self):
+        '''
+        Same as yapic_io.utils.label_histogram().
+        '''
+        counts = [{} for _ in range(self.n_channels)]
+        for (c, l), coords in sorted(self._coordinates.items()):
+            counts[c][l] = len(coords)
+        return counts
+
+
+def get_coordinate_index_dir(coordinate_index, folder):
+    '''
+    Returns the directory of persisted coordinate indices for the
+    coordinate_index argument of connectors (None if disabled).
+
+    Parameters
+    ----------
+    coordinate_index : None, bool, str or Path
+        None or False disables the index. True stores the index in
+        a subfolder of `folder`. A path defines a custom directory.
+    folder : Path
+        Default location of the index directory.
+    '''
+    if coordinate_index is None or coordinate_index is False:
+        return None
+    if coordinate_index is True:
+        folder = Path(folder)
+        if not folder.is_dir():
+            folder = folder.parent
+        return folder / DEFAULT_DIRNAME
+    return Path(coordinate_index)
@@ -7,6 +7,8 @@ from functools import lru_cache
 import logging
 import os
 import yapic_io.transformations as trafo
+from yapic_io.integral_volume import IntegralVolume, bin_counts
+from yapic_io.cache import LRUByteCache
 import sys
 
 logger = logging.getLogger(os.path.basename(__file__))
@@ -32,6 +34,18 @@ class Dataset(object):
     pixel_connector : yapic_io.connector.Connector
         Connector object (e.g. TiffConnector or IlastikConnector) for binding
         of pixel and label data, as well as prediction result data.
+    n_workers : int, optional
+        Number of threads for collecting label counts and image dimensions
+        of all images. Defaults to the `n_workers` setting of the
+        connector (serial if not set).
+    integral_bin_zxy : (z, x, y), optional
+        Resolution of the summed-area tables used for counting labels in
+        tiles (see label_count_in_tile). Labels are counted in bins of
+        this size, counts are upper bounds (exact with bins of (1, 1, 1),
+        which needs 4 bytes per voxel and label).
+    integral_max_bytes : int, optional
+        Memory budget for summed-area tables. Least recently used tables
+        are dropped and rebuilt when needed again.
 
     Notes
     -----
@@ -39,10 +53,14 @@ class Dataset(object):
     Pixel data is cached in memory for repeated requests.
     '''
 
-    def __init__(self, pixel_connector):
+    def __init__(self, pixel_connector, n_workers=None,
+                 integral_bin_zxy=(8, 32, 32), integral_max_bytes=2**28):
 
         self.pixel_connector = pixel_connector
         self.n_images = pixel_connector.image_count()
+        if n_workers is None:
+            n_workers = getattr(pixel_connector, 'n_workers', None)
+        self.n_workers = n_workers
         self.label_counts = self.load_label_counts()
 
         # self.label_weights dict is complementary to self.label_counts
@@ -51,6 +69,10 @@ class Dataset(object):
         # max nr of trials to get a random training tile in polling mode
         self.max_pollings = 30
 
+        # summed-area tables of labels per image (built on demand)
+        self.integral_bin_zxy = tuple(integral_bin_zxy)
+        self._label_integrals = LRUByteCache(max_bytes=integral_max_bytes)
+
         is_consistent, channel_cnt = self.channels_are_consistent()
         msg = ('Varying number of channels: {}. '
                'Channel counts must be identical '
@@ -158,8 +180,9 @@ class Dataset(object):
         list
             List with channel counts
         '''
-        channel_cnt = np.unique([self.image_dimensions(i)[0]
-                                for i in range(self.n_images)])
+        dims = ut.parallel_map(self.image_dimensions, range(self.n_images),
+                               self.n_workers)
+        channel_cnt = np.unique([d[0] for d in dims])
 
         if len(channel_cnt) == 1:
             return True, channel_cnt
@@ -222,7 +245,7 @@ class Dataset(object):
         if labels == 'all':
             labels = self.label_values()
 
-        if hasattr(self.pixel_connector, 'label_index_to_coordinate'):
+        if self.pixel_connector.has_label_coordinates():
             # fetch by label index
             return self._random_training_tile_by_coordinate(
                 size_zxy,
@@ -277,6 +300,154 @@ class Dataset(object):
             lbl_count = self.label_counts[label_value]
         return lbl_count / lbl_count.sum()
 
+    def label_integral(self, image_nr, label_value):
+        '''
+        Returns summed-area table (IntegralVolume) of a label in an image.
+        Tables are built on first request. Tables of all labels of the
+        same label channel are built together, such that each block of
+        label data is read only once (see label_value_tile of
+        connectors).
+
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+        label_value : int
+            Id of the label.
+
+        Returns
+        -------
+        IntegralVolume
+            Counts of label_value in dimension order (z, x, y).
+        '''
+        key = (image_nr, label_value)
+        integral = self._label_integrals.get(key)
+        if integral is None:
+            integrals = self._build_label_integrals(
+                image_nr, self._labels_of_same_channel(label_value))
+            for label, iv in integrals.items():
+                self._label_integrals.put((image_nr, label), iv)
+            integral = integrals[label_value]
+        return integral
+
+    def _labels_of_same_channel(self, label_value):
+        '''
+        Returns all label values stored in the same label channel as
+        label_value (only label_value if the connector does not provide
+        label_value_tile()).
+        '''
+        if not hasattr(self.pixel_connector, 'label_value_tile'):
+            return [label_value]
+        mapping = self.pixel_connector._mapped_label_value_to_original
+        channel = mapping(label_value)[0]
+        return [label for label in self.label_values()
+                if mapping(label)[0] == channel]
+
+    def _build_label_integrals(self, image_nr, labels,
+                               max_block_voxels=2**24):
+        shape_zxy = np.array(self.image_dimensions(image_nr)[1:])
+        bin_zxy = np.array(self.integral_bin_zxy)
+        n_bins = -(-shape_zxy // bin_zxy)
+        counts = {label: np.zeros(n_bins, dtype=np.uint32)
+                  for label in labels}
+        labels = [label for label in labels
+                  if self.label_counts[label][image_nr] > 0]
+
+        if hasattr(self.pixel_connector, 'label_value_tile'):
+            # all labels are counted from one read of label values
+            mapping = self.pixel_connector._mapped_label_value_to_original
+            channel = mapping(labels[0])[0] if labels else 0
+            originals = [mapping(label)[1] for label in labels]
+
+            def get_masks(pos_zxy, size_zxy):
+                values = self.pixel_connector.label_value_tile(
+                    image_nr, pos_zxy, size_zxy, channel)
+                return [values == original for original in originals]
+        else:
+            def get_masks(pos_zxy, size_zxy):
+                return [self.pixel_connector.label_tile(
+                            image_nr, pos_zxy, size_zxy, label)
+                        for label in labels]
+
+        # blocks of whole bins, all y
+        Z, X, Y = shape_zxy
+        bz, bx, _ = bin_zxy
+        xs = max(1, max_block_voxels // (bz * bx * Y)) * bx
+        for z in range(0, Z if labels else 0, bz):
+            for x in range(0, X, xs):
+                size_zxy = (min(bz, Z - z), min(xs, X - x), Y)
+                masks = get_masks((z, x, 0), size_zxy)
+                for label, mask in zip(labels, masks):
+                    binned = bin_counts(mask, bin_zxy)
+                    counts[label][z // bz, x // bx: x // bx + len(binned[0])] \
+                        = binned[0]
+
+        return {label: IntegralVolume(c, shape_zxy, bin_zxy)
+                for label, c in counts.items()}
+
+    def label_count_in_tile(self, image_nr, pos_zxy, size_zxy,
+                            label_value=None):
+        '''
+        Returns the number of labels in a tile without reading pixel or
+        label data (see label_integral). If `integral_bin_zxy` is larger
+        than one voxel (default), the count is an upper bound, but 0
+        always means that the tile contains no labels.
+
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+        pos_zxy : (z, x, y) or array_like
+            Upper left position of the tile, or an array of shape (n, 3)
+            with positions of n tiles.
+        size_zxy : (nr_zslices, nr_x, nr_y)
+            Tile size.
+        label_value : int, optional
+            Id of the label. Counts of all labels are summed if None.
+
+        Returns
+        -------
+        int or numpy.ndarray
+            Label count for one position or array of counts.
+        '''
+        labels = self.label_values() if label_value is None \
+            else [label_value]
+        return sum(self.label_integral(image_nr, label).count(pos_zxy,
+                                                              size_zxy)
+                   for label in labels)
+
+    def label_coordinate(self, label_value, label_index):
+        '''
+        Returns image and czxy coordinate of a label. Labels of all images
+        are indexed consecutively, with image order.
+
+        Parameters
+        ----------
+        label_value : int
+            Id of the label.
+        label_index : int
+            Value between 0 and the total count of label_value in all
+            images.
+
+        Returns
+        -------
+        tuple
+            (image_nr, c, z, x, y)
+        '''
+        counts = self.label_counts[label_value]
+        msg = 'Label index {} out of range for {} labels'.format(
+            label_index, counts.sum())
+        assert 0 <= label_index < counts.sum(), msg
+
+        # image containing the label index
+        upper = np.cumsum(counts)
+        img_nr = int(np.searchsorted(upper, label_index, side='right'))
+        label_index -= upper[img_nr] - counts[img_nr]
+
+        coord = self.pixel_connector.label_index_to_coordinate(
+                    img_nr, label_value, label_index)
+        return (img_nr,) + tuple(int(c) for c in coord)
+
     def _random_training_tile_by_polling(self,
                                          size_zxy,
                                          channels,
@@ -291,6 +462,8 @@ class Dataset(object):
         tile. The number if trials is set in self.max_pollings.
         If the nr of trials exceeds max_pollings, the last fetched tile is
         returned, although not containing the label.
+        Tiles are checked for labels with label_count_in_tile() first,
+        such that pixel data is only read for tiles containing labels.
         '''
         augment_params = augment_params or {}
         if ensure_labelvalue is None and equalized:
@@ -300,6 +473,11 @@ class Dataset(object):
             img_nr, pos_zxy = self._random_pos_izxy(ensure_labelvalue,
                                                     size_zxy)
 
+            is_last_trial = counter == self.max_pollings - 1
+            if not is_last_trial and not self.label_count_in_tile(
+                    img_nr, pos_zxy, size_zxy, ensure_labelvalue):
+                continue  # no labels in tile, skip reading pixels
+
             tile_data = self.training_tile(img_nr, pos_zxy, size_zxy,
                                            channels, labels,
                                            pixel_padding=pixel_padding,
@@ -410,23 +588,42 @@ class Dataset(object):
         -------
         collections.namedtuple
             TrainingTile(pixels, channels, labels, weights, augmentation)
+
+        Notes
+        -----
+        If the connector provides label_value_tile(), pixels and labels
+        are fetched and augmented together as one stack (see
+        _augment_stack). Pixels are interpolated with order
+        `augment_params['interpolation_order']` (0 by default), labels
+        always with nearest neighbour interpolation. Tiles that are not
+        square in xy and rotated by rot90 and rotation/shear are cropped
+        off-center (see _augment_tile) and are augmented separately.
         '''
         augment_params = augment_params or {}
-        # 4d pixel tile with selected channels in 1st dimension
-        pixel_tile = self.multichannel_pixel_tile(
-                        image_nr, pos_zxy, size_zxy, channels,
-                        pixel_padding=pixel_padding,
-                        augment_params=augment_params)
-
-        # 4d label tile with selected labels in 1st dimension
-        shape_zxy = self.image_dimensions(image_nr)[1:]
-        label_tile = [_augment_tile(shape_zxy, pos_zxy, size_zxy,
-                                    self._get_weights_tile,
-                                    augment_params=augment_params,
-                                    image_nr=image_nr,
-                                    label_value=l)
-                      for l in labels]
-        label_tile = np.array(label_tile)
+        size_padded = np.array(size_zxy) + 2 * np.array(pixel_padding)
+        is_joint = (hasattr(self.pixel_connector, 'label_value_tile') and
+                    not _is_off_center_crop(size_zxy, augment_params) and
+                    not _is_off_center_crop(size_padded, augment_params))
+        if is_joint:
+            pixel_tile, label_tile = self._joint_training_tile(
+                image_nr, pos_zxy, size_zxy, channels, labels,
+                pixel_padding=pixel_padding, augment_params=augment_params)
+        else:
+            # 4d pixel tile with selected channels in 1st dimension
+            pixel_tile = self.multichannel_pixel_tile(
+                            image_nr, pos_zxy, size_zxy, channels,
+                            pixel_padding=pixel_padding,
+                            augment_params=augment_params)
+
+            # 4d label tile with selected labels in 1st dimension
+            shape_zxy = self.image_dimensions(image_nr)[1:]
+            label_tile = [_augment_tile(shape_zxy, pos_zxy, size_zxy,
+                                        self._get_weights_tile,
+                                        augment_params=augment_params,
+                                        image_nr=image_nr,
+                                        label_value=l)
+                          for l in labels]
+            label_tile = np.array(label_tile)
 
         msg = 'pixel tile dim={} label tile dim={} labels={}'.format(
                     pixel_tile.shape, label_tile.shape, len(labels))
@@ -442,6 +639,14 @@ class Dataset(object):
                                 channels,
                                 pixel_padding=(0, 0, 0),
                                 augment_params=None):
+        '''
+        Returns a padded and augmented pixel tile with dimensions czxy.
+
+        All channels are fetched, padded and augmented together: channels
+        in consecutive order are read with one call of the connector's
+        get_tile(). Rotation and shear use interpolation order
+        `augment_params['interpolation_order']` (0 by default).
+        '''
         augment_params = augment_params or {}
         np.testing.assert_equal(len(pos_zxy), 3,
                                 'Expected 3 dimensions (Z, X, Y)')
@@ -455,18 +660,126 @@ class Dataset(object):
         size_padded = size_zxy + 2 * pixel_padding
         pos_padded = pos_zxy - pixel_padding
 
+        channels = tuple(int(c) for c in channels)
+        for c in channels:
+            msg = 'channel {} does not exist'.format(c)
+            assert c < image_shape_zxy[0], msg
+
+        # channel dimension refers to the selected channels
+        n_channels = len(channels)
+        return _augment_tile(np.hstack([[n_channels], image_shape_zxy[1:]]),
+                             np.hstack([[0], pos_padded]),
+                             np.hstack([[n_channels], size_padded]),
+                             self._get_channels_tile,
+                             augment_params=augment_params,
+                             order=augment_params.get('interpolation_order',
+                                                      0),
+                             image_nr=image_nr,
+                             channels=channels)
+
+    def _get_channels_tile(self, image_nr=None, pos=None, size=None,
+                           channels=None):
+        '''
+        Returns a czxy pixel tile of selected channels. pos[0] and size[0]
+        refer to the list of channels. Runs of consecutive channels are
+        read at once.
+        '''
+        C, Z, X, Y = pos
+        CC = C + size[0]
+        channels = channels[C:CC]
+
+        # split channels into runs of consecutive channels
+        splits = np.flatnonzero(np.diff(channels) != 1) + 1
+        runs = np.split(np.array(channels), splits)
+        tiles = [self.pixel_connector.get_tile(image_nr,
+                                               (run[0], Z, X, Y),
+                                               (len(run),) + tuple(size[1:]))
+                 for run in runs if len(run)]
+        if len(tiles) == 1:
+            return tiles[0]
+        return np.concatenate(tiles)
+
+    def _joint_training_tile(self, image_nr, pos_zxy, size_zxy, channels,
+                             labels, pixel_padding=(0, 0, 0),
+                             augment_params=None):
+        '''
+        Returns pixel tile (czxy) and weights of several labels (lzxy).
+
+        Pixels and label values of each label channel are read for the
+        padded tile region and augmented together as one stack. Label
+        values are then cropped to the tile size and expanded to one
+        weight matrix per label.
+        '''
+        augment_params = augment_params or {}
+        np.testing.assert_equal(len(pos_zxy), 3,
+                                'Expected 3 dimensions (Z, X, Y)')
+        np.testing.assert_equal(len(size_zxy), 3,
+                                'Expected 3 dimensions (Z, X, Y)')
+
+        image_shape = self.image_dimensions(image_nr)
+        ut.assert_valid_image_subset(image_shape[1:], pos_zxy, size_zxy)
+
+        channels = tuple(int(c) for c in channels)
         for c in channels:
             msg = 'channel {} does not exist'.format(c)
-            assert c < self.pixel_connector.image_dimensions(image_nr)[0], msg
-        tile = [_augment_tile(image_shape_zxy,
-                              np.hstack([[c], pos_padded]),
-                              np.hstack([[1], size_padded]),
-                              self.pixel_connector.get_tile,
-                              augment_params=augment_params,
-                              image_nr=image_nr)
-                for c in channels]
+            assert c < image_shape[0], msg
+
+        labels = list(labels)
 
-        return np.vstack(tile)
+        # label indices and original label values per label channel
+        by_channel = collections.defaultdict(list)
+        for i, label_value in enumerate(labels):
+            assert label_value in self.label_values()
+            C, original = \
+                self.pixel_connector._mapped_label_value_to_original(
+                    label_value)
+            by_channel[C].append((i, original,
+                                  self.label_weights[label_value]))
+
+        label_channels = sorted(by_channel.keys())
+
+        def get_pixels(pos, size):
+            return self._get_channels_tile(image_nr, (0,) + tuple(pos),
+                                           (len(channels),) + tuple(size),
+                                           channels)
+
+        def get_label_values(channel):
+            return lambda pos, size: self._get_label_values_tile(
+                image_nr, pos, size, channel)[np.newaxis]
+
+        pixel_padding = np.array(pixel_padding)
+        pixel_order = augment_params.get('interpolation_order', 0)
+        pixel_tile, *label_values = _augment_stack(
+            image_shape[1:],
+            np.array(pos_zxy) - pixel_padding,
+            np.array(size_zxy) + 2 * pixel_padding,
+            [get_pixels] + [get_label_values(C) for C in label_channels],
+            augment_params=augment_params,
+            orders=[pixel_order] + [0] * len(label_channels))
+
+        # crop labels to tile size (x and y are swapped by odd rot90)
+        pad_zxy = pixel_padding.copy()
+        if augment_params.get('rot90', 0) % 2 == 1:
+            pad_zxy[1:] = pad_zxy[:0:-1]
+        size_out = np.array(pixel_tile.shape[1:]) - 2 * pad_zxy
+        crop = tuple(slice(p, p + s) for p, s in zip(pad_zxy, size_out))
+
+        weights = np.zeros((len(labels),) + tuple(size_out))
+        for C, values in zip(label_channels, label_values):
+            indices, originals, label_weights = zip(*by_channel[C])
+            weights[list(indices)] = _one_hot_weights(values[0][crop],
+                                                      originals,
+                                                      label_weights)
+        return pixel_tile, weights
+
+    def _get_label_values_tile(self, image_nr=None, pos=None, size=None,
+                               channel=0):
+        '''
+        Returns a 3d tile of original label values of a label channel with
+        dimensions zxy.
+        '''
+        return self.pixel_connector.label_value_tile(image_nr, pos, size,
+                                                     channel)
 
     def _get_weights_tile(self, image_nr=None, pos=None, size=None,
                           label_value=None):
@@ -526,9 +839,11 @@ class Dataset(object):
 
         label_counts = collections.defaultdict(lambda: np.zeros(self.n_images,
                                                                 dtype='int64'))
-        for i in range(self.n_images):
-            img_label_counts = \
-                self.pixel_connector.label_count_for_image(i) or {}
+        connector = self.pixel_connector
+        all_counts = ut.parallel_map(connector.label_count_for_image,
+                                     range(self.n_images), self.n_workers)
+        for i, img_label_counts in enumerate(all_counts):
+            img_label_counts = img_label_counts or {}
 
             for label_value in img_label_counts.keys():
                 label_counts[label_value][i] = img_label_counts[label_value]
@@ -664,17 +979,219 @@ def inner_tile_size(image_shape, pos, tile_shape):
     return tuple(pos_out), tuple(size_out), tuple(pos_tile), tuple(padding)
 
 
+def _one_hot_weights(values, label_values, weights):
+    '''
+    Expands a matrix of label values to one weight matrix per label value
+    (weight where the label value occurs, 0 elsewhere).
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.dataset import _one_hot_weights
+    >>> _one_hot_weights(np.array([[0, 3, 7]]), [7, 3], [0.5, 2])
+    array([[[0. , 0. , 0.5]],
+    <BLANKLINE>
+           [[0. , 2. , 0. ]]])
+    '''
+    out = np.zeros((len(label_values),) + values.shape)
+    if values.size == 0:
+        return out
+
+    if values.dtype.kind in 'ui' and values.min() >= 0 and \
+            min(label_values) >= 0 and values.max() < 2**24:
+        # lookup table: label value -> row in out (0: not selected)
+        lut = np.zeros(max(int(values.max()), *label_values) + 1,
+                       dtype=np.intp)
+        lut[list(label_values)] = np.arange(1, len(label_values) + 1)
+        rows = lut[values]
+        weight_lut = np.concatenate([[0.], weights])
+
+        one_hot = np.zeros((len(label_values) + 1,) + values.shape)
+        np.put_along_axis(one_hot, rows[np.newaxis],
+                          weight_lut[rows][np.newaxis], axis=0)
+        return one_hot[1:]
+
+    # e.g. float values after rotation
+    for i, (label_value, weight) in enumerate(zip(label_values, weights)):
+        out[i][values == label_value] = weight
+    return out
+
+
+def _is_off_center_crop(tile_shape, augment_params):
+    '''
+    True if a tile is cropped off-center after rotation/shear: the tile
+    is rotated by an odd number of rot90 steps and not square in xy, but
+    cropped with the original (not swapped) tile shape.
+    '''
+    return (augment_params.get('rot90', 0) % 2 == 1 and
+            (augment_params.get('rotation_angle', 0) > 0 or
+             augment_params.get('shear_angle', 0) > 0) and
+            tile_shape[-1] != tile_shape[-2])
+
+
+def _use_fast_affine(augment_params, tile_shape, orders=(0,)):
+    return (augment_params.get('fast_affine', False)
+            and not _is_off_center_crop(tile_shape, augment_params)
+            and all(order in (0, 1) for order in orders))
+
+
+def _fast_affine_grid(tile_shape, augment_params, order=0):
+    '''
+    Returns sampling grid and xy margin of the fetched region for
+    rotation and shear of a tile in fast affine mode.
+
+    The region is the tile grown by the margin on each side, which is
+    the smallest region centered at the tile that contains all sampled
+    pixels (also after flipping and rot90, which are applied to the
+    region before sampling).
+
+    Parameters
+    ----------
+    tile_shape : array_like
+        Tile size (before rot90), xy in last two dimensions.
+    augment_params : dict
+        Augmentation settings, see _augment_tile.
+    order : int
+        Interpolation order (0 or 1).
+
+    Returns
+    -------
+    grid : numpy.ndarray
+        Source coordinates (2, nr_x, nr_y) in the flipped region.
+    margin : numpy.ndarray
+        Margin (x, y) of the fetched region.
+    '''
+    shape_xy = np.array(tile_shape[-2:])
+    swap_xy = augment_params.get('rot90', 0) % 2 == 1
+    if swap_xy:
+        shape_xy = shape_xy[::-1]
+
+    grid = trafo.affine_sampling_grid(tuple(int(s) for s in shape_xy),
+                                      augment_params.get('rotation_angle', 0),
+                                      augment_params.get('shear_angle', 0))
+    lo, hi = trafo.affine_support(grid, order=order)
+    margin_flipped = np.maximum(np.maximum(-lo, hi - shape_xy), 0)
+
+    grid = grid + margin_flipped[:, np.newaxis, np.newaxis]
+    margin = margin_flipped[::-1] if swap_xy else margin_flipped
+    return grid, margin
+
+
+def _augment_stack(img_shape_zxy,
+                   pos_zxy,
+                   tile_shape_zxy,
+                   get_tile_funcs,
+                   augment_params=None,
+                   orders=None):
+    '''
+    Fetches several stacks of the same zxy region and augments them
+    together (same as _augment_tile, but bounds, padding, flipping and
+    warping are computed once for all stacks).
+
+    Parameters
+    ----------
+    img_shape_zxy : (nr_zslices, nr_x, nr_y)
+        Image size.
+    pos_zxy : (z, x, y)
+        Upper left position of the tile.
+    tile_shape_zxy : (nr_zslices, nr_x, nr_y)
+        Tile size.
+    get_tile_funcs : list of functions
+        Functions f(pos, size) returning stacks of dimension nzxy.
+    augment_params : dict
+        Augmentation settings, see _augment_tile.
+    orders : list of int, optional
+        Interpolation order of each stack for rotation and shear
+        (nearest neighbour by default).
+
+    Returns
+    -------
+    list of numpy.ndarray
+        Augmented stacks (with data types of fetched stacks).
+    '''
+    augment_params = augment_params or {}
+    rotation_angle = augment_params.get('rotation_angle', 0)
+    shear_angle = augment_params.get('shear_angle', 0)
+    orders = orders or [0] * len(get_tile_funcs)
+
+    pos = np.array(pos_zxy)
+    orig_tile_shape = np.array(tile_shape_zxy)
+    tile_shape = np.array(tile_shape_zxy)
+
+    augment_fast = (tile_shape[-2:] > 1).any()
+    augment_slow = augment_fast and (rotation_angle > 0 or shear_angle > 0)
+    fast_affine = augment_slow and _use_fast_affine(
+        augment_params, orig_tile_shape, orders)
+
+    if fast_affine:
+        grid, margin = _fast_affine_grid(orig_tile_shape, augment_params,
+                                         order=max(orders))
+        pos[-2:] -= margin
+        tile_shape[-2:] += 2 * margin
+    elif augment_slow:
+        pos -= tile_shape
+        tile_shape *= 3
+
+    res = inner_tile_size(np.array(img_shape_zxy), pos, tile_shape)
+    pos_transient, size_transient, pos_inside_transient, pad_size = res
+
+    stacks = [f(pos_transient, size_transient) for f in get_tile_funcs]
+    dtypes = [s.dtype for s in stacks]
+    splits = np.cumsum([len(s) for s in stacks])[:-1]
+    tile = stacks[0] if len(stacks) == 1 else np.concatenate(stacks)
+
+    if np.any(pad_size):
+        tile = np.pad(tile, ((0, 0),) + tuple(pad_size), mode='symmetric')
+    mesh = ut.get_tile_meshgrid(tile.shape, (0,) + pos_inside_transient,
+                                (len(tile),) + tuple(tile_shape))
+    tile = tile[tuple(mesh)]
+
+    if augment_fast:
+        rot90 = augment_params.get('rot90', 0)
+        flipud = augment_params.get('flipud', False)
+        fliplr = augment_params.get('fliplr', False)
+
+        tile = trafo.flip_image_2d_stack(tile, fliplr=fliplr,
+                                         flipud=flipud, rot90=rot90)
+
+    stacks = np.split(tile, splits)
+    if fast_affine:
+        stacks = [trafo.affine_gather(s, grid, order=order)
+                  for s, order in zip(stacks, orders)]
+    elif augment_slow:
+        # stacks with equal interpolation order are warped together
+        for order in set(orders):
+            idx = [i for i, o in enumerate(orders) if o == order]
+            warped = trafo.warp_image_2d_stack(
+                np.concatenate([stacks[i] for i in idx]),
+                rotation_angle, shear_angle, order=order)
+            for i, s in zip(idx, np.split(
+                    warped, np.cumsum([len(stacks[i]) for i in idx])[:-1])):
+                stacks[i] = s
+
+        # same crop as _augment_tile
+        crop = tuple(slice(s, 2 * s) for s in orig_tile_shape)
+        stacks = [s[(slice(None),) + crop] for s in stacks]
+
+    return [s.astype(dtype, copy=False) for s, dtype in zip(stacks, dtypes)]
+
+
 def _augment_tile(img_shape,
                   pos,
                   tile_shape,
                   get_tile_func,
                   augment_params=None,
+                  order=0,
                   **kwargs):
     '''
     fetch tile and augment it
     if rotation and shear is activated, a 3 times larger tile
     is fetched and the final tile is cut out from that after
     rotation/shear.
+    if augment_params['fast_affine'] is True, only the region needed
+    for rotation/shear is fetched and sampled at once for all slices
+    (see _fast_affine_grid).
+    order is the interpolation order for rotation/shear.
     '''
     augment_params = augment_params or {}
     rotation_angle = augment_params.get('rotation_angle', 0)
@@ -686,8 +1203,15 @@ def _augment_tile(img_shape,
 
     augment_fast = (tile_shape[-2:] > 1).any()
     augment_slow = augment_fast and (rotation_angle > 0 or shear_angle > 0)
-
-    if augment_slow:
+    fast_affine = augment_slow and _use_fast_affine(
+        augment_params, orig_tile_shape, (order,))
+
+    if fast_affine:
+        grid, margin = _fast_affine_grid(orig_tile_shape, augment_params,
+                                         order=order)
+        pos[-2:] -= margin
+        tile_shape[-2:] += 2 * margin
+    elif augment_slow:
         pos -= tile_shape
         tile_shape *= 3
 
@@ -696,7 +1220,8 @@ def _augment_tile(img_shape,
 
     tile = get_tile_func(pos=pos_transient, size=size_transient, **kwargs)
 
-    tile = np.pad(tile, pad_size, mode='symmetric')
+    if np.any(pad_size):
+        tile = np.pad(tile, pad_size, mode='symmetric')
     mesh = ut.get_tile_meshgrid(tile.shape, pos_inside_transient, tile_shape)
     tile = tile[tuple(mesh)]
 
@@ -711,8 +1236,11 @@ def _augment_tile(img_shape,
         tile = trafo.flip_image_2d_stack(tile, fliplr=fliplr,
                                          flipud=flipud, rot90=rot90)
 
-    if augment_slow:
-        tile = trafo.warp_image_2d_stack(tile, rotation_angle, shear_angle)
+    if fast_affine:
+        tile = trafo.affine_gather(tile, grid, order=order)
+    elif augment_slow:
+        tile = trafo.warp_image_2d_stack(tile, rotation_angle, shear_angle,
+                                         order=order)
         mesh = ut.get_tile_meshgrid(tile.shape, orig_tile_shape,
                                     orig_tile_shape)
         tile = tile[tuple(mesh)]
@@ -1,10 +1,12 @@
-from itertools import zip_longest
 import os
 import logging
+from importlib import metadata
 from functools import lru_cache
 import numpy as np
+import yapic_io.utils as ut
 import pyilastik
 from yapic_io.tiff_connector import TiffConnector
+from yapic_io.coordinate_connector import CoordinateConnector
 from pathlib import Path
 import collections
 
@@ -12,7 +14,183 @@ FilePair = collections.namedtuple('FilePair', ['img', 'lbl'])
 logger = logging.getLogger(os.path.basename(__file__))
 
 
-class IlastikConnector(TiffConnector):
+def read_label_blocks(ilp, item):
+    '''
+    Reads all label blocks of an image in an Ilastik project.
+
+    pyilastik has no public API for single label blocks. This function
+    is the only place where pyilastik internals are used (tested with
+    pyilastik 0.0.9).
+
+    Parameters
+    ----------
+    ilp : pyilastik project
+        Project opened with pyilastik.read_project().
+    item : int
+        Index of the image in the project.
+
+    Returns
+    -------
+    numpy.ndarray, list of numpy.ndarray
+        Block bounds with shape (n, 3, 2) in dimension order zyx and
+        block data with dimension order zyx.
+    '''
+    try:
+        from pyilastik.ilastik_storage_version_01 import normalize_dim_order
+        get_block_slices = getattr(ilp, '_get_block_slices')
+    except (ImportError, AttributeError) as e:
+        try:
+            installed = metadata.version('pyilastik')
+        except metadata.PackageNotFoundError:
+            installed = 'unknown'
+        raise ImportError('Reading label blocks of Ilastik projects is not '
+                          'supported by the installed pyilastik version {} '
+                          '(tested with 0.0.9): {}'.format(installed, e))
+
+    slices = get_block_slices(item)
+
+    if slices.size == 0:  # no labels in image
+        return np.zeros((0, 3, 2), dtype=int), []
+
+    # block slices and data to dimension order zyx(c)
+    dim_order = ilp.original_dimension_order()
+    slices = slices[:, list(normalize_dim_order(dim_order)), :]
+    blocks = [normalize_dim_order(dim_order,
+                                  data=ilp.load_block_data(item, i))
+              for i in range(len(slices))]
+    if slices.shape[1] == 3:  # 2d images: add z axis
+        slices = np.concatenate(
+            [np.tile([[[0, 1]]], (len(slices), 1, 1)), slices], axis=1)
+        blocks = [b[np.newaxis] for b in blocks]
+
+    # drop channel axis (always one label channel)
+    return slices[:, :3, :], [b[..., 0] for b in blocks]
+
+
+class LabelBlockIndex(object):
+    '''
+    Index of the label blocks of one image in an Ilastik project.
+
+    Ilastik stores labels as dense blocks covering the labeled regions.
+    Blocks without labels are dropped, for all other blocks the bounding
+    box and label counts are kept, such that label values and counts are
+    known without decoding blocks again and tiles are assembled only from
+    blocks intersecting the tile. Coordinates of all voxels of a label
+    are collected (once) in a compact coordinate table.
+
+    Parameters
+    ----------
+    bounds : array_like
+        Block bounding boxes of shape (n_blocks, 3, 2): (start, stop) for
+        z, y and x.
+    blocks : list of numpy.ndarray
+        Label data of each block in dimension order (z, y, x).
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.ilastik_connector import LabelBlockIndex
+    >>> block = np.array([[[0, 1], [2, 2]]])
+    >>> index = LabelBlockIndex([[[0, 1], [2, 4], [3, 5]]], [block])
+    >>> index.label_histogram()
+    [{1: 1, 2: 2}]
+    >>> index.tile((0, 1, 2), (1, 4, 5))
+    array([[[0, 0, 0],
+            [0, 0, 1],
+            [0, 2, 2]]])
+    >>> index.coordinates(2)
+    array([[0, 3, 3],
+           [0, 3, 4]], dtype=uint8)
+    '''
+
+    def __init__(self, bounds, blocks):
+        self.bounds = np.zeros((0, 3, 2), dtype=np.int64)
+        self.blocks = []
+        self.counts = []
+
+        for block_bounds, block in zip(bounds, blocks):
+            values, counts = ut._value_counts(block)
+            counts = {v: n for v, n in zip(values.tolist(), counts.tolist())
+                      if v != 0}
+            if not counts:
+                continue  # block without labels
+            self.bounds = np.vstack([self.bounds, [block_bounds]])
+            self.blocks.append(block)
+            self.counts.append(counts)
+
+        self.dtype = np.result_type(np.uint8, *self.blocks)
+        self._coordinates = {}
+
+    def __repr__(self):
+        return 'LabelBlockIndex ({} blocks)'.format(len(self.blocks))
+
+    def label_histogram(self):
+        '''
+        Same as yapic_io.utils.label_histogram() (one label channel).
+        '''
+        counts = collections.Counter()
+        for block_counts in self.counts:
+            counts.update(block_counts)
+        return [dict(sorted(counts.items()))]
+
+    def coordinates(self, label_value):
+        '''
+        Returns zyx coordinates of all voxels with label_value as array of
+        shape (n, 3), ordered by block. The smallest unsigned integer type
+        holding all coordinates is used.
+        '''
+        coords = self._coordinates.get(label_value)
+        if coords is not None:
+            return coords
+
+        max_coord = int(self.bounds.max()) if len(self.blocks) else 0
+        dtype = np.min_scalar_type(max_coord)
+        coords = [np.zeros((0, 3), dtype=dtype)]
+        for block_bounds, block, counts in zip(self.bounds, self.blocks,
+                                                self.counts):
+            if label_value not in counts:
+                continue
+            block_coords = np.argwhere(block == label_value)
+            coords.append((block_coords + block_bounds[:, 0]).astype(dtype))
+        coords = np.concatenate(coords)
+
+        self._coordinates[label_value] = coords
+        return coords
+
+    def blocks_in_tile(self, start_zyx, stop_zyx):
+        '''
+        Returns indices of blocks intersecting the region
+        [start_zyx, stop_zyx).
+        '''
+        return np.flatnonzero(
+            np.all((self.bounds[:, :, 0] < stop_zyx) &
+                   (self.bounds[:, :, 1] > start_zyx), axis=1))
+
+    def tile(self, start_zyx, stop_zyx):
+        '''
+        Returns label values in region [start_zyx, stop_zyx) in dimension
+        order (z, y, x).
+        '''
+        start_zyx = np.array(start_zyx)
+        stop_zyx = np.array(stop_zyx)
+        tile = np.zeros(stop_zyx - start_zyx, dtype=self.dtype)
+
+        for i in self.blocks_in_tile(start_zyx, stop_zyx):
+            lo = np.maximum(self.bounds[i, :, 0], start_zyx)
+            hi = np.minimum(self.bounds[i, :, 1], stop_zyx)
+            src = tuple(slice(a, b) for a, b
+                        in zip(lo - self.bounds[i, :, 0],
+                               hi - self.bounds[i, :, 0]))
+            dst = tuple(slice(a, b) for a, b
+                        in zip(lo - start_zyx, hi - start_zyx))
+            block = self.blocks[i][src]
+            labeled = block > 0
+            tile[dst][labeled] = block[labeled]
+
+        return tile
+
+
+class IlastikConnector(TiffConnector, CoordinateConnector):
     '''
     Implementation of Connector for tiff images up to 4 dimensions and
     corresponding Ilastik_ project file. The Ilastik_ Project file
@@ -45,6 +223,10 @@ class IlastikConnector(TiffConnector):
 
     Files from Ilastik v1.2 and v1.3 are supported (storage version 0.1).
 
+    Ilastik stores labels as sparse blocks, thus label coordinates are
+    indexed (see label_index_to_coordinate()) and training tiles are
+    fetched by label coordinate instead of random polling.
+
     Examples
     --------
     >>> from yapic_io.ilastik_connector import IlastikConnector
@@ -75,9 +257,27 @@ class IlastikConnector(TiffConnector):
         label_path = label_filepath
         self.ilp = pyilastik.read_project(label_filepath, skip_image=True)
         lbl_filenames = self.ilp.image_path_list()
+        # label block index per label filename (shared by views)
+        self._block_indices = {}
 
         return label_path, lbl_filenames
 
+    def _label_block_index(self, image_nr):
+        '''
+        Returns the LabelBlockIndex of an image. Label blocks are read
+        from the project and indexed only once.
+        '''
+        label_filename = Path(self.filenames[image_nr].lbl).as_posix()
+        index = self._block_indices.get(label_filename)
+        if index is not None:
+            return index
+
+        item = self.ilp.image_path_list().index(label_filename)
+        index = LabelBlockIndex(*read_label_blocks(self.ilp, item))
+
+        self._block_indices[label_filename] = index
+        return index
+
     def __repr__(self):
         infostring = \
             'IlastikConnector object\n' \
@@ -112,47 +312,10 @@ class IlastikConnector(TiffConnector):
         IlastikConnector
             Connector object containing only images with labels.
         '''
-        pairs = [self.filenames[i]for i in range(
-            self.image_count()) if self.label_count_for_image(i)]
-
-        tiff_sel = [self.img_path / pair.img for pair in pairs]
-
-        return IlastikConnector(tiff_sel, self.label_path,
-                                savepath=self.savepath)
-
-    def split(self, fraction, random_seed=42):
-        '''
-        Split the images pseudo-randomly into two Connector subsets.
-
-        The first of size `(1-fraction)*N_images`, the other of size
-        `fraction*N_images`
-
-        Parameters
-        ----------
-        fraction : float
-        random_seed : float, optional
-
-        Returns
-        -------
-        connector_1, connector_2
-        '''
-
-        img_fnames1, img_fnames2, mask = self._split_img_fnames(
-            fraction, random_seed=random_seed)
-
-        conn1 = IlastikConnector(img_fnames1, self.label_path,
-                                 savepath=self.savepath)
-        conn2 = IlastikConnector(img_fnames2, self.label_path,
-                                 savepath=self.savepath)
+        image_nrs = [i for i in range(self.image_count())
+                     if self.label_count_for_image(i)]
+        return self._view(image_nrs)
 
-        # ensures that both resulting connectors have the same
-        # labelvalue mapping (issue #1)
-        conn1.labelvalue_mapping = self.labelvalue_mapping
-        conn2.labelvalue_mapping = self.labelvalue_mapping
-
-        return conn1, conn2
-
-    @lru_cache(maxsize=20)
     def label_tile(self, image_nr, pos_zxy, size_zxy, label_value):
         '''
         Get 3d zxy boolean matrix where positions of the requested label
@@ -175,29 +338,57 @@ class IlastikConnector(TiffConnector):
             3D subsection of labelmatrix as boolean mask in dimension order
             (z, x, y)
         '''
+        C, original_label_value = self._mapped_label_value_to_original(
+                                         label_value)
+        tile = self.label_value_tile(image_nr, pos_zxy, size_zxy, C)
+        return tile == original_label_value
 
-        slices = np.array([[pos_zxy[0], pos_zxy[0] + size_zxy[0]],  # z
-                           [pos_zxy[2], pos_zxy[2] + size_zxy[2]],  # y
-                           [pos_zxy[1], pos_zxy[1] + size_zxy[1]],  # x
-                           [0, 1]])  # c
+    def label_value_tile(self, image_nr, pos_zxy, size_zxy, channel=0):
+        '''
+        Get 3d zxy matrix of original label values (see
+        TiffConnector.label_value_tile). Ilastik projects have one label
+        channel.
+        '''
+        Z, X, Y = pos_zxy
+        ZZ, XX, YY = np.array(pos_zxy) + size_zxy
 
-        if self.ilp.n_dims(image_nr) == 0:  # no labels in image
-            return np.zeros(size_zxy) > 0
+        # only label blocks intersecting the tile are read
+        lbl = self._label_block_index(image_nr).tile((Z, Y, X),
+                                                     (ZZ, YY, XX))
+        # zyx to zxy
+        return np.moveaxis(lbl, (0, 1, 2), (0, 2, 1))
 
-        elif self.ilp.n_dims(image_nr) == 4:  # z-stacks
-            lbl = self.ilp.tile(image_nr, slices)
+    def has_label_coordinates(self):
+        return True
 
-        elif self.ilp.n_dims(image_nr) == 3:  # 2d images
-            lbl = self.ilp.tile(image_nr, slices[1:, :])
-            lbl = np.expand_dims(lbl, axis=0)  # add z axis
+    def label_index_to_coordinate(self, image_nr, label_value, label_index):
+        '''
+        Get image coordinate for specific label.
 
-        # zyxc to czxy
-        lbl = np.transpose(lbl, (3, 0, 2, 1)).astype(int)
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+        label_value : int
+            Id of the label (mapped label value).
+        label_index: int
+            Value between 0 and count[label_value].
+            Label count can be retrieved with self.label_count_for_image
+            method.
+
+        Returns
+        -------
+        ndarray
+            czxy coordinate of a specific label (specified by the
+            label index) with labelvalue label_value (mapped label value).
+        '''
         C, original_label_value = self._mapped_label_value_to_original(
                                          label_value)
-        lbl = (lbl == original_label_value)
+        coords = self._label_block_index(image_nr).coordinates(
+                     original_label_value)
+        z, y, x = coords[label_index]
 
-        return lbl[0, :, :, :]
+        return np.array([C, z, x, y])
 
     def check_label_matrix_dimensions(self):
         '''
@@ -209,73 +400,14 @@ class IlastikConnector(TiffConnector):
         '''
         return True
 
-    @lru_cache(maxsize=1)
-    def original_label_values_for_all_images(self):
-        '''
-        Get all unique label values per image.
-
-        Returns
-        -------
-        list
-            List of sets. Each set corresponds to 1 label channel.
-            each set contains the label values of that channel.
-            E.g. `[{91, 109, 150}, {90, 100}]` for two label channels
-        '''
-        labels_per_channel = []
-
-        for image_nr in range(self.image_count()):
-            label_filename = str(self.filenames[image_nr].lbl)
-
-            if label_filename is None:
-                msg = 'No label matrix file found for image file #{}.'
-                logger.warning(msg.format(image_nr))
-                return None
-
-            _, (img, lbl, _) = self.ilp[Path(label_filename).as_posix()]
-            lbl = np.transpose(lbl, (3, 0, 2, 1)).astype(int)
-
-            C = lbl.shape[0]
-            labels = [np.unique(lbl[c, ...]) for c in range(C)]
-            labels = [set(labels) - {0} for labels in labels]
-
-            labels_per_channel = [l1.union(l2)
-                                  for l1, l2 in zip_longest(labels_per_channel,
-                                                            labels,
-                                                            fillvalue=set())]
-
-        return labels_per_channel
-
     @lru_cache(maxsize=1500)
-    def label_count_for_image(self, image_nr):
+    def _original_label_count_for_image(self, image_nr):
         '''
-        Get number of labels per labelvalue for an image.
-
-        Parameters
-        ----------
-        image_nr : int
-            index of image
-
-        Returns
-        -------
-        dict
+        Returns for each label channel a dict with original label values
+        as keys and label counts as values.
         '''
-        label_filename = str(self.filenames[image_nr].lbl)
-
+        label_filename = self.filenames[image_nr].lbl
         if label_filename is None:
-            msg = 'No label matrix file found for image file #{}.'
-            logger.warning(msg.format(image_nr))
             return None
 
-        _, (img, lbl, _) = self.ilp[Path(label_filename).as_posix()]
-        lbl = np.transpose(lbl, (3, 0, 2, 1)).astype(int)
-
-        C = lbl.shape[0]
-        labels = [np.unique(lbl[c, ...]) for c in range(C)]
-
-        original_label_count = [{l: np.count_nonzero(lbl[c, ...] == l)
-                                 for l in labels[c] if l > 0}
-                                for c in range(C)]
-        label_count = {self.labelvalue_mapping[c][l]: count
-                       for c, orig in enumerate(original_label_count)
-                       for l, count in orig.items()}
-        return label_count
+        return self._label_block_index(image_nr).label_histogram()
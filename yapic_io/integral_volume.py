@@ -0,0 +1,131 @@
+'''
+Summed-area tables (integral volumes) for counting labels in tiles in
+constant time.
+'''
+import numpy as np
+
+
+class IntegralVolume(object):
+    '''
+    Summed-area table of a 3D count volume with dimension order (z, x, y),
+    optionally at reduced resolution.
+
+    The number of counted voxels in any box is computed from 8 table
+    entries, independent of the box size. At reduced resolution, voxels
+    are counted in bins of `bin_zxy` voxels, and boxes are grown to bin
+    boundaries. Counts are then upper bounds: a count of 0 still
+    guarantees that the box contains no counted voxel.
+
+    Parameters
+    ----------
+    binned_counts : numpy.ndarray
+        Counts per bin, dimension order (z, x, y).
+    shape_zxy : (nr_zslices, nr_x, nr_y)
+        Size of the full resolution volume.
+    bin_zxy : (z, x, y), optional
+        Bin size in voxels.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.integral_volume import IntegralVolume
+    >>> mask = np.zeros((1, 4, 6), dtype=bool)
+    >>> mask[0, 1:3, 2] = True
+    >>> iv = IntegralVolume.from_mask(mask)
+    >>> iv.count((0, 0, 0), (1, 2, 3)), iv.count((0, 2, 3), (1, 2, 3))
+    (1, 0)
+    >>> iv.count([[0, 0, 1], [0, 1, 2], [0, 2, 3]], (1, 2, 2))
+    array([1, 2, 0])
+    >>> iv2 = IntegralVolume.from_mask(mask, bin_zxy=(1, 2, 2))
+    >>> iv2.count((0, 2, 3), (1, 2, 3))  # upper bound
+    1
+    '''
+
+    def __init__(self, binned_counts, shape_zxy, bin_zxy=(1, 1, 1)):
+        binned_counts = np.asarray(binned_counts)
+        self.shape_zxy = tuple(int(s) for s in shape_zxy)
+        self.bin_zxy = np.array(bin_zxy, dtype=np.int64)
+        np.testing.assert_array_equal(
+            binned_counts.shape, -(-np.array(self.shape_zxy) // self.bin_zxy))
+
+        total = int(binned_counts.sum())
+        dtype = np.int32 if total < 2**31 else np.int64
+        table = np.zeros(np.array(binned_counts.shape) + 1, dtype=dtype)
+        table[1:, 1:, 1:] = binned_counts.cumsum(0, dtype=dtype)\
+                                         .cumsum(1).cumsum(2)
+        self.table = table
+
+    def __repr__(self):
+        return 'IntegralVolume (shape {}, bins {}, {} counts)'.format(
+            self.shape_zxy, tuple(self.bin_zxy), self.total)
+
+    @property
+    def total(self):
+        return int(self.table[-1, -1, -1])
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+    @classmethod
+    def from_mask(cls, mask, bin_zxy=(1, 1, 1)):
+        '''
+        Counts True values of a boolean (z, x, y) array.
+        '''
+        return cls(bin_counts(mask, bin_zxy), mask.shape, bin_zxy)
+
+    def count(self, pos_zxy, size_zxy):
+        '''
+        Returns the number of counted voxels in the box
+        [pos_zxy, pos_zxy + size_zxy). Boxes may exceed the volume.
+
+        Parameters
+        ----------
+        pos_zxy : array_like
+            Box position (z, x, y) or array of positions of shape (n, 3).
+        size_zxy : (nr_zslices, nr_x, nr_y)
+            Box size.
+
+        Returns
+        -------
+        int or numpy.ndarray
+            Count for one position or array of counts for n positions.
+        '''
+        pos_zxy = np.asarray(pos_zxy, dtype=np.int64)
+        grid_shape = np.array(self.table.shape) - 1
+
+        lo = np.clip(pos_zxy // self.bin_zxy, 0, grid_shape)
+        hi = np.clip(-(-(pos_zxy + size_zxy) // self.bin_zxy), 0, grid_shape)
+        hi = np.maximum(hi, lo)
+
+        lo, hi = lo.T, hi.T
+        t = self.table
+        count = (t[hi[0], hi[1], hi[2]]
+                 - t[lo[0], hi[1], hi[2]]
+                 - t[hi[0], lo[1], hi[2]]
+                 - t[hi[0], hi[1], lo[2]]
+                 + t[lo[0], lo[1], hi[2]]
+                 + t[lo[0], hi[1], lo[2]]
+                 + t[hi[0], lo[1], lo[2]]
+                 - t[lo[0], lo[1], lo[2]])
+
+        if pos_zxy.ndim == 1:
+            return int(count)
+        return count.astype(np.int64)
+
+
+def bin_counts(mask, bin_zxy):
+    '''
+    Counts True values of a boolean (z, x, y) array in bins of size
+    bin_zxy. Incomplete bins at the upper borders are counted as well.
+    '''
+    bin_zxy = np.array(bin_zxy)
+    if (bin_zxy == 1).all():
+        return mask.astype(np.uint32)
+
+    n_bins = -(-np.array(mask.shape) // bin_zxy)
+    pad = [(0, p) for p in n_bins * bin_zxy - mask.shape]
+    mask = np.pad(mask, pad)
+
+    shape = [x for n, b in zip(n_bins, bin_zxy) for x in (n, b)]
+    return mask.reshape(shape).sum(axis=(1, 3, 5), dtype=np.uint32)
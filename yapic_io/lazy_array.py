@@ -0,0 +1,436 @@
+'''
+Lazy array types for image sources that can not (or should not) be loaded
+or memory mapped as a whole, e.g. chunked or compressed storage.
+'''
+import itertools
+import numbers
+import numpy as np
+
+ZYXC = 'ZYXC'
+
+
+def _expand_key(key, ndim):
+    '''
+    Normalizes a numpy style basic indexing key to a list of ndim elements
+    (slices or integers).
+    '''
+    if not isinstance(key, tuple):
+        key = (key,)
+
+    n_ellipsis = sum(k is Ellipsis for k in key)
+    if n_ellipsis > 1:
+        raise IndexError('an index can only have a single ellipsis')
+
+    if n_ellipsis == 1:
+        i = [k is Ellipsis for k in key].index(True)
+        fill = (slice(None),) * (ndim - len(key) + 1)
+        key = key[:i] + fill + key[i + 1:]
+
+    if len(key) > ndim:
+        raise IndexError('too many indices for array')
+
+    key = list(key) + [slice(None)] * (ndim - len(key))
+    for k in key:
+        if not isinstance(k, (slice, numbers.Integral)):
+            msg = 'only integers and slices are supported, got {}'
+            raise IndexError(msg.format(type(k)))
+    return key
+
+
+class ZYXCView(object):
+    '''
+    Read-only view on an array-like object that presents its data in
+    dimension order (z, y, x, c) without loading it.
+
+    Only the region requested by slicing is read from the underlying array.
+    For chunked storage (zarr, n5, hdf5) this means that only chunks
+    overlapping the requested region are decoded.
+
+    Parameters
+    ----------
+    array : array_like
+        Object with ``shape``, ``dtype`` and numpy style basic slicing,
+        e.g. a ``zarr.Array`` or a ``h5py.Dataset``.
+    axes : str
+        Dimension order of ``array``, e.g. ``'CZYX'``. Letters Y and X are
+        required, Z and C are optional and added as dimensions of size 1
+        if missing. Any other axis (e.g. T) must be of size 1 and is dropped.
+    '''
+
+    def __init__(self, array, axes):
+        axes = axes.upper()
+        msg = 'axes {} do not fit array of shape {}'.format(axes, array.shape)
+        assert len(axes) == len(array.shape), msg
+        assert len(set(axes)) == len(axes), msg
+        assert 'Y' in axes and 'X' in axes, msg
+        for a, length in zip(axes, array.shape):
+            assert a in ZYXC or length == 1, msg
+
+        self.array = array
+        self.axes = axes
+        self.dtype = np.dtype(array.dtype)
+
+    @property
+    def shape(self):
+        return tuple(self.array.shape[self.axes.index(a)]
+                     if a in self.axes else 1 for a in ZYXC)
+
+    @property
+    def chunks(self):
+        '''
+        Chunk shape in (z, y, x, c) order or None if the underlying array
+        is not chunked.
+        '''
+        chunks = getattr(self.array, 'chunks', None)
+        if chunks is None:
+            return None
+        return tuple(chunks[self.axes.index(a)]
+                     if a in self.axes else 1 for a in ZYXC)
+
+    @property
+    def ndim(self):
+        return 4
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+    def __getitem__(self, key):
+        key = _expand_key(key, 4)
+
+        native_key = tuple(key[ZYXC.index(a)] if a in ZYXC else 0
+                           for a in self.axes)
+        data = np.asarray(self.array[native_key])
+        current = [a for a in self.axes if a in ZYXC and
+                   not isinstance(key[ZYXC.index(a)], numbers.Integral)]
+
+        for a in ZYXC:
+            if a in self.axes:
+                continue
+            k = key[ZYXC.index(a)]
+            if isinstance(k, numbers.Integral):
+                if k not in (0, -1):
+                    msg = 'index {} is out of bounds for axis {} with size 1'
+                    raise IndexError(msg.format(k, a))
+                continue
+            data = np.expand_dims(data, axis=-1)[..., k]
+            current.append(a)
+
+        order = [current.index(a) for a in ZYXC if a in current]
+        return np.transpose(data, order)
+
+
+def _bounds(key, shape):
+    '''
+    Returns the bounding (start, stop) range of a key per dimension and
+    per dimension the indices to pick the requested elements from the
+    bounding box (None if all elements are requested).
+    '''
+    bounds = []
+    picks = []
+    for k, length in zip(key, shape):
+        if isinstance(k, numbers.Integral):
+            i = k + length if k < 0 else k
+            if not 0 <= i < length:
+                msg = 'index {} is out of bounds for axis with size {}'
+                raise IndexError(msg.format(k, length))
+            bounds.append((i, i + 1))
+            picks.append(0)
+            continue
+
+        r = range(*k.indices(length))
+        if len(r) == 0:
+            bounds.append((0, 0))
+            picks.append(None)
+        elif r.step == 1:
+            bounds.append((r.start, r.stop))
+            picks.append(None)
+        else:
+            lo = min(r[0], r[-1])
+            bounds.append((lo, max(r[0], r[-1]) + 1))
+            picks.append(np.array(r) - lo)
+    return bounds, picks
+
+
+def _pick(data, picks):
+    for axis in reversed(range(len(picks))):
+        if picks[axis] is not None:
+            data = np.take(data, picks[axis], axis=axis)
+    return data
+
+
+class TiffSegmentArray(object):
+    '''
+    Lazy array for the first image series of a tiff file. Only strips or
+    tiles (segments) overlapping a requested region are read and decoded.
+
+    Supports compressed (e.g. LZW, Deflate, ZSTD) as well as tiled tiffs,
+    which can not be memory mapped. Decoded segments are stored in a
+    byte-budgeted LRU cache, such that neighboring tiles do not have to
+    be decoded again.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path to tiff file.
+    cache : yapic_io.cache.LRUByteCache, optional
+        Cache for decoded segments.
+
+    Notes
+    -----
+    Shape and axes correspond to the (squeezed) shape and axes of the
+    tiff series as reported by tifffile, e.g. ``'ZYXS'`` for RGB z-stacks.
+    '''
+
+    def __init__(self, path, cache=None):
+        from tifffile import TiffFile
+
+        self.path = str(path)
+        self.cache = cache
+        self._tif = TiffFile(self.path)
+
+        series = self._tif.series[0]
+        self.shape = tuple(series.shape)
+        self.axes = series.axes
+        self.dtype = np.dtype(series.dtype)
+        self._pages = list(series.pages)
+        self._keyframe = series.keyframe
+
+        kf = self._keyframe
+        page_ndim = len(kf.shape)
+        self._n_leading = len(self.shape) - page_ndim
+        msg = ('Can not map tiff series of shape {} to pages of '
+               'shape {} in {}').format(self.shape, kf.shape, self.path)
+        if self._n_leading < 0 or \
+                tuple(self.shape[self._n_leading:]) != tuple(kf.shape) or \
+                int(np.prod(self.shape[:self._n_leading])) != len(self._pages):
+            self.close()
+            raise ValueError(msg)
+
+        # page axes in normalized segment space
+        # (separate sample, depth, length, width, contig sample)
+        separate = kf.planarconfig == 2
+        self._shaped_dims = [{'S': 0 if separate else 4,
+                              'Z': 1, 'Y': 2, 'X': 3}[a] for a in kf.axes]
+
+        S, D, H, W, _ = kf.shaped
+        if kf.is_tiled:
+            self._segment_shape = (kf.tiledepth, kf.tilelength, kf.tilewidth)
+        else:
+            rows = kf.rowsperstrip if 0 < kf.rowsperstrip < H else H
+            self._segment_shape = (1, rows, W)
+        td, th, tw = self._segment_shape
+        self._grid = (S, -(-D // td), -(-H // th), -(-W // tw))
+        if len(self._pages[0].dataoffsets) != int(np.prod(self._grid)):
+            self.close()
+            raise ValueError(msg)
+
+    def __repr__(self):
+        return 'TiffSegmentArray({}, shape={}, axes={})'.format(
+            self.path, self.shape, self.axes)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def chunks(self):
+        '''
+        Shape of one decoded segment in array dimensions.
+        '''
+        td, th, tw = self._segment_shape
+        seg = {0: 1, 1: td, 2: th, 3: tw}
+        page_chunks = [seg.get(d, self.shape[self._n_leading + i])
+                       for i, d in enumerate(self._shaped_dims)]
+        return (1,) * self._n_leading + tuple(page_chunks)
+
+    def close(self):
+        self._tif.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __array__(self, dtype=None):
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+    def __getitem__(self, key):
+        key = _expand_key(key, self.ndim)
+        bounds, picks = _bounds(key, self.shape)
+
+        out = np.zeros([b - a for a, b in bounds], dtype=self.dtype)
+        if out.size == 0:
+            return _pick(out, picks)
+
+        leading = bounds[:self._n_leading]
+        page_bounds = bounds[self._n_leading:]
+        leading_shape = self.shape[:self._n_leading]
+
+        for pos in itertools.product(*[range(a, b) for a, b in leading]):
+            page_nr = int(np.ravel_multi_index(pos, leading_shape)) \
+                if pos else 0
+            out_pos = tuple(p - a for p, (a, _) in zip(pos, leading))
+            out[out_pos] = self._read_page_region(page_nr, page_bounds)
+
+        return _pick(out, picks)
+
+    def _read_page_region(self, page_nr, page_bounds):
+        shaped_bounds = [(0, 1)] * 5
+        for d, b in zip(self._shaped_dims, page_bounds):
+            shaped_bounds[d] = b
+        (s0, s1), (d0, d1), (h0, h1), (w0, w1), (c0, c1) = shaped_bounds
+
+        region = np.zeros([b - a for a, b in shaped_bounds],
+                          dtype=self.dtype)
+        td, th, tw = self._segment_shape
+        _, nd, nh, nw = self._grid
+
+        for s in range(s0, s1):
+            for di in range(d0 // td, (d1 - 1) // td + 1):
+                for hi in range(h0 // th, (h1 - 1) // th + 1):
+                    for wi in range(w0 // tw, (w1 - 1) // tw + 1):
+                        index = ((s * nd + di) * nh + hi) * nw + wi
+                        seg = self._segment(page_nr, index)
+                        if seg is None:
+                            continue
+                        # segment origin in image
+                        d, h, w = di * td, hi * th, wi * tw
+                        za, zb = max(d0, d), min(d1, d + seg.shape[0])
+                        ya, yb = max(h0, h), min(h1, h + seg.shape[1])
+                        xa, xb = max(w0, w), min(w1, w + seg.shape[2])
+                        region[s - s0, za - d0:zb - d0, ya - h0:yb - h0,
+                               xa - w0:xb - w0, :] = \
+                            seg[za - d:zb - d, ya - h:yb - h,
+                                xa - w:xb - w, c0:c1]
+
+        return region.reshape([b - a for a, b in page_bounds])
+
+    def _segment(self, page_nr, index):
+        '''
+        Returns decoded segment of shape (depth, length, width, samples),
+        cropped to the image bounds.
+        '''
+        cache_key = (self.path, page_nr, index)
+        if self.cache is not None:
+            seg = self.cache.get(cache_key)
+            if seg is not None:
+                return seg
+
+        page = self._pages[page_nr]
+        kf = self._keyframe
+        offset = page.dataoffsets[index]
+        bytecount = page.databytecounts[index]
+        if bytecount == 0:
+            return None
+
+        fh = self._tif.filehandle
+        with fh.lock:
+            fh.seek(offset)
+            data = fh.read(bytecount)
+
+        seg, (_, d, h, w, _), shape = kf.decode(data, index,
+                                                jpegtables=kf.jpegtables)
+        if seg is None:
+            return None
+
+        _, D, H, W, _ = kf.shaped
+        seg = seg.reshape(shape)[:D - d, :H - h, :W - w]
+        if self.cache is not None:
+            self.cache.put(cache_key, seg)
+        return seg
+
+
+class ChannelStackArray(object):
+    '''
+    Lazy array in dimension order (z, y, x, c) combining images stored in
+    separate files (e.g. one file per channel) along the channel axis.
+
+    Slicing reads only the requested region of the requested channels.
+
+    Parameters
+    ----------
+    arrays : list of array_like
+        Arrays of shape (z, y, x, c) with equal z, y and x size, e.g.
+        memory maps or ZYXCView objects.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.lazy_array import ChannelStackArray
+    >>> a = ChannelStackArray([np.zeros((1, 4, 5, 1)), np.ones((1, 4, 5, 2))])
+    >>> a.shape
+    (1, 4, 5, 3)
+    >>> a[0, 1:3, 2, 1:]
+    array([[1., 1.],
+           [1., 1.]])
+    '''
+
+    def __init__(self, arrays):
+        assert len(arrays) > 0
+        zyx = set(tuple(a.shape[:3]) for a in arrays)
+        msg = 'z, y, x sizes of channel images differ: {}'.format(zyx)
+        assert len(zyx) == 1, msg
+
+        self.arrays = arrays
+        self.dtype = np.result_type(*[a.dtype for a in arrays])
+        # (array index, channel in array) for each channel
+        self._channels = [(i, c) for i, a in enumerate(arrays)
+                          for c in range(a.shape[3])]
+
+    def __repr__(self):
+        return 'ChannelStackArray(shape={}, {} arrays)'.format(
+            self.shape, len(self.arrays))
+
+    @property
+    def shape(self):
+        return tuple(self.arrays[0].shape[:3]) + (len(self._channels),)
+
+    @property
+    def ndim(self):
+        return 4
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+    def __getitem__(self, key):
+        key = _expand_key(key, 4)
+        zyx_key = tuple(key[:3])
+        c_key = key[3]
+
+        if isinstance(c_key, numbers.Integral):
+            i, c = self._channels[c_key]
+            return np.asarray(self.arrays[i][zyx_key + (c,)], self.dtype)
+
+        channels = self._channels[c_key]
+        if len(channels) == 0:
+            empty = self.arrays[0][zyx_key + (slice(0, 0),)]
+            return np.asarray(empty, self.dtype)
+        return np.stack([np.asarray(self.arrays[i][zyx_key + (c,)],
+                                    self.dtype)
+                         for i, c in channels], axis=-1)
@@ -1,10 +1,11 @@
 from yapic_io.tiff_connector import TiffConnector
+from yapic_io.lazy_array import ZYXCView, _expand_key, _bounds, _pick
 from pathlib import Path
 import numpy as np
+import yapic_io.utils as ut
 import collections
 import logging
 import os
-from itertools import zip_longest
 from functools import lru_cache
 import sparse
 import typing
@@ -37,10 +38,149 @@ def reconstruct_layer(layer_array: np.array, shape: tuple) -> np.array:
     return tmp_sparse.todense()
 
 
+class SparseLabelArray(object):
+    '''
+    Lazy label array in dimension order (z, y, x, c) for a sparse napari
+    label layer (COO list).
+
+    Coordinates are sorted by their linear index once per layer, so the
+    voxels of a region are found by binary search per z-slice. Only the
+    voxels inside a requested region are materialized, the dense label
+    volume is never built.
+
+    Parameters
+    ----------
+    layer_array : numpy.ndarray
+        Sparse layer data of shape (ndim + 1, n): coordinates in rows
+        0 to ndim - 1 and label values in the last row.
+    shape : tuple
+        Shape (y, x), (z, y, x) or (z, y, x, c) of the original layer
+        data.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.napari_connector import SparseLabelArray
+    >>> coo = np.array([[0, 1, 3],    # y
+    ...                 [2, 2, 0],    # x
+    ...                 [1, 2, 1]])   # label values
+    >>> a = SparseLabelArray(coo, (4, 5))
+    >>> a.shape
+    (1, 4, 5, 1)
+    >>> a[0, :2, 1:3, 0]
+    array([[0, 1],
+           [0, 2]])
+    >>> a.label_histogram()
+    [{1: 2, 2: 1}]
+    '''
+
+    def __init__(self, layer_array, shape):
+        layer_array = np.asarray(layer_array)
+        coords = layer_array[:-1].astype(np.int64)
+        values = layer_array[-1]
+        shape = tuple(int(n) for n in shape)
+        msg = 'sparse layer of shape {} not supported'.format(shape)
+        assert 2 <= len(shape) <= 4 and len(coords) == len(shape), msg
+
+        zeros = np.zeros((1, coords.shape[1]), np.int64)
+        if len(shape) == 2:  # add z dimension
+            coords, shape = np.vstack([zeros, coords]), (1,) + shape
+        if len(shape) == 3:  # add channel dimension
+            coords, shape = np.vstack([coords, zeros]), shape + (1,)
+
+        nonzero = values != 0
+        index = np.ravel_multi_index(tuple(coords[:, nonzero]), shape)
+        order = np.argsort(index, kind='stable')
+        self._index = index[order]
+        self._values = values[nonzero][order]
+        self.shape = shape
+        self.dtype = self._values.dtype
+
+    def __repr__(self):
+        return 'SparseLabelArray(shape={}, {} labeled voxels)'.format(
+            self.shape, len(self._values))
+
+    @property
+    def ndim(self):
+        return 4
+
+    def __array__(self, dtype=None):
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+    def __getitem__(self, key):
+        key = _expand_key(key, 4)
+        bounds, picks = _bounds(key, self.shape)
+        (z0, z1), (y0, y1), (x0, x1), (c0, c1) = bounds
+        _, Y, X, C = self.shape
+
+        out = np.zeros([b - a for a, b in bounds], dtype=self.dtype)
+        if out.size > 0:
+            for z in range(z0, z1):
+                # voxels of rows y0 to y1 of slice z
+                lo, hi = np.searchsorted(self._index,
+                                         [(z * Y + y0) * X * C,
+                                          (z * Y + y1) * X * C])
+                index = self._index[lo:hi]
+                y, x, c = (index // (X * C)) % Y, (index // C) % X, index % C
+                inside = (x >= x0) & (x < x1) & (c >= c0) & (c < c1)
+                out[z - z0, y[inside] - y0, x[inside] - x0, c[inside] - c0] = \
+                    self._values[lo:hi][inside]
+
+        return _pick(out, picks)
+
+    def label_histogram(self):
+        '''
+        Same as yapic_io.utils.label_histogram(), computed from the
+        sparse label values.
+        '''
+        C = self.shape[-1]
+        channels = self._index % C
+        histogram = []
+        for c in range(C):
+            values, counts = ut._value_counts(self._values[channels == c])
+            histogram.append({v: n for v, n
+                              in zip(values.tolist(), counts.tolist())
+                              if v != 0})
+        return histogram
+
+    def labeled_slices(self):
+        '''
+        Returns sorted indices of z-slices with labels.
+        '''
+        _, Y, X, C = self.shape
+        return np.unique(self._index // (Y * X * C)).tolist()
+
+
 class NapariConnector(TiffConnector):
-    def __init__(self, img_filepath, label_filepath, savepath=None):
+    '''
+    Implementation of Connector for labels (and optionally pixels) stored
+    in a Napari project HDF5 file.
+
+    Parameters
+    ----------
+    img_filepath : str, list of str or None
+        Path to pixel images in tiff format (see TiffConnector). If None,
+        pixel data is read from the image layers of the Napari project.
+        Only the HDF5 chunks overlapping a requested tile are read.
+    label_filepath : str
+        Path to Napari project (.h5).
+    savepath : str, optional
+        Directory to save pixel classification results as probability
+        images.
+    chunk_cache_bytes : int, optional
+        Size of the HDF5 chunk cache of each dataset of the project (default
+        of h5py if None). Decoded chunks are kept in the cache, such that
+        neighboring tiles do not decode them again.
+    '''
+    def __init__(self, img_filepath, label_filepath, savepath=None,
+                 chunk_cache_bytes=None):
         # Dictionary of list telling labeled slices (non-zero matrices)
         self.labeled_slices = dict()
+        self.h5 = NapariStorage(h5_path=label_filepath, max_dim=4,
+                                chunk_cache_bytes=chunk_cache_bytes)
+        # pixels are read from image layers of the project
+        self.h5_images = img_filepath is None
         super().__init__(img_filepath, label_filepath, savepath=savepath)
 
     def _assemble_filenames(self, pairs):
@@ -49,11 +189,29 @@ class NapariConnector(TiffConnector):
         print('filenames in napariconnector')
         print(self.filenames)
 
+    def _handle_img_filenames(self, img_filepath):
+        if self.h5_images:
+            return Path(self.h5.f.filename), self.h5.get_image_names()
+        return super()._handle_img_filenames(img_filepath)
+
     def _handle_lbl_filenames(self, label_filepath):
-        self.h5 = NapariStorage(h5_path=label_filepath, max_dim=4)
         lbl_filenames = self.h5.get_labels_names()
         return label_filepath, lbl_filenames
 
+    def _open_image_file(self, image_nr):
+        if not self.h5_images:
+            return super()._open_image_file(image_nr)
+
+        image_name = str(self.filenames[image_nr].img)
+        key = ('napari_image', str(self.img_path), image_name)
+        return self.handle_cache.get(
+            key, lambda: self.h5.get_image_array(image_name))
+
+    def _image_file_shape(self, image_nr):
+        if not self.h5_images:
+            return super()._image_file_shape(image_nr)
+        return self._open_image_file(image_nr).shape
+
     def __repr__(self):
         infostring = \
             'NapariConnector object\n' \
@@ -79,7 +237,24 @@ class NapariConnector(TiffConnector):
         label_value = new_list
         return label_value
 
+    def _view(self, image_nrs):
+        view = super()._view(image_nrs)
+        # labeled slices are stored per image index
+        view.labeled_slices = {new: self.labeled_slices[old]
+                               for new, old in enumerate(image_nrs)
+                               if old in self.labeled_slices}
+        return view
+
     def effective_slices(self):
+        '''
+        Returns a dict with image indices as keys and lists of labeled
+        z-slices as values (see NapariStorage.filled_slices).
+        '''
+        for image_nr, (_, label_filename) in enumerate(self.filenames):
+            if image_nr not in self.labeled_slices:
+                self.labeled_slices[image_nr] = [] \
+                    if label_filename is None else \
+                    self.h5.filled_slices('labels', label_filename)
         return self.labeled_slices
 
     def filter_labeled(self):
@@ -91,44 +266,9 @@ class NapariConnector(TiffConnector):
         NapariConnector
             Connector object containing only images with labels.
         '''
-        pairs = [self.filenames[i]for i in range(
-            self.image_count()) if self.label_count_for_image(i)]
-        tiff_sel = [self.img_path / pair.img for pair in pairs]
-
-        return NapariConnector(tiff_sel, self.label_path,
-                               savepath=self.savepath)
-
-    def split(self, fraction, random_seed=42):
-        '''
-        Split the images pseudo-randomly into two Connector subsets.
-
-        The first of size `(1-fraction)*N_images`, the other of size
-        `fraction*N_images`
-
-        Parameters
-        ----------
-        fraction : float
-        random_seed : float, optional
-
-        Returns
-        -------
-        connector_1, connector_2
-        '''
-
-        img_fnames1, img_fnames2, mask = self._split_img_fnames(
-            fraction, random_seed=random_seed)
-
-        conn1 = NapariConnector(img_fnames1, self.label_path,
-                                savepath=self.savepath)
-        conn2 = NapariConnector(img_fnames2, self.label_path,
-                                savepath=self.savepath)
-
-        # ensures that both resulting connectors have the same
-        # labelvalue mapping (issue #1)
-        conn1.labelvalue_mapping = self.labelvalue_mapping
-        conn2.labelvalue_mapping = self.labelvalue_mapping
-
-        return conn1, conn2
+        image_nrs = [i for i in range(self.image_count())
+                     if self.label_count_for_image(i)]
+        return self._view(image_nrs)
 
     def label_tile(self, image_nr, pos_zxy, size_zxy, label_value):
         Z, X, Y = pos_zxy
@@ -147,6 +287,12 @@ class NapariConnector(TiffConnector):
         return tile
 
     def _open_label_file(self, image_nr):
+        '''
+        Returns lazy label array with shape: z, y, x, c
+
+        Sparse label layers are indexed once (see SparseLabelArray),
+        dense layers are read from the HDF5 dataset on demand.
+        '''
         label_filename = self.filenames[image_nr].lbl
 
         if label_filename is None:
@@ -157,20 +303,9 @@ class NapariConnector(TiffConnector):
         logger.debug('Trying to load labelmat {} in {} Napari project'.format(
             label_filename, self.label_path))
 
-        label_data = self.h5.get_array_data('labels', label_filename)
-        label_n_dim = self.h5.n_dims('labels', label_filename)
-
-        if label_n_dim == 2:
-            label_data = np.expand_dims(label_data, axis=-1)  # channel
-            label_data = np.expand_dims(label_data, axis=0)  # z dim
-        elif label_n_dim == 3:
-            label_data = np.expand_dims(label_data, axis=-1)  # channel
-
-        if image_nr not in self.labeled_slices.keys():
-            self.labeled_slices[image_nr] = self.h5.filled_slices(
-                'labels', label_filename)
-
-        return label_data
+        key = ('napari_labels', str(self.label_path), label_filename)
+        return self.handle_cache.get(
+            key, lambda: self.h5.get_label_array(label_filename))
 
     def label_matrix_dimensions(self, image_nr):
         '''
@@ -198,84 +333,40 @@ class NapariConnector(TiffConnector):
 
         return output
 
-    @lru_cache(maxsize=1)
-    def original_label_values_for_all_images(self):
-        '''
-        Get all unique label values per image.
-
-        Returns
-        -------
-        list
-            List of sets. Each set corresponds to 1 label channel.
-            each set contains the label values of that channel.
-            E.g. `[{91, 109, 150}, {90, 100}]` for two label channels
-        '''
-        labels_per_channel = []
-
-        for image_nr in range(self.image_count()):
-            label_filename = str(self.filenames[image_nr].lbl)
-
-            if label_filename is None:
-                msg = 'No label matrix file found for image file #{}.'
-                logger.warning(msg.format(image_nr))
-                return None
-            print('label filename')
-            print(label_filename)
-            lbl = self._open_label_file(image_nr)
-
-            lbl = np.transpose(lbl, (3, 0, 2, 1)).astype(int)
-
-            C = lbl.shape[0]
-            labels = [np.unique(lbl[c, ...]) for c in range(C)]
-            labels = [set(labels) - {0} for labels in labels]
-
-            labels_per_channel = [l1.union(l2)
-                                  for l1, l2 in zip_longest(labels_per_channel,
-                                                            labels,
-                                                            fillvalue=set())]
-
-        return labels_per_channel
-
     @lru_cache(maxsize=1500)
-    def label_count_for_image(self, image_nr):
+    def _original_label_count_for_image(self, image_nr):
         '''
-        Get number of labels per labelvalue for an image.
-
-        Parameters
-        ----------
-        image_nr : int
-            index of image
-
-        Returns
-        -------
-        dict
+        Returns for each label channel a dict with original label values
+        as keys and label counts as values.
         '''
-        label_filename = str(self.filenames[image_nr].lbl)
-
-        if label_filename is None:
-            msg = 'No label matrix file found for image file #{}.'
-            logger.warning(msg.format(image_nr))
-            return None
-
         lbl = self._open_label_file(image_nr)
+        if lbl is None:
+            return None
+        if isinstance(lbl, SparseLabelArray):
+            return lbl.label_histogram()
 
-        lbl = np.transpose(lbl, (3, 0, 2, 1)).astype(int)
-
-        C = lbl.shape[0]
-        labels = [np.unique(lbl[c, ...]) for c in range(C)]
-
-        original_label_count = [{l: np.count_nonzero(lbl[c, ...] == l)
-                                 for l in labels[c] if l > 0}
-                                for c in range(C)]
-        label_count = {self.labelvalue_mapping[c][l]: count
-                       for c, orig in enumerate(original_label_count)
-                       for l, count in orig.items()}
-        return label_count
+        return ut.label_histogram(lbl)
 
 
 class NapariStorage():
-    def __init__(self, h5_path, max_dim=np.inf):
-        self.f = h5py.File(h5_path, 'r')
+    '''
+    Napari project stored in a HDF5 file.
+
+    Parameters
+    ----------
+    h5_path : str
+        Path to HDF5 file.
+    max_dim : int, optional
+        Maximum number of dimensions of used layers.
+    chunk_cache_bytes : int, optional
+        Size of the chunk cache of each dataset (default of h5py if
+        None).
+    '''
+    def __init__(self, h5_path, max_dim=np.inf, chunk_cache_bytes=None):
+        kwargs = {}
+        if chunk_cache_bytes is not None:
+            kwargs['rdcc_nbytes'] = chunk_cache_bytes
+        self.f = h5py.File(h5_path, 'r', **kwargs)
         self.max_dim = max_dim
 
     def __iter__(self):
@@ -323,22 +414,61 @@ class NapariStorage():
             array_data = np.array(napari_layer)
         return array_data
 
+    def get_label_array(self, layer_name: str):
+        '''
+        Returns lazy array of a Napari label layer with dimensions
+        (z, y, x, c). No pixel data of dense layers is read.
+        '''
+        napari_layer = self.f['labels'][layer_name]
+        if napari_layer.attrs['is_sparse']:
+            return SparseLabelArray(napari_layer[:],
+                                    tuple(napari_layer.attrs['shape']))
+
+        axes = {2: 'YX', 3: 'ZYX', 4: 'ZYXC'}[napari_layer.ndim]
+        return ZYXCView(napari_layer, axes)
+
+    def get_image_array(self, layer_name: str):
+        '''
+        Returns lazy array of a Napari image layer with dimensions
+        (z, y, x, c). Only the requested regions are read (as HDF5
+        hyperslabs).
+
+        Dimension order is taken from the layer attribute `axes` if
+        present. Otherwise 3D layers with 3 or 4 elements in the last
+        dimension are treated as RGB(A) images (y, x, c), other 3D layers
+        as z-stacks (z, y, x).
+        '''
+        napari_layer = self.f['image'][layer_name]
+        axes = napari_layer.attrs.get('axes')
+        if axes is None:
+            if napari_layer.ndim == 3:
+                axes = 'YXC' if napari_layer.shape[-1] in (3, 4) else 'ZYX'
+            else:
+                axes = {2: 'YX', 4: 'ZYXC'}[napari_layer.ndim]
+        return ZYXCView(napari_layer, str(axes))
+
     def filled_slices(self, layer_type: str, layer_name: str) -> list:
         '''
         Returns a list of indices specifying which slices have labels
         (values different than 0)
+
+        Dense layers are read slice by slice, for sparse layers only the
+        z-coordinates and values are read.
         '''
         napari_layer = self.f[layer_type][layer_name]
-        data = np.array(napari_layer)
-        if layer_type == 'labels':
-            if napari_layer.attrs['is_sparse']:
-                # check if the sparse label includes z-dim
-                if napari_layer.shape[0] > 3:
-                    return list(np.unique(data[0, :]))
-            else:
-                if len(data.shape) > 2:
-                    return data.shape[0]  # non-sparse array
-        return [0]  # when the images are 2D there is only one slice
+
+        is_sparse = layer_type == 'labels' and napari_layer.attrs['is_sparse']
+        if is_sparse and napari_layer.shape[0] > 3:
+            # sparse label includes z-dim: first coordinate row
+            values = napari_layer[-1, :]
+            z = napari_layer[0, :]
+            slices = np.unique(z[values != 0]).tolist()
+        elif not is_sparse and napari_layer.ndim > 2:
+            slices = [z for z in range(napari_layer.shape[0])
+                      if np.any(napari_layer[z])]
+        else:
+            return [0]  # when the images are 2D there is only one slice
+        return slices
 
     def excluded_layers(self) -> dict:
         '''
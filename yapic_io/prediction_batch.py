@@ -4,6 +4,8 @@ from numpy.testing import assert_equal
 import os
 import logging
 from yapic_io.minibatch import Minibatch
+from yapic_io.probmap_writer import ProbmapWriter
+from yapic_io.probmap_sinks import get_sink
 
 logger = logging.getLogger(os.path.basename(__file__))
 
@@ -18,6 +20,10 @@ class PredictionBatch(Minibatch):
     * Pixel data is loaded lazily to support arbitrary large image datasets.
     * Provides ``put_probmap_data()`` method to transfer classification
       results of your neural network back to the data source.
+    * Optionally writes results on a background thread
+      (``async_output_on()``), in compressed formats or quantized
+      (``set_output_format()``), or only the most probable class of each
+      voxel (``segmentation_output_on()``).
     * Flexible data binding through the Dataset object.
 
     Parameters
@@ -82,6 +88,9 @@ class PredictionBatch(Minibatch):
                          padding_zxy=padding_zxy)
         self.current_batch_pos = 0
         self.multichannel = False
+        self.segmentation = False
+        self.writer = None
+        self._async_args = None
 
         if size_zxy:
             self.set_tile_size(size_zxy)
@@ -100,6 +109,96 @@ class PredictionBatch(Minibatch):
         '''
         self.multichannel = False
 
+    def segmentation_output_on(self):
+        '''
+        Instead of probability maps, a label image with suffix
+        _segmentation.tif is saved for each image. Each voxel is set to the
+        label value of the most probable class (uint8, or uint16 for label
+        values above 255).
+        '''
+        self.segmentation = True
+
+    def segmentation_output_off(self):
+        '''
+        Probability maps are saved (default).
+        '''
+        self.segmentation = False
+
+    def set_output_format(self, output_format='tif', dtype='float32',
+                          max_open_files=None, **kwargs):
+        '''
+        Sets the file format and data type of probability maps.
+
+        Parameters
+        ----------
+        output_format : str
+            `'tif'` (uncompressed tiff, default),
+            `'compressed_tif'` (tiled and compressed tiff, written when
+            all batches are processed), `'h5'` (chunked and compressed
+            HDF5) or `'zarr'` (chunked and compressed zarr store).
+        dtype : str
+            `'float32'` (default), `'float16'` or `'uint8'`
+            (probabilities scaled to 0-255).
+        max_open_files : int
+            Maximum number of open output files, unlimited by default.
+        **kwargs
+            Format options, e.g. `compression='lzf'` for `'h5'`
+            (see yapic_io.probmap_sinks).
+        '''
+        self.close()
+        connector = self.dataset.pixel_connector
+        connector.output_sink = get_sink(output_format, dtype=dtype,
+                                         max_open_files=max_open_files,
+                                         **kwargs)
+
+    def async_output_on(self, max_buffer_bytes=2**29, max_queue=8):
+        '''
+        Probability maps are written on a background thread. Tiles are
+        buffered and combined to contiguous writes
+        (see yapic_io.probmap_writer.ProbmapWriter).
+
+        Results are written completely after iterating over all batches
+        or after calling ``flush()``.
+        '''
+        self.async_output_off()
+        self._async_args = {'max_buffer_bytes': max_buffer_bytes,
+                            'max_queue': max_queue}
+
+    def async_output_off(self):
+        '''
+        Probability maps are written directly in ``put_probmap_data()``
+        (default).
+        '''
+        self._close_writer()
+        self._async_args = None
+
+    def _close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def flush(self):
+        '''
+        Writes all buffered probability map tiles (if async output is on)
+        and pending data of the output files to disk. Output files are
+        kept open, except for formats that are only written when closed
+        (e.g. `'compressed_tif'`).
+        '''
+        if self.writer is not None:
+            self.writer.flush()
+        self.dataset.pixel_connector.flush()
+
+    def close(self):
+        '''
+        Writes all buffered probability map tiles, stops the background
+        writer thread (if async output is on) and closes all output files.
+        Called automatically after iterating over all batches. With async
+        output on, a new writer thread is started on the next
+        ``put_probmap_data()``.
+        '''
+        self._close_writer()
+        self.dataset.pixel_connector.close()
+
     def set_tile_size(self, size_zxy):
         super().set_tile_size(size_zxy)
         self._all_tile_positions = self._compute_pos_zxy()
@@ -130,6 +229,8 @@ class PredictionBatch(Minibatch):
         Implements list-like operations of element selection and slicing.
         '''
         if position >= len(self):
+            # end of iteration: store all results
+            self.close()
             raise IndexError('index out of bounds')
 
         self.current_batch_pos = position
@@ -165,6 +266,9 @@ class PredictionBatch(Minibatch):
         The order of the labels list (acessed with ``self.labels``) defines
         the order of the labels layer in the probability map.
 
+        If segmentation output is on, only the label value of the most
+        probable class is saved for each voxel.
+
         To pass 3D probmaps for a certain label, use
         ``put_probmap_data_for_label()``.
         '''
@@ -186,11 +290,30 @@ class PredictionBatch(Minibatch):
         assert_equal(L, len(self.labels))
         assert_equal(ZXY, self.tile_size_zxy)
 
+        if self.writer is None and self._async_args is not None:
+            self.writer = ProbmapWriter(self.dataset.pixel_connector,
+                                        **self._async_args)
+        output = self.dataset.pixel_connector if self.writer is None \
+            else self.writer
+
+        if self.segmentation:
+            label_values = np.array(list(self.labels))
+            dtype = np.uint8 if label_values.max() < 256 else np.uint16
+            label_values = label_values.astype(dtype)
+            for probmap, (image_nr, pos_zxy) in zip(
+                    probmap_batch, self.current_tile_positions):
+                output.put_segmentation_tile(
+                    label_values[np.argmax(probmap, axis=0)],
+                    pos_zxy,
+                    image_nr)
+            return
+
+        put_tile = output.put_tile
         for probmap, (image_nr, pos_zxy) in zip(probmap_batch,
                                                 self.current_tile_positions):
 
             for label_ch, label in zip(probmap, self.labels):
-                self.dataset.pixel_connector.put_tile(
+                put_tile(
                     label_ch,
                     pos_zxy,
                     image_nr,
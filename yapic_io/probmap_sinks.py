@@ -0,0 +1,382 @@
+'''
+Output formats for probability maps.
+
+A sink creates (or reopens) exactly one output array of shape (z, y, x, c)
+per probability map file, shared by all classes written to the file. The
+array stays open until close() (or until it is evicted to respect
+`max_open_files`).
+'''
+import collections
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+import numpy as np
+from tifffile import memmap, imread, imwrite
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+DTYPES = ('float32', 'float16', 'uint8')
+
+
+def quantize(data, dtype):
+    '''
+    Converts probabilities (floats between 0 and 1) to the output data
+    type. For uint8, probabilities are scaled to 0-255.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.probmap_sinks import quantize
+    >>> quantize(np.array([0, 0.5, 1, 1.2]), 'uint8')
+    array([  0, 128, 255, 255], dtype=uint8)
+    '''
+    dtype = np.dtype(dtype)
+    if dtype == np.uint8:
+        return np.clip(np.rint(data * 255), 0, 255).astype(np.uint8)
+    return np.asarray(data, dtype=dtype)
+
+
+class _Sink(object):
+    '''
+    Base class for sinks. Keeps one output per file open until close().
+
+    Parameters
+    ----------
+    dtype : str, optional
+        Data type of probability maps, one of `'float32'`, `'float16'`
+        or `'uint8'` (probabilities scaled to 0-255).
+    max_open_files : int, optional
+        Maximum number of open output files. If exceeded, the least
+        recently used file is closed (and reopened when written again).
+        Unlimited by default.
+    check_interval : float, optional
+        Minimum time in seconds between two checks whether an open file
+        still exists (files removed meanwhile are created again). With 0,
+        files are checked on every write. With None, files are checked
+        only when opened.
+    '''
+    extension = '.tif'
+
+    def __init__(self, dtype='float32', max_open_files=None,
+                 check_interval=5.):
+        msg = 'dtype {} not supported, use one of {}'.format(dtype, DTYPES)
+        assert np.dtype(dtype).name in DTYPES, msg
+        assert max_open_files is None or max_open_files > 0
+        self.dtype = np.dtype(dtype)
+        self.max_open_files = max_open_files
+        self.check_interval = check_interval
+        self._outputs = collections.OrderedDict()
+        self._checked = {}
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return '{} ({}, {} open files)'.format(type(self).__name__,
+                                              self.dtype,
+                                              len(self._outputs))
+
+    @property
+    def n_open_files(self):
+        return len(self._outputs)
+
+    def quantize(self, data):
+        '''
+        Converts probabilities to the data type of the sink.
+        '''
+        return quantize(data, self.dtype)
+
+    def open(self, path, shape, dtype=None):
+        '''
+        Returns writable array of shape (z, y, x, c) for the file at path.
+        The same array is returned until the file is closed.
+
+        Parameters
+        ----------
+        path : Path
+            File path.
+        shape : tuple
+            Shape (z, y, x, c) of the output.
+        dtype : str, optional
+            Data type of the output if it is not a probability map (e.g.
+            for label images).
+        '''
+        path = Path(path)
+        dtype = np.dtype(dtype or self.dtype)
+        with self._lock:
+            now = time.monotonic()
+            if path in self._outputs and self._needs_check(path, now):
+                self._checked[path] = now
+                if not self._is_valid(path):
+                    self._outputs.pop(path)  # file was removed
+            if path not in self._outputs:
+                self._outputs[path] = self._open(path, tuple(shape), dtype)
+                self._checked[path] = now
+                while self.max_open_files is not None and \
+                        len(self._outputs) > self.max_open_files:
+                    evicted, output = self._outputs.popitem(last=False)
+                    self._checked.pop(evicted, None)
+                    self._close(evicted, output)
+            self._outputs.move_to_end(path)
+            return self._outputs[path][0]
+
+    def flush(self):
+        '''
+        Writes pending data of all open files to disk. Files are kept
+        open, except for formats that are only written on close.
+        '''
+        with self._lock:
+            for path, output in list(self._outputs.items()):
+                self._flush(path, output)
+
+    def close(self):
+        '''
+        Finalizes and closes all output files.
+        '''
+        with self._lock:
+            outputs, self._outputs = self._outputs, collections.OrderedDict()
+            self._checked.clear()
+            for path, output in outputs.items():
+                self._close(path, output)
+
+    def _needs_check(self, path, now):
+        if self.check_interval is None:
+            return False
+        return now - self._checked.get(path, now) >= self.check_interval
+
+    def _is_valid(self, path):
+        return path.exists()
+
+    def _open(self, path, shape, dtype):
+        '''Returns tuple (array, ...) passed to _flush() and _close()'''
+        raise NotImplementedError()
+
+    def _flush(self, path, output):
+        raise NotImplementedError()
+
+    def _close(self, path, output):
+        raise NotImplementedError()
+
+
+class TiffSink(_Sink):
+    '''
+    Uncompressed tiff files, written via memory mapping (default output
+    format).
+
+    Parameters
+    ----------
+    dtype : str, optional
+        Data type of probability maps (see quantize()).
+    max_open_files : int, optional
+        Maximum number of memory mapped files.
+    '''
+    extension = '.tif'
+
+    def _open(self, path, shape, dtype):
+        if not path.exists():  # created "empty" tif of shape
+            return (memmap(str(path), shape=shape, dtype=dtype),)
+        # tifffile squeezes singleton dimensions
+        return (memmap(str(path)).reshape(shape),)
+
+    def _flush(self, path, output):
+        output[0].flush()  # write dirty pages
+
+    def _close(self, path, output):
+        output[0].flush()
+
+
+class H5Sink(_Sink):
+    '''
+    Chunked and compressed HDF5 files with one dataset of shape
+    (z, y, x, c).
+
+    Parameters
+    ----------
+    dtype : str, optional
+        Data type of probability maps (see quantize()).
+    max_open_files : int, optional
+        Maximum number of open HDF5 files.
+    compression : str, optional
+        HDF5 compression filter, e.g. `'gzip'` or `'lzf'`.
+    compression_opts : optional
+        Options of the compression filter (e.g. gzip level).
+    chunks : tuple, optional
+        Chunk shape (z, y, x, c). By default chunks span up to 256 x 256
+        pixels of one z-slice and all channels.
+    dataset : str, optional
+        Name of the dataset inside the files.
+    check_interval : float, optional
+        Minimum time in seconds between two checks whether an open file
+        still exists (see _Sink).
+    '''
+    extension = '.h5'
+
+    def __init__(self, dtype='float32', max_open_files=None,
+                 compression='gzip', compression_opts=4, chunks=None,
+                 dataset='probmap', check_interval=5.):
+        super().__init__(dtype, max_open_files, check_interval)
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.chunks = chunks
+        self.dataset = dataset
+
+    def _open(self, path, shape, dtype):
+        import h5py
+
+        f = h5py.File(str(path), 'a')
+        if self.dataset not in f:
+            Z, Y, X, C = shape
+            chunks = self.chunks or (1, min(Y, 256), min(X, 256), C)
+            opts = self.compression_opts if self.compression == 'gzip' \
+                else None
+            f.create_dataset(self.dataset, shape=shape, dtype=dtype,
+                             chunks=chunks, compression=self.compression,
+                             compression_opts=opts, fillvalue=0)
+        return f[self.dataset], f
+
+    def _flush(self, path, output):
+        output[1].flush()
+
+    def _close(self, path, output):
+        output[1].close()
+
+
+class ZarrSink(_Sink):
+    '''
+    Chunked and compressed zarr stores of shape (z, y, x, c). Stores can
+    be read by yapic_io.zarr_connector.ZarrConnector.
+
+    Parameters
+    ----------
+    dtype : str, optional
+        Data type of probability maps (see quantize()).
+    max_open_files : int, optional
+        Maximum number of open zarr arrays.
+    compressor : numcodecs codec, optional
+        Compressor, zarr's default compressor (Blosc) if not given.
+    chunks : tuple, optional
+        Chunk shape (z, y, x, c). By default chunks span up to 256 x 256
+        pixels of one z-slice and all channels.
+    check_interval : float, optional
+        Minimum time in seconds between two checks whether an open store
+        still exists (see _Sink).
+    '''
+    extension = '.zarr'
+
+    def __init__(self, dtype='float32', max_open_files=None,
+                 compressor='default', chunks=None, check_interval=5.):
+        super().__init__(dtype, max_open_files, check_interval)
+        self.compressor = compressor
+        self.chunks = chunks
+
+    def _open(self, path, shape, dtype):
+        import zarr
+
+        Z, Y, X, C = shape
+        chunks = self.chunks or (1, min(Y, 256), min(X, 256), C)
+        array = zarr.open(str(path), mode='a', shape=shape, chunks=chunks,
+                          dtype=dtype, compressor=self.compressor,
+                          fill_value=0)
+        array.attrs['_ARRAY_DIMENSIONS'] = ['z', 'y', 'x', 'c']
+        return (array,)
+
+    def _flush(self, path, output):
+        pass  # chunks are stored when written
+
+    def _close(self, path, output):
+        pass
+
+
+class CompressedTiffSink(_Sink):
+    '''
+    Tiled and compressed tiff files.
+
+    Compressed tiff files can not be modified in place, so results are
+    collected in a temporary memory mapped file and the tiff file is
+    written on flush() or close().
+
+    Parameters
+    ----------
+    dtype : str, optional
+        Data type of probability maps (see quantize()).
+    max_open_files : int, optional
+        Maximum number of temporary files.
+    compression : str, optional
+        Tiff compression, e.g. `'zlib'` or `'zstd'`.
+    tile : (y, x), optional
+        Tile size (multiple of 16).
+    '''
+    extension = '.tif'
+
+    def __init__(self, dtype='float32', max_open_files=None,
+                 compression='zlib', tile=(256, 256)):
+        super().__init__(dtype, max_open_files)
+        self.compression = compression
+        self.tile = tile
+
+    def flush(self):
+        '''
+        Writes all tiff files (and closes the temporary files).
+        '''
+        self.close()
+
+    def _is_valid(self, path):
+        return True  # tiff file is written on close
+
+    def _open(self, path, shape, dtype):
+        tmp = tempfile.TemporaryFile(dir=str(path.parent),
+                                     prefix=path.name, suffix='.tmp')
+        array = np.memmap(tmp, dtype=dtype, mode='w+', shape=shape)
+        if path.exists():  # continue writing to finalized file
+            data = imread(str(path))
+            array[:] = data.reshape(shape)
+        return array, tmp
+
+    def _close(self, path, output):
+        array, tmp = output
+        Z, Y, X, C = array.shape
+        if C == 1:
+            data, axes, kwargs = array[..., 0], 'ZYX', {}
+        else:
+            data, axes, kwargs = array, 'ZYXC', {'planarconfig': 'contig'}
+        tile = tuple(min(t, 16 * int(np.ceil(n / 16)))
+                     for t, n in zip(self.tile, (Y, X)))
+
+        imwrite(str(path), data, compression=self.compression, tile=tile,
+                photometric='minisblack', metadata={'axes': axes}, **kwargs)
+        tmp.close()
+
+
+SINKS = {'tif': TiffSink,
+         'tiff': TiffSink,
+         'compressed_tif': CompressedTiffSink,
+         'h5': H5Sink,
+         'zarr': ZarrSink}
+
+
+def get_sink(output_format, **kwargs):
+    '''
+    Returns a sink for an output format.
+
+    Parameters
+    ----------
+    output_format : str or sink
+        One of `'tif'` (uncompressed, default), `'compressed_tif'`,
+        `'h5'` or `'zarr'`. A sink object is returned as is.
+    **kwargs
+        Options of the sink (e.g. `dtype` or `compression`), see TiffSink,
+        CompressedTiffSink, H5Sink and ZarrSink.
+
+    Examples
+    --------
+    >>> from yapic_io.probmap_sinks import get_sink
+    >>> get_sink('h5', dtype='uint8', compression='lzf')
+    H5Sink (uint8, 0 open files)
+    '''
+    if not isinstance(output_format, str):
+        return output_format
+    msg = 'unknown output format {}, use one of {}'.format(
+        output_format, sorted(SINKS.keys()))
+    assert output_format in SINKS, msg
+    return SINKS[output_format](**kwargs)
@@ -0,0 +1,226 @@
+'''
+Asynchronous, write-combining output of classification results.
+'''
+import collections
+import functools
+import logging
+import os
+import queue
+import threading
+import numpy as np
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class _SlabBuffer(object):
+    '''
+    In-memory copy of z-slices [z, zz) of one output file in storage
+    order (z, y, x, c). Keeps track of written voxels and written tile
+    regions.
+    '''
+
+    def __init__(self, shape, dtype, open_target):
+        self.data = np.zeros(shape, dtype=dtype)
+        self.open_target = open_target
+        self.filled = np.zeros(shape, dtype=bool)
+        self.n_filled = 0
+        self.regions = []
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.filled.nbytes
+
+    @property
+    def complete(self):
+        return self.n_filled == self.data.size
+
+    def put(self, region, pixels):
+        self.data[region] = pixels
+        self.n_filled += np.count_nonzero(~self.filled[region])
+        self.filled[region] = True
+        self.regions.append(region)
+
+
+class ProbmapWriter(object):
+    '''
+    Writes classification results (probability map tiles or label tiles)
+    of a connector on a background thread.
+
+    Tiles are collected per output file in buffers spanning the full
+    y-x plane of the tile's z-slices. Once all tiles of such a slab are
+    written, the slab is stored with one contiguous write instead of
+    many strided writes with swapped x/y axes. Slabs are written by a
+    background thread, so the classifier can compute the next tiles
+    meanwhile.
+
+    If the buffers exceed `max_buffer_bytes`, the oldest incomplete
+    buffers are written tile by tile. Tiles of images whose slabs exceed
+    the memory budget are written without buffering (still on the
+    background thread).
+
+    Parameters
+    ----------
+    connector : TiffConnector
+        Connector to write probability maps to.
+    max_buffer_bytes : int, optional
+        Memory budget for buffered tiles.
+    max_queue : int, optional
+        Maximum number of pending writes. If the background thread falls
+        behind, put_tile() blocks.
+
+    Notes
+    -----
+    Results are only guaranteed to be stored after calling flush() or
+    close().
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> import numpy as np
+    >>> from yapic_io import TiffConnector
+    >>> from yapic_io.probmap_writer import ProbmapWriter
+    >>> savepath = tempfile.TemporaryDirectory()
+    >>> c = TiffConnector('yapic_io/test_data/tiffconnector_1/im/*.tif',
+    ...                   'yapic_io/test_data/tiffconnector_1/labels/*.tif',
+    ...                   savepath=savepath.name)
+    >>> writer = ProbmapWriter(c)
+    >>> tile = np.ones((1, 6, 4), dtype=np.float32)  # z, x, y
+    >>> writer.put_tile(tile, (0, 0, 0), image_nr=2, label_value=1)
+    >>> writer.close()
+    '''
+
+    def __init__(self, connector, max_buffer_bytes=2**29, max_queue=8):
+        self.connector = connector
+        self.max_buffer_bytes = max_buffer_bytes
+        self.nbytes = 0
+
+        self._buffers = collections.OrderedDict()
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._error = None
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        return 'ProbmapWriter ({} buffers, {} bytes, {} pending writes)'\
+            .format(len(self._buffers), self.nbytes, self._queue.qsize())
+
+    def put_tile(self, pixels, pos_zxy, image_nr, label_value,
+                 multichannel=False):
+        '''
+        Queues a probability map tile for writing.
+        Same arguments as TiffConnector.put_tile().
+        '''
+        C = label_value - 1 if multichannel else 0
+        key = ('probmap', image_nr, None if multichannel else label_value,
+               multichannel)
+        open_target = functools.partial(
+            self.connector._open_probability_map_file,
+            image_nr, label_value, multichannel=multichannel)
+        self._put(key, open_target,
+                  self.connector.output_sink.quantize(pixels),
+                  pos_zxy, image_nr, C, multichannel or 1)
+
+    def put_segmentation_tile(self, pixels, pos_zxy, image_nr):
+        '''
+        Queues a tile of label values for writing.
+        Same arguments as TiffConnector.put_segmentation_tile().
+        '''
+        key = ('segmentation', image_nr, pixels.dtype.str)
+        open_target = functools.partial(
+            self.connector._open_segmentation_file, image_nr, pixels.dtype)
+        self._put(key, open_target, pixels, pos_zxy, image_nr, 0, 1)
+
+    def _put(self, key, open_target, pixels, pos_zxy, image_nr, C,
+             n_channels):
+        self._raise_error()
+        np.testing.assert_equal(len(pos_zxy), 3)
+        np.testing.assert_equal(len(pixels.shape), 3)
+
+        Z, X, Y = pos_zxy
+        ZZ, XX, YY = np.array(pos_zxy) + pixels.shape
+        region = (slice(Z, ZZ), slice(Y, YY), slice(X, XX), slice(C, C + 1))
+        # storage order is z, y, x, c
+        pixels = np.moveaxis(pixels, (0, 1, 2), (0, 2, 1))[..., np.newaxis]
+
+        key = key + (Z, ZZ)
+        buf = self._buffers.get(key)
+
+        if buf is None:
+            _, _, X_img, Y_img = self.connector.image_dimensions(image_nr)
+            shape = (ZZ - Z, Y_img, X_img, n_channels)
+            # data + bool mask
+            nbytes = (pixels.itemsize + 1) * int(np.prod(shape))
+
+            if nbytes > self.max_buffer_bytes:
+                self._submit(open_target, [(region, np.array(pixels))])
+                return
+
+            while self._buffers and \
+                    self.nbytes + nbytes > self.max_buffer_bytes:
+                self._write_buffer(next(iter(self._buffers)))
+
+            buf = _SlabBuffer(shape, pixels.dtype, open_target)
+            self._buffers[key] = buf
+            self.nbytes += buf.nbytes
+
+        buf.put((slice(None),) + region[1:], pixels)
+        if buf.complete:
+            self._write_buffer(key)
+
+    def flush(self):
+        '''
+        Writes all buffered tiles and waits until all writes are done.
+        '''
+        for key in list(self._buffers.keys()):
+            self._write_buffer(key)
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        '''
+        Flushes and stops the background thread.
+        '''
+        try:
+            self.flush()
+        finally:
+            if self._thread.is_alive():
+                self._queue.put(None)
+                self._thread.join()
+
+    def _write_buffer(self, key):
+        Z, ZZ = key[-2:]
+        buf = self._buffers.pop(key)
+        self.nbytes -= buf.nbytes
+
+        if buf.complete:
+            writes = [((slice(Z, ZZ),), buf.data)]
+        else:
+            # write only written regions, tile by tile
+            writes = [((slice(Z, ZZ),) + region[1:], buf.data[region])
+                      for region in buf.regions]
+        self._submit(buf.open_target, writes)
+
+    def _submit(self, open_target, writes):
+        self._queue.put((open_target, writes))
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                if self._error is None:
+                    open_target, writes = job
+                    target = open_target()
+                    for region, data in writes:
+                        target[region] = data
+            except Exception as e:
+                logger.error('Writing classification result failed: %s', e)
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
@@ -0,0 +1,156 @@
+'''
+Persistent cache for per-file scan results (e.g. image dimensions, label
+values and label counts), stored in a json sidecar file.
+'''
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+DEFAULT_FILENAME = '.yapic_io_stats.json'
+VERSION = 1
+
+
+def _fingerprint(path):
+    st = os.stat(str(path))
+    return [st.st_size, st.st_mtime_ns]
+
+
+class StatsCache(object):
+    '''
+    Cache for scan results of image and label files, persisted in a json
+    sidecar file.
+
+    Entries are keyed by file path and are only valid as long as size and
+    modification time of the file are unchanged. Results for modified
+    files are dropped and have to be computed again.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path to the json sidecar file. It is created if it does not exist.
+
+    Examples
+    --------
+    >>> import tempfile, os
+    >>> from yapic_io.stats_cache import StatsCache
+    >>> tmpdir = tempfile.TemporaryDirectory()
+    >>> fname = os.path.join(tmpdir.name, 'image.tif')
+    >>> with open(fname, 'w') as f:
+    ...     _ = f.write('some data')
+    >>> cache = StatsCache(os.path.join(tmpdir.name, 'stats.json'))
+    >>> cache.get(fname, 'shape') is None
+    True
+    >>> cache.put(fname, shape=[1, 4, 6, 3])
+    >>> cache.save()
+    >>> StatsCache(os.path.join(tmpdir.name, 'stats.json')).get(fname, 'shape')
+    [1, 4, 6, 3]
+    '''
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._entries = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def __repr__(self):
+        return 'StatsCache ({} files, {})'.format(len(self._entries),
+                                                  self.path)
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            with open(str(self.path)) as f:
+                content = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning('Could not read stats cache %s: %s', self.path, e)
+            return
+
+        if content.get('version') != VERSION:
+            logger.info('Ignoring stats cache %s of other version', self.path)
+            return
+        self._entries = content.get('files', {})
+
+    def _entry(self, filepath):
+        '''
+        Returns valid cache entry for a file (or an empty entry if the file
+        was modified).
+        '''
+        key = str(Path(filepath).resolve())
+        fingerprint = _fingerprint(key)
+
+        entry = self._entries.get(key)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            entry = {'fingerprint': fingerprint, 'stats': {}}
+            self._entries[key] = entry
+        return entry
+
+    def get(self, filepath, name):
+        '''
+        Returns cached value for a file or None if not cached.
+
+        Parameters
+        ----------
+        filepath : str or Path
+            Path of scanned file.
+        name : str
+            Name of the value, e.g. `'shape'`.
+        '''
+        with self._lock:
+            return self._entry(filepath)['stats'].get(name)
+
+    def put(self, filepath, **values):
+        '''
+        Stores values (json serializable) for a file.
+        '''
+        with self._lock:
+            self._entry(filepath)['stats'].update(values)
+            self._dirty = True
+
+    def save(self):
+        '''
+        Writes the cache to the sidecar file (if anything changed).
+        '''
+        with self._lock:
+            if not self._dirty:
+                return
+            content = {'version': VERSION, 'files': self._entries}
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            try:
+                with open(str(tmp_path), 'w') as f:
+                    json.dump(content, f)
+                os.replace(str(tmp_path), str(self.path))
+            except OSError as e:
+                logger.warning('Could not write stats cache %s: %s',
+                               self.path, e)
+                return
+            self._dirty = False
+
+
+def get_stats_cache(stats_cache, folder):
+    '''
+    Returns a StatsCache object for the stats_cache argument of connectors.
+
+    Parameters
+    ----------
+    stats_cache : None, bool, str, Path or StatsCache
+        None or False disables the cache. True uses a sidecar file
+        in `folder`. A path defines the sidecar file location.
+    folder : Path
+        Default location of the sidecar file.
+    '''
+    if stats_cache is None or stats_cache is False:
+        return None
+    if isinstance(stats_cache, StatsCache):
+        return stats_cache
+    if stats_cache is True:
+        folder = Path(folder)
+        if not folder.is_dir():
+            folder = folder.parent
+        return StatsCache(folder / DEFAULT_FILENAME)
+    return StatsCache(stats_cache)
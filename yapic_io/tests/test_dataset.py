@@ -1,4 +1,4 @@
-from unittest import TestCase
+from unittest import TestCase, mock
 import os
 import numpy as np
 from yapic_io.tiff_connector import TiffConnector
@@ -24,6 +24,10 @@ def c(*a):
 
 class TestDataset(TestCase):
 
+    @pytest.fixture(autouse=True)
+    def setup(self, tmpdir):
+        self.tmpdir = tmpdir.strpath
+
     def test_pixel_statistics(self):
 
         data_dir = os.path.join(base_path, '../test_data/cellvoyager')
@@ -386,6 +390,21 @@ class TestDataset(TestCase):
         assert_array_equal(expected_3, t[3])
         self.assertTrue(sorted(list(t.keys())), [1, 2, 3])
 
+    def test_load_label_counts_parallel(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path, n_workers=3)
+        d = Dataset(c)
+
+        self.assertEqual(d.n_workers, 3)
+        self.assertEqual(c.labelvalue_mapping, [{91: 1, 109: 2, 150: 3}])
+
+        t = d.load_label_counts()
+        assert_array_equal(t[1], [4, 0, 0])
+        assert_array_equal(t[2], [3, 0, 11])
+        assert_array_equal(t[3], [3, 0, 3])
+
     def test_sync_label_counts(self):
         img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
         label_path = os.path.join(
@@ -711,6 +730,158 @@ class TestDataset(TestCase):
 
         self.assertTrue((tile == val).all())
 
+    def test_multichannel_pixel_tile_reads_channels_at_once(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c)
+
+        pos_zxy = (1, 2, 1)
+        size_zxy = (2, 4, 3)
+        pd = (1, 2, 3)
+        augment_params = {'fliplr': True, 'flipud': True}
+
+        def single_channel_tiles(channels):
+            return np.vstack([d.multichannel_pixel_tile(
+                2, pos_zxy, size_zxy, [ch], pixel_padding=pd,
+                augment_params=augment_params) for ch in channels])
+
+        for channels in ([0, 1, 2], [2, 0], [0, 2]):
+            with mock.patch.object(c, 'get_tile', wraps=c.get_tile) as m:
+                tile = d.multichannel_pixel_tile(
+                    2, pos_zxy, size_zxy, channels, pixel_padding=pd,
+                    augment_params=augment_params)
+                n_reads = m.call_count
+
+            self.assertEqual(tile.shape, (len(channels), 4, 8, 9))
+            assert_array_equal(tile, single_channel_tiles(channels))
+            self.assertEqual(n_reads, 1 if channels == [0, 1, 2] else 2)
+
+    def test_training_tile_reads_labels_at_once(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c)
+        d.label_weights = {1: 0.5, 2: 1, 3: 2}
+
+        pos_zxy = (0, 1, 1)
+        size_zxy = (2, 4, 3)
+        labels = [3, 1, 2]
+        shape_zxy = d.image_dimensions(2)[1:]
+
+        for augment_params in ({}, {'fliplr': True, 'flipud': True},
+                               {'rotation_angle': 30}):
+            with mock.patch.object(c, 'label_value_tile',
+                                   wraps=c.label_value_tile) as m:
+                tile = d.training_tile(2, pos_zxy, size_zxy, [0], labels,
+                                       augment_params=augment_params)
+                self.assertEqual(m.call_count, 1)
+
+            for i, label in enumerate(labels):
+                val = ds._augment_tile(shape_zxy, pos_zxy, size_zxy,
+                                       d._get_weights_tile,
+                                       augment_params=augment_params,
+                                       image_nr=2, label_value=label)
+                assert_array_equal(tile.weights[i], val)
+
+    def test_training_tile_augments_pixels_and_labels_jointly(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c)
+
+        pos_zxy = (0, 1, 1)
+        size_zxy = (2, 4, 3)
+        padding = (0, 2, 3)
+        labels = [1, 2, 3]
+        shape_zxy = d.image_dimensions(2)[1:]
+
+        for augment_params in ({}, {'rot90': 1, 'fliplr': True},
+                               {'rotation_angle': 30, 'fliplr': True},
+                               {'shear_angle': 10, 'flipud': True}):
+            tile = d.training_tile(2, pos_zxy, size_zxy, [0], labels,
+                                   pixel_padding=padding,
+                                   augment_params=augment_params)
+
+            pixels = d.multichannel_pixel_tile(2, pos_zxy, size_zxy, [0],
+                                               pixel_padding=padding,
+                                               augment_params=augment_params)
+            assert_array_equal(tile.pixels, pixels)
+
+            for i, label in enumerate(labels):
+                val = ds._augment_tile(shape_zxy, pos_zxy, size_zxy,
+                                       d._get_weights_tile,
+                                       augment_params=augment_params,
+                                       image_nr=2, label_value=label)
+                assert_array_equal(tile.weights[i], val)
+
+    def test_training_tile_rot90_and_rotation_non_square(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c)
+
+        augment_params = {'rotation_angle': 17, 'shear_angle': 8, 'rot90': 1}
+        shape_zxy = d.image_dimensions(0)[1:]
+        pos_zxy = (0, 0, 0)
+        size_zxy = (1, 4, 5)
+        labels = [1, 2, 3]
+
+        for params in (augment_params, dict(augment_params,
+                                            fast_affine=True)):
+            tile = d.training_tile(0, pos_zxy, size_zxy, [0], labels,
+                                   augment_params=params)
+            self.assertEqual(tile.pixels.shape, (1, 1, 4, 5))
+            self.assertEqual(tile.weights.shape, (3, 1, 4, 5))
+
+            pixels = d.multichannel_pixel_tile(0, pos_zxy, size_zxy, [0],
+                                               augment_params=params)
+            assert_array_equal(tile.pixels, pixels)
+            for i, label in enumerate(labels):
+                val = ds._augment_tile(shape_zxy, pos_zxy, size_zxy,
+                                       d._get_weights_tile,
+                                       augment_params=augment_params,
+                                       image_nr=0, label_value=label)
+                assert_array_equal(tile.weights[i], val)
+
+    def test_training_tile_fast_affine(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c)
+
+        pos_zxy = (0, 1, 0)
+        size_zxy = (1, 4, 4)
+        padding = (0, 1, 1)
+
+        for augment_params in ({'rotation_angle': 30},
+                               {'rotation_angle': 40, 'rot90': 1,
+                                'flipud': True},
+                               {'shear_angle': 5, 'fliplr': True,
+                                'interpolation_order': 1}):
+            fast_params = dict(augment_params, fast_affine=True)
+            tile = d.training_tile(2, pos_zxy, size_zxy, [0], [1, 2, 3],
+                                   pixel_padding=padding,
+                                   augment_params=augment_params)
+            tile_fast = d.training_tile(2, pos_zxy, size_zxy, [0], [1, 2, 3],
+                                        pixel_padding=padding,
+                                        augment_params=fast_params)
+            np.testing.assert_allclose(tile_fast.pixels, tile.pixels)
+            assert_array_equal(tile_fast.weights, tile.weights)
+
+            pixels = d.multichannel_pixel_tile(2, pos_zxy, size_zxy, [0],
+                                               pixel_padding=padding,
+                                               augment_params=augment_params)
+            pixels_fast = d.multichannel_pixel_tile(
+                2, pos_zxy, size_zxy, [0], pixel_padding=padding,
+                augment_params=fast_params)
+            np.testing.assert_allclose(pixels_fast, pixels)
+
     def test_channels_are_consistent(self):
 
         data_dir = os.path.join(base_path, '../test_data/cellvoyager')
@@ -884,6 +1055,114 @@ class TestDataset(TestCase):
         weights_val = np.array([[[[0.]]], [[[1.]]]])
         assert_array_equal(training_tile.weights, weights_val)
 
+    def test_random_training_tile_by_coordinate_ilastik(self):
+
+        p = os.path.join(base_path, '../test_data/ilastik/dimensionstest')
+        img_path = os.path.join(p, 'images')
+        label_path = os.path.join(p, 'x15_y10_z2_c4_classes2.ilp')
+
+        size = (1, 3, 2)
+        channels = [0, 1, 2, 3]
+        labels = set([1, 2])
+
+        c = IlastikConnector(img_path, label_path)
+        d = Dataset(c)
+
+        for i in range(4):
+            img_nr, C, *pos_zxy = d.label_coordinate(2, i)
+            self.assertEqual((img_nr, C), (0, 0))
+            assert_array_equal(c.label_tile(0, pos_zxy, (1, 1, 1), 2),
+                               [[[True]]])
+        with self.assertRaises(AssertionError):
+            d.label_coordinate(2, 4)
+
+        np.random.seed(43)
+        for _ in range(10):
+            training_tile = d.random_training_tile(size, channels,
+                                                   ensure_labelvalue=2)
+            self.assertTrue(training_tile.weights[1].any())
+        np.random.seed(None)
+
+    def test_random_training_tile_by_coordinate(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+
+        size = (1, 4, 3)
+        channels = [0, 1, 2]
+        labels = set([1, 2, 3])
+
+        c = TiffConnector(img_path, label_path,
+                          coordinate_index=os.path.join(self.tmpdir, 'idx'))
+        d = Dataset(c)
+
+        with mock.patch.object(d, '_random_training_tile_by_polling') as m:
+            np.random.seed(43)
+            for label_value in [1, 2, 3] * 5:
+                tile = d.random_training_tile(size, channels,
+                                              labels=labels,
+                                              ensure_labelvalue=label_value)
+                self.assertTrue(tile.weights[label_value - 1].any())
+            np.random.seed(None)
+            m.assert_not_called()
+
+    def test_label_count_in_tile(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c, integral_bin_zxy=(1, 1, 1))
+        size = (1, 3, 2)
+
+        for image_nr in range(d.n_images):
+            shape_zxy = d.image_dimensions(image_nr)[1:]
+            positions = [(z, x, y) for z in range(shape_zxy[0])
+                         for x in range(shape_zxy[1] - 2)
+                         for y in range(shape_zxy[2] - 1)]
+            for label in d.label_values():
+                expected = [c.label_tile(image_nr, p, size, label).sum()
+                            for p in positions]
+                assert_array_equal(
+                    d.label_count_in_tile(image_nr, positions, size, label),
+                    expected)
+            self.assertEqual(d.label_count_in_tile(image_nr, (0, 0, 0),
+                                                   shape_zxy),
+                             sum(counts[image_nr]
+                                 for counts in d.label_counts.values()))
+
+        d2 = Dataset(c)
+        for label in d.label_values():
+            self.assertGreaterEqual(
+                d2.label_count_in_tile(2, (0, 1, 1), size, label),
+                d.label_count_in_tile(2, (0, 1, 1), size, label))
+
+    def test_label_integrals_are_built_lazily(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c)
+        with mock.patch.object(c, 'label_value_tile',
+                               wraps=c.label_value_tile) as m:
+            d.label_integral(2, 1)
+            # one read for all labels of the label channel
+            self.assertEqual(m.call_count, 1)
+            self.assertEqual(len(d._label_integrals), 3)
+            for label in (2, 3):
+                d.label_integral(2, label)
+            self.assertEqual(m.call_count, 1)
+
+        # tables are dropped if they exceed the memory budget
+        d2 = Dataset(c, integral_bin_zxy=(1, 1, 1), integral_max_bytes=0)
+        self.assertEqual(d2.label_count_in_tile(2, (0, 0, 0), (3, 6, 4)),
+                         d.label_count_in_tile(2, (0, 0, 0), (3, 6, 4)))
+        self.assertEqual(len(d2._label_integrals), 0)
+
     def test_random_training_tile_by_polling(self):
         img_path = os.path.join(
             base_path, '../test_data/tiffconnector_1/im/')
@@ -1,7 +1,7 @@
 import os
 import logging
 from unittest import TestCase
-from yapic_io.ilastik_connector import IlastikConnector
+from yapic_io.ilastik_connector import IlastikConnector, read_label_blocks
 from numpy.testing import assert_array_equal
 import numpy as np
 from pprint import pprint
@@ -189,7 +189,7 @@ class TestIlastikConnector(TestCase):
         print(c.filenames)
         print(c.image_count)
 
-        image_id = 0  # 769_cerebellum_5M41_subset_1.tif
+        image_id = 3  # 769_cerebellum_5M41_subset_1.tif
         pos_zxy = (0, 309, 212)
         size_zxy = (1, 4, 5)
 
@@ -222,6 +222,25 @@ class TestIlastikConnector(TestCase):
         lbl = c.label_tile(image_id, pos_zxy, size_zxy, 4)
         self.assertEqual(lbl.shape, size_zxy)
 
+    def test_label_index_to_coordinate(self):
+        p = os.path.join(base_path, '../test_data/ilastik/purkinjetest')
+        img_path = os.path.join(p, 'images')
+        lbl_path = os.path.join(p, 'ilastik-1.2.2post1mac.ilp')
+
+        c = IlastikConnector(img_path, lbl_path)
+
+        image_id = 3  # 769_cerebellum_5M41_subset_1.tif
+        for label_value, count in c.label_count_for_image(image_id).items():
+            coords = [c.label_index_to_coordinate(image_id, label_value, i)
+                      for i in range(count)]
+            # all coordinates are distinct and labeled with label_value
+            self.assertEqual(len(set(tuple(x) for x in coords)), count)
+            for C, z, x, y in coords[::50]:
+                self.assertEqual(C, 0)
+                lbl = c.label_tile(image_id, (z, x, y), (1, 1, 1),
+                                   label_value)
+                self.assertTrue(lbl.all())
+
     def test_labeltile_for_image_without_labels(self):
         p = os.path.join(base_path, '../test_data/ilastik/purkinjetest')
         img_path = os.path.join(p, 'images')
@@ -318,3 +337,11 @@ class TestIlastikConnector(TestCase):
 
         assert_array_equal(c1.image_count() + c2.image_count(),
                            c.image_count())
+
+    def test_read_label_blocks_unsupported_pyilastik(self):
+
+        class Project(object):  # project without pyilastik internals
+            pass
+
+        with self.assertRaisesRegex(ImportError, 'pyilastik version'):
+            read_label_blocks(Project(), 0)
@@ -0,0 +1,42 @@
+from unittest import TestCase
+import numpy as np
+from numpy.testing import assert_array_equal
+from yapic_io.integral_volume import IntegralVolume, bin_counts
+
+
+class TestIntegralVolume(TestCase):
+
+    def test_count(self):
+        np.random.seed(42)
+        mask = np.random.rand(5, 13, 11) > 0.8
+        iv = IntegralVolume.from_mask(mask)
+        self.assertEqual(iv.total, mask.sum())
+
+        size = (2, 4, 3)
+        positions = [(z, x, y) for z in range(-1, 5)
+                     for x in range(-2, 13, 3) for y in range(-2, 11, 2)]
+        expected = [mask[max(z, 0):z + 2, max(x, 0):x + 4,
+                         max(y, 0):y + 3].sum() for z, x, y in positions]
+        assert_array_equal(iv.count(positions, size), expected)
+        self.assertEqual(iv.count(positions[7], size), expected[7])
+        np.random.seed(None)
+
+    def test_binned_count_is_upper_bound(self):
+        np.random.seed(42)
+        mask = np.random.rand(3, 13, 11) > 0.95
+        iv = IntegralVolume.from_mask(mask, bin_zxy=(2, 4, 3))
+        self.assertEqual(iv.table.shape, (3, 5, 5))
+
+        size = (1, 3, 2)
+        positions = [(z, x, y) for z in range(3)
+                     for x in range(11) for y in range(10)]
+        counts = iv.count(positions, size)
+        for (z, x, y), n in zip(positions, counts):
+            n_exact = mask[z:z + 1, x:x + 3, y:y + 2].sum()
+            self.assertGreaterEqual(n, n_exact)
+        np.random.seed(None)
+
+    def test_bin_counts(self):
+        mask = np.ones((1, 5, 4), dtype=bool)
+        assert_array_equal(bin_counts(mask, (1, 2, 2)),
+                           [[[4, 4], [4, 4], [2, 2]]])
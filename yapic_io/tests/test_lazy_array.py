@@ -0,0 +1,105 @@
+from unittest import TestCase
+import os
+import numpy as np
+from numpy.testing import assert_array_equal
+from tifffile import imwrite
+import pytest
+from yapic_io.lazy_array import ZYXCView, TiffSegmentArray, ChannelStackArray
+from yapic_io.cache import LRUByteCache
+from yapic_io.tiff_connector import TiffConnector
+
+
+class TestZYXCView(TestCase):
+
+    def test_shape_and_tile(self):
+        data = np.arange(2 * 3 * 4 * 5).reshape((2, 3, 4, 5))  # czyx
+        v = ZYXCView(data, 'CZYX')
+
+        self.assertEqual(v.shape, (3, 4, 5, 2))
+        expected = np.moveaxis(data, 0, -1)
+        assert_array_equal(v[...], expected)
+        assert_array_equal(v[1:3, 0:2, 3:5, 1], expected[1:3, 0:2, 3:5, 1])
+        assert_array_equal(v[..., 0], expected[..., 0])
+
+    def test_missing_axes(self):
+        data = np.arange(4 * 5).reshape((4, 5))
+        v = ZYXCView(data, 'YX')
+
+        self.assertEqual(v.shape, (1, 4, 5, 1))
+        assert_array_equal(v[0:1, 1:3, 2:4, 0:1],
+                           data[np.newaxis, 1:3, 2:4, np.newaxis])
+        assert_array_equal(v[..., 0], data[np.newaxis])
+
+    def test_invalid_axes(self):
+        with self.assertRaises(AssertionError):
+            ZYXCView(np.zeros((2, 3)), 'ZYX')
+        with self.assertRaises(AssertionError):
+            ZYXCView(np.zeros((2, 3, 4)), 'TYX')
+
+
+class TestTiffSegmentArray(TestCase):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmpdir):
+        self.tmpdir = tmpdir.strpath
+
+    def test_tiled_rgb(self):
+        data = np.random.randint(0, 255, (3, 26, 40, 3), dtype=np.uint8)
+        path = os.path.join(self.tmpdir, 'tiled.tif')
+        imwrite(path, data, tile=(16, 16), compression='zlib',
+                photometric='rgb')
+
+        cache = LRUByteCache(max_bytes=10**6)
+        a = TiffSegmentArray(path, cache=cache)
+        self.assertEqual(a.shape, data.shape)
+        self.assertEqual(a.chunks, (1, 16, 16, 3))
+
+        assert_array_equal(a[1, 3:20, 17:39], data[1, 3:20, 17:39])
+        # only the 4 intersecting tiles are decoded
+        self.assertEqual(cache.misses, 4)
+
+        assert_array_equal(a[1, 3:20, 20:39], data[1, 3:20, 20:39])
+        self.assertEqual(cache.misses, 4)
+        self.assertEqual(cache.hits, 4)
+
+        assert_array_equal(a[...], data)
+        assert_array_equal(a[::-1, 1:25:3, -1], data[::-1, 1:25:3, -1])
+
+    def test_compressed_strips(self):
+        data = np.random.randint(0, 2**16, (2, 3, 26, 40), dtype=np.uint16)
+        path = os.path.join(self.tmpdir, 'stripped.tif')
+        imwrite(path, data, compression='zlib', rowsperstrip=5,
+                imagej=True)
+
+        a = TiffSegmentArray(path)
+        self.assertEqual(a.axes, 'ZCYX')
+        assert_array_equal(a[...], data)
+        assert_array_equal(a[1, :, 4:21, 0:7], data[1, :, 4:21, 0:7])
+
+
+class TestChannelStackArray(TestCase):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmpdir):
+        self.tmpdir = tmpdir.strpath
+
+    def test_channel_files(self):
+        data = np.random.randint(0, 2**16, (3, 20, 30), dtype=np.uint16)
+        paths = [os.path.join(self.tmpdir, 'C0{}.tif'.format(i))
+                 for i in range(3)]
+        imwrite(paths[0], data[0])
+        imwrite(paths[1], data[1], compression='zlib', tile=(16, 16))
+        imwrite(paths[2], data[2])
+
+        a = ChannelStackArray([TiffConnector._open_tiff(p) for p in paths])
+        expected = np.moveaxis(data, 0, -1)[np.newaxis]  # z, y, x, c
+        self.assertEqual(a.shape, (1, 20, 30, 3))
+        assert_array_equal(a[...], expected)
+        assert_array_equal(a[0, 3:17, 5:9, 1], expected[0, 3:17, 5:9, 1])
+        assert_array_equal(a[:, 3:17, 5:9, 1:3], expected[:, 3:17, 5:9, 1:3])
+        assert_array_equal(a[..., ::-2], expected[..., ::-2])
+        self.assertEqual(a[:, :, :, 3:].shape, (1, 20, 30, 0))
+
+    def test_shape_mismatch(self):
+        with self.assertRaises(AssertionError):
+            ChannelStackArray([np.zeros((1, 4, 5, 1)), np.zeros((1, 5, 4, 1))])
@@ -0,0 +1,145 @@
+from unittest import TestCase
+import os
+import h5py
+import numpy as np
+from numpy.testing import assert_array_equal
+from tifffile import imwrite
+import pytest
+from yapic_io import Dataset, TrainingBatch
+from yapic_io.napari_connector import (NapariConnector, NapariStorage,
+                                       SparseLabelArray, reconstruct_layer)
+
+
+def write_project(path, layers, images={}):
+    '''
+    Writes a napari project with label layers {name: (dense data, sparse)}
+    and image layers {name: data}.
+    '''
+    with h5py.File(path, 'w') as f:
+        image = f.create_group('image')
+        for name, data in images.items():
+            image.create_dataset(name, data=data, chunks=(1, 8, 8))
+        labels = f.create_group('labels')
+        for name, (data, is_sparse) in layers.items():
+            if is_sparse:
+                coords = np.array(np.nonzero(data))
+                layer = labels.create_dataset(
+                    name, data=np.vstack([coords, data[tuple(coords)]]))
+            else:
+                layer = labels.create_dataset(name, data=data)
+            layer.attrs['shape'] = data.shape
+            layer.attrs['is_sparse'] = is_sparse
+
+
+class TestSparseLabelArray(TestCase):
+
+    def test_getitem(self):
+        dense = np.zeros((3, 20, 30), dtype=np.int64)
+        rs = np.random.RandomState(42)
+        dense[rs.rand(*dense.shape) > 0.9] = 2
+        dense[rs.rand(*dense.shape) > 0.95] = 1
+        coords = np.array(np.nonzero(dense))
+        coo = np.vstack([coords, dense[tuple(coords)]])
+        coo = coo[:, rs.permutation(coo.shape[1])]  # unsorted COO list
+
+        a = SparseLabelArray(coo, dense.shape)
+        expected = reconstruct_layer(coo, dense.shape)[..., np.newaxis]
+        self.assertEqual(a.shape, expected.shape)
+        assert_array_equal(a[...], expected)
+        assert_array_equal(a[1:3, 4:17, 5:9, 0], expected[1:3, 4:17, 5:9, 0])
+        assert_array_equal(a[2, :, 3], expected[2, :, 3])
+        assert_array_equal(a[::-1, 1:20:3, -5:], expected[::-1, 1:20:3, -5:])
+
+        values, counts = np.unique(dense[dense > 0], return_counts=True)
+        self.assertEqual(a.label_histogram(),
+                         [dict(zip(values.tolist(), counts.tolist()))])
+        self.assertEqual(a.labeled_slices(), [0, 1, 2])
+
+
+class TestNapariConnector(TestCase):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmpdir):
+        self.tmpdir = tmpdir.strpath
+
+    def test_sparse_and_dense_labels(self):
+        rs = np.random.RandomState(0)
+        dense = (rs.rand(3, 20, 30) > 0.9).astype(np.uint8)
+        dense[1] *= 2
+        img = rs.randint(0, 255, (3, 20, 30), dtype=np.uint8)
+
+        layers = {'sparse_label': (dense, True),
+                  'dense_label': (dense, False)}
+        project = os.path.join(self.tmpdir, 'project.h5')
+        write_project(project, layers)
+        for name in ('sparse', 'dense'):
+            imwrite(os.path.join(self.tmpdir, name + '.tif'), img,
+                    metadata={'axes': 'ZYX'})
+
+        c = NapariConnector(os.path.join(self.tmpdir, '*.tif'), project)
+        self.assertEqual(len(c.filenames), 2)
+        for image_nr in range(2):
+            self.assertEqual(c.label_count_for_image(image_nr),
+                             {1: np.count_nonzero(dense == 1),
+                              2: np.count_nonzero(dense == 2)})
+            self.assertEqual(c.label_matrix_dimensions(image_nr),
+                             [1, 3, 30, 20])
+
+            tile = c.label_tile(image_nr, (1, 2, 3), (2, 10, 7), 2)
+            expected = np.moveaxis(dense[1:3, 3:10, 2:12], 1, 2) == 2
+            assert_array_equal(tile, expected)
+
+    def test_filled_slices(self):
+        dense = np.zeros((4, 20, 30), dtype=np.uint8)
+        dense[1, 3, 4] = 1
+        dense[3, 5:7, 2] = 2
+        project = os.path.join(self.tmpdir, 'project.h5')
+        write_project(project, {'sparse_label': (dense, True),
+                                'dense_label': (dense, False),
+                                'label_2d': (dense[3], False)})
+
+        storage = NapariStorage(project)
+        for name in ('sparse_label', 'dense_label'):
+            self.assertEqual(storage.filled_slices('labels', name), [1, 3])
+        self.assertEqual(storage.filled_slices('labels', 'label_2d'), [0])
+        storage.f.close()
+
+    def test_effective_tiles(self):
+        dense = np.zeros((4, 20, 30), dtype=np.uint8)
+        dense[1, 3, 4] = 1
+        dense[3, 5:7, 2] = 2
+        project = os.path.join(self.tmpdir, 'project.h5')
+        write_project(project, {'stack_label': (dense, True)})
+        imwrite(os.path.join(self.tmpdir, 'stack.tif'), dense,
+                metadata={'axes': 'ZYX'})
+
+        c = NapariConnector(os.path.join(self.tmpdir, '*.tif'), project)
+        self.assertEqual(c.effective_slices(), {0: [1, 3]})
+
+        t = TrainingBatch(Dataset(c), (2, 10, 10))
+        for tiles in t.effective_tiles().values():
+            self.assertTrue(len(tiles) > 0)
+            # tiles of slices [0, 2) and [2, 4) overlap labeled slices
+            self.assertEqual(set(tile[1] for tile in tiles), {0, 1, 2})
+
+    def test_image_layers(self):
+        rs = np.random.RandomState(0)
+        dense = (rs.rand(3, 20, 30) > 0.9).astype(np.uint8)
+        img = rs.randint(0, 255, (3, 20, 30), dtype=np.uint8)
+        project = os.path.join(self.tmpdir, 'project.h5')
+        write_project(project, {'stack_label': (dense, True)},
+                      images={'stack': img})
+        imwrite(os.path.join(self.tmpdir, 'stack.tif'), img,
+                metadata={'axes': 'ZYX'})
+
+        c = NapariConnector(None, project, chunk_cache_bytes=2**20)
+        tc = NapariConnector(os.path.join(self.tmpdir, '*.tif'), project)
+        _, _, cache_bytes, _ = c.h5.f.id.get_access_plist().get_cache()
+        self.assertEqual(cache_bytes, 2**20)
+
+        self.assertEqual(c.image_dimensions(0), (1, 3, 30, 20))
+        self.assertEqual(c.image_dimensions(0), tc.image_dimensions(0))
+        assert_array_equal(c.get_tile(0, (0, 1, 4, 3), (1, 2, 11, 7)),
+                           tc.get_tile(0, (0, 1, 4, 3), (1, 2, 11, 7)))
+        self.assertEqual(c.label_count_for_image(0),
+                         tc.label_count_for_image(0))
@@ -2,11 +2,12 @@ from unittest import TestCase
 import os
 from yapic_io.connector import io_connector
 import numpy as np
-from numpy.testing import assert_array_almost_equal, assert_array_equal
+from numpy.testing import (assert_array_almost_equal, assert_array_equal,
+                           assert_allclose)
 from yapic_io import TiffConnector, Dataset, PredictionBatch
 import pytest
 
-from tifffile import memmap
+from tifffile import memmap, imread
 
 
 base_path = os.path.dirname(__file__)
@@ -333,6 +334,167 @@ class TestPredictionBatch(TestCase):
             # pass classifier results for each class to data source
             item.put_probmap_data(mock_classifier_result)
 
+    def _predict(self, savepath, multichannel=False, output_format=None,
+                 segmentation=False, **async_args):
+        img_dir = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        lbl_dir = os.path.join(base_path,
+                               '../test_data/tiffconnector_1/labels/')
+        os.makedirs(savepath)
+        c = TiffConnector(img_dir, lbl_dir, savepath=savepath)
+        p = PredictionBatch(Dataset(c), 3, (2, 5, 3))
+        if multichannel:
+            p.multichannel_output_on()
+        if segmentation:
+            p.segmentation_output_on()
+        if output_format:
+            p.set_output_format(*output_format)
+        if async_args:
+            p.async_output_on(**async_args)
+
+        for counter, item in enumerate(p):
+            pixels = item.pixels()
+            probmap = np.random.RandomState(counter).rand(
+                pixels.shape[0], 3, *pixels.shape[2:])
+            item.put_probmap_data(probmap)
+
+        return sorted(os.listdir(savepath))
+
+    def test_async_output(self):
+        direct = os.path.join(self.tmpdir, 'direct')
+        fnames = self._predict(direct)
+        self.assertEqual(len(fnames), 9)
+
+        for budget in (2**29, 5000, 10):
+            path = os.path.join(self.tmpdir, 'async_{}'.format(budget))
+            self.assertEqual(self._predict(path, max_buffer_bytes=budget,
+                                           max_queue=2), fnames)
+            for fname in fnames:
+                assert_array_equal(memmap(os.path.join(path, fname)),
+                                   memmap(os.path.join(direct, fname)))
+
+    def test_async_output_close_stops_writer(self):
+        img_dir = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        lbl_dir = os.path.join(base_path,
+                               '../test_data/tiffconnector_1/labels/')
+        direct = os.path.join(self.tmpdir, 'direct')
+        fnames = self._predict(direct)
+
+        path = os.path.join(self.tmpdir, 'async')
+        os.makedirs(path)
+        c = TiffConnector(img_dir, lbl_dir, savepath=path)
+        p = PredictionBatch(Dataset(c), 3, (2, 5, 3))
+        p.async_output_on(max_buffer_bytes=5000, max_queue=2)
+
+        for _ in range(2):
+            for counter, item in enumerate(p):
+                pixels = item.pixels()
+                probmap = np.random.RandomState(counter).rand(
+                    pixels.shape[0], 3, *pixels.shape[2:])
+                item.put_probmap_data(probmap)
+                thread = p.writer._thread
+
+            self.assertIsNone(p.writer)
+            self.assertFalse(thread.is_alive())
+            self.assertEqual(sorted(os.listdir(path)), fnames)
+            for fname in fnames:
+                assert_array_equal(memmap(os.path.join(path, fname)),
+                                   memmap(os.path.join(direct, fname)))
+
+    def test_async_output_multichannel(self):
+        direct = os.path.join(self.tmpdir, 'direct')
+        fnames = self._predict(direct, multichannel=True)
+        self.assertEqual(len(fnames), 3)
+
+        path = os.path.join(self.tmpdir, 'async')
+        self.assertEqual(self._predict(path, multichannel=True,
+                                       max_buffer_bytes=2**20), fnames)
+        for fname in fnames:
+            assert_array_equal(memmap(os.path.join(path, fname)),
+                               memmap(os.path.join(direct, fname)))
+
+    def test_output_formats(self):
+        import h5py
+        from yapic_io.tiff_connector import TiffConnector as T, tiff_metadata
+
+        direct = os.path.join(self.tmpdir, 'direct')
+        fnames = self._predict(direct, multichannel=True)
+        expected = [T._open_tiff(os.path.join(direct, f))[:] for f in fnames]
+
+        path = os.path.join(self.tmpdir, 'compressed')
+        self.assertEqual(self._predict(path, multichannel=True,
+                                       output_format=('compressed_tif',)),
+                         fnames)
+        for fname, val in zip(fnames, expected):
+            self.assertIsNone(tiff_metadata(os.path.join(path, fname)).offset)
+            assert_array_equal(T._open_tiff(os.path.join(path, fname))[:],
+                               val)
+
+        path = os.path.join(self.tmpdir, 'h5')
+        self._predict(path, multichannel=True, output_format=('h5',),
+                      max_buffer_bytes=2**20)
+        for fname, val in zip(fnames, expected):
+            h5_fname = os.path.splitext(fname)[0] + '.h5'
+            with h5py.File(os.path.join(path, h5_fname), 'r') as f:
+                assert_array_equal(f['probmap'][:], val)
+
+        zarr = pytest.importorskip('zarr')
+        path = os.path.join(self.tmpdir, 'zarr')
+        self._predict(path, multichannel=True, output_format=('zarr',))
+        for fname, val in zip(fnames, expected):
+            z = zarr.open(os.path.join(path,
+                                       os.path.splitext(fname)[0] + '.zarr'))
+            assert_array_equal(z[:], val)
+
+    def test_bounded_open_files(self):
+        direct = os.path.join(self.tmpdir, 'direct')
+        fnames = self._predict(direct)
+
+        for fmt in ('tif', 'compressed_tif'):
+            path = os.path.join(self.tmpdir, fmt)
+            self.assertEqual(self._predict(path,
+                                           output_format=(fmt, 'float32', 1)),
+                             fnames)
+            for fname in fnames:
+                assert_array_equal(
+                    imread(os.path.join(path, fname)).squeeze(),
+                    imread(os.path.join(direct, fname)).squeeze())
+
+    def test_quantized_output(self):
+        direct = os.path.join(self.tmpdir, 'direct')
+        fnames = self._predict(direct, multichannel=True)
+
+        for dtype, atol in (('float16', 1e-3), ('uint8', 0.5 / 255)):
+            path = os.path.join(self.tmpdir, dtype)
+            self.assertEqual(self._predict(path, multichannel=True,
+                                           output_format=('tif', dtype),
+                                           max_buffer_bytes=5000),
+                             fnames)
+            for fname in fnames:
+                val = memmap(os.path.join(path, fname))
+                self.assertEqual(val.dtype, np.dtype(dtype))
+                scale = 255 if dtype == 'uint8' else 1
+                assert_allclose(val / scale,
+                                memmap(os.path.join(direct, fname)),
+                                atol=atol)
+
+    def test_segmentation_output(self):
+        direct = os.path.join(self.tmpdir, 'direct')
+        fnames = self._predict(direct, multichannel=True)
+
+        for name, async_args in (('seg', {}),
+                                 ('seg_async', {'max_buffer_bytes': 500})):
+            path = os.path.join(self.tmpdir, name)
+            seg_fnames = self._predict(path, segmentation=True, **async_args)
+            self.assertEqual(seg_fnames,
+                             [os.path.splitext(f)[0] + '_segmentation.tif'
+                              for f in fnames])
+            for fname, seg_fname in zip(fnames, seg_fnames):
+                probmap = memmap(os.path.join(direct, fname))
+                seg = memmap(os.path.join(path, seg_fname))
+                self.assertEqual(seg.dtype, np.uint8)
+                assert_array_equal(seg.squeeze(),
+                                   np.argmax(probmap, axis=-1).squeeze() + 1)
+
     def test_pixel_dimensions(self):
 
         img_path = os.path.abspath(os.path.join(
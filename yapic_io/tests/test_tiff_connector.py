@@ -1,12 +1,15 @@
 import itertools
-from unittest import TestCase
+from unittest import TestCase, mock
 import os
+import shutil
 import numpy as np
 from numpy.testing import assert_array_equal
 from yapic_io.tiff_connector import TiffConnector
+from yapic_io.cache import HandleCache
 import yapic_io.tiff_connector as tc
 import logging
 from pathlib import Path
+from tifffile import imread, imwrite, memmap
 import pytest
 logger = logging.getLogger(os.path.basename(__file__))
 
@@ -134,6 +137,31 @@ class TestTiffConnector(TestCase):
         self.assertEqual(c1.labelvalue_mapping, c.labelvalue_mapping)
         self.assertEqual(c2.labelvalue_mapping, c.labelvalue_mapping)
 
+    def test_split_reuses_scan_results(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        lbl_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, lbl_path)
+        counts = [c.label_count_for_image(i) for i in range(3)]
+
+        with mock.patch.object(TiffConnector,
+                               '_original_label_count_for_image') as m:
+            c1, c2 = c.split(0.5)
+            c3 = c2.filter_labeled()
+            views = [c1, c2, c3]
+            for view in views:
+                for i, (img, _) in enumerate(view.filenames):
+                    j = [p.img for p in c.filenames].index(img)
+                    self.assertEqual(view.label_count_for_image(i),
+                                     counts[j])
+                    self.assertEqual(view.image_dimensions(i),
+                                     c.image_dimensions(j))
+            m.assert_not_called()
+
+        self.assertEqual(c1.image_count() + c2.image_count(), 3)
+        self.assertTrue(all(lbl is not None for _, lbl in c3.filenames))
+        self.assertIs(c3._parent, c)
+
     def test_load_filenames_emptyfolder(self):
         img_path = os.path.join(base_path, '../test_data/empty_folder/')
 
@@ -356,6 +384,67 @@ class TestTiffConnector(TestCase):
         except FileNotFoundError:
             pass
 
+    def test_put_tile_one_handle_per_image(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/*.tif')
+        c = TiffConnector(img_path, label_path, savepath=self.tmpdir)
+        pixels = np.ones((1, 2, 3), dtype=np.float32)
+
+        for label_value in (1, 2, 3):
+            c.put_tile(pixels * label_value, (0, 1, 1), 2, label_value,
+                       multichannel=3)
+        self.assertEqual(c.output_sink.n_open_files, 1)
+        self.assertIs(c._open_probability_map_file(2, 1, multichannel=3),
+                      c._open_probability_map_file(2, 3, multichannel=3))
+
+        c.close()
+        self.assertEqual(c.output_sink.n_open_files, 0)
+        probmap = memmap(os.path.join(self.tmpdir,
+                                      '6width4height3slices_rgb.tif'))
+        np.testing.assert_array_equal(probmap[0, 1:4, 1:3],
+                                      np.ones((3, 2, 3)) * [1, 2, 3])
+
+        # least recently used files are closed
+        c.output_sink.max_open_files = 2
+        for label_value in (1, 2, 3):
+            c.put_tile(pixels, (0, 1, 1), 2, label_value)
+            self.assertLessEqual(c.output_sink.n_open_files, 2)
+        c.flush()
+        self.assertEqual(c.output_sink.n_open_files, 2)
+
+    def test_put_tile_checks_removed_files_once_per_interval(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/*.tif')
+        c = TiffConnector(img_path, label_path, savepath=self.tmpdir)
+        sink = c.output_sink
+        pixels = np.ones((1, 2, 3), dtype=np.float32)
+        path = os.path.join(self.tmpdir,
+                            '6width4height3slices_rgb_class_1.tif')
+
+        with mock.patch.object(sink, '_is_valid',
+                               wraps=sink._is_valid) as m:
+            for _ in range(5):
+                c.put_tile(pixels, (0, 1, 1), 2, 1)
+            m.assert_not_called()
+
+            sink.check_interval = 0
+            c.put_tile(pixels, (0, 1, 1), 2, 1)
+            self.assertEqual(m.call_count, 1)
+
+        # removed files are created again
+        c.close()
+        c.put_tile(pixels, (0, 1, 1), 2, 1)
+        os.remove(path)
+        c.put_tile(pixels * 2, (0, 0, 0), 2, 1)
+        c.close()
+        probmap = memmap(path)
+        self.assertEqual(np.count_nonzero(probmap), 6)
+        self.assertEqual(probmap.max(), 2)
+
     def test_put_tile_1(self):
         img_path = os.path.join(
             base_path, '../test_data/tiffconnector_1/im/*.tif')
@@ -525,3 +614,213 @@ class TestTiffConnector(TestCase):
         original_labels = c.original_label_values_for_all_images()
         c.calc_label_values_mapping(original_labels)
         self.assertEqual(c.labelvalue_mapping, [{109: 1, 150: 2}])
+
+    def test_compressed_and_tiled_tiffs(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+
+        # write tiled (pixels) and compressed stripped (labels) copies
+        img_out = os.path.join(self.tmpdir, 'im')
+        lbl_out = os.path.join(self.tmpdir, 'labels')
+        os.makedirs(img_out)
+        os.makedirs(lbl_out)
+        for fname in Path(img_path).glob('*.tif'):
+            imwrite(os.path.join(img_out, fname.name), imread(str(fname)),
+                    tile=(16, 16), compression='zlib', photometric='rgb',
+                    metadata={'axes': 'ZYXS'})
+        for fname in Path(label_path).glob('*.tif'):
+            imwrite(os.path.join(lbl_out, fname.name), imread(str(fname)),
+                    compression='zlib', rowsperstrip=3,
+                    photometric='minisblack', metadata={'axes': 'ZYX'})
+
+        c_compressed = TiffConnector(img_out, lbl_out)
+
+        self.assertEqual(c_compressed.labelvalue_mapping,
+                         c.labelvalue_mapping)
+        for i in range(c.image_count()):
+            self.assertEqual(c_compressed.image_dimensions(i),
+                             c.image_dimensions(i))
+            self.assertEqual(c_compressed.label_count_for_image(i),
+                             c.label_count_for_image(i))
+
+        pos = (1, 1, 3, 18)
+        size = (2, 2, 30, 7)
+        assert_array_equal(c_compressed.get_tile(0, pos, size),
+                           c.get_tile(0, pos, size))
+        assert_array_equal(
+            c_compressed.label_tile(0, (0, 5, 2), (3, 20, 20), 2),
+            c.label_tile(0, (0, 5, 2), (3, 20, 20), 2))
+
+    def test_stats_cache(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(self.tmpdir, 'labels')
+        shutil.copytree(os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/'), label_path)
+
+        c = TiffConnector(img_path, label_path, stats_cache=True)
+        sidecar = os.path.join(label_path, '.yapic_io_stats.json')
+        self.assertTrue(os.path.isfile(sidecar))
+
+        counts = [c.label_count_for_image(i) for i in range(3)]
+        dims = [c.image_dimensions(i) for i in range(3)]
+
+        # second connector is served from sidecar file without reading
+        # any label or image data
+        with mock.patch.object(TiffConnector, '_open_label_file') as m1, \
+                mock.patch.object(TiffConnector, '_open_image_file') as m2:
+            c2 = TiffConnector(img_path, label_path, stats_cache=sidecar)
+            self.assertEqual(c2.labelvalue_mapping, c.labelvalue_mapping)
+            self.assertEqual([c2.label_count_for_image(i)
+                              for i in range(3)], counts)
+            self.assertEqual([c2.image_dimensions(i) for i in range(3)],
+                             dims)
+            m1.assert_not_called()
+            m2.assert_not_called()
+
+        # modified files are scanned again
+        fname = os.path.join(label_path, '6width4height3slices_rgb.tif')
+        lbl = imread(fname)
+        lbl[:] = 109
+        imwrite(fname, lbl, metadata={'axes': 'ZYX'})
+
+        c3 = TiffConnector(img_path, label_path, stats_cache=True)
+        self.assertEqual(c3.label_count_for_image(2), {2: 72})
+        self.assertEqual(c3.label_count_for_image(0), counts[0])
+
+    def test_coordinate_index(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(self.tmpdir, 'labels')
+        shutil.copytree(os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/'), label_path)
+
+        c = TiffConnector(img_path, label_path, coordinate_index=True)
+        self.assertTrue(c.has_label_coordinates())
+        self.assertFalse(TiffConnector(img_path, label_path)
+                         .has_label_coordinates())
+
+        for i in range(3):
+            counts = c.label_count_for_image(i) or {}
+            for label_value, count in counts.items():
+                coords = [c.label_index_to_coordinate(i, label_value, j)
+                          for j in range(count)]
+                self.assertEqual(len(set(tuple(x) for x in coords)), count)
+                for C, z, x, y in coords:
+                    lbl = c.label_tile(i, (z, x, y), (1, 1, 1), label_value)
+                    self.assertTrue(lbl.all())
+
+        index_file = os.path.join(label_path, '.yapic_io_coordinates',
+                                  '6width4height3slices_rgb.tif.npz')
+        self.assertTrue(os.path.isfile(index_file))
+
+        # second connector reads the index files
+        with mock.patch.object(TiffConnector, '_open_label_file') as m:
+            c2 = TiffConnector(img_path, label_path, coordinate_index=True)
+            assert_array_equal(c2.label_index_to_coordinate(2, 3, 1),
+                               c.label_index_to_coordinate(2, 3, 1))
+            m.assert_not_called()
+
+        # index of modified files is built again
+        fname = os.path.join(label_path, '6width4height3slices_rgb.tif')
+        lbl = imread(fname)
+        lbl[:] = 0
+        lbl[1, 2, 3] = 150
+        imwrite(fname, lbl, metadata={'axes': 'ZYX'})
+
+        c3 = TiffConnector(img_path, label_path, coordinate_index=True)
+        self.assertEqual(c3.label_count_for_image(2), {3: 1})
+        assert_array_equal(c3.label_index_to_coordinate(2, 3, 0),
+                           [0, 1, 3, 2])
+
+    def test_coordinate_index_float_labels(self):
+        img_path = os.path.join(self.tmpdir, 'im')
+        label_path = os.path.join(self.tmpdir, 'labels')
+        os.makedirs(img_path)
+        os.makedirs(label_path)
+        imwrite(os.path.join(img_path, 'img.tif'),
+                np.zeros((1, 4, 5), dtype=np.uint8), metadata={'axes': 'ZYX'})
+        lbl = np.zeros((1, 4, 5), dtype=np.float32)
+        lbl[0, 0, :2] = 1.5
+        lbl[0, 2, :] = 2
+        lbl[0, 3, 0] = -1
+        imwrite(os.path.join(label_path, 'img.tif'), lbl,
+                metadata={'axes': 'ZYX'})
+
+        c = TiffConnector(img_path, label_path)
+        for _ in range(2):  # index is built, then read from npz file
+            c2 = TiffConnector(img_path, label_path, coordinate_index=True)
+            self.assertEqual(c2.labelvalue_mapping,
+                             [{-1: 1, 1.5: 2, 2: 3}])
+            self.assertEqual(c2.label_count_for_image(0),
+                             c.label_count_for_image(0))
+            assert_array_equal(c2.label_index_to_coordinate(0, 2, 1),
+                               [0, 0, 1, 0])
+
+    def test_handle_cache(self):
+        img_path = os.path.join(self.tmpdir, 'im')
+        os.makedirs(img_path)
+        for i in range(15):
+            imwrite(os.path.join(img_path, 'img_{:02d}.tif'.format(i)),
+                    np.full((2, 4, 5), i, dtype=np.uint8),
+                    metadata={'axes': 'ZYX'})
+
+        c = TiffConnector(img_path, 'path/to/nowhere')
+        c.handle_cache = HandleCache(max_entries=20)
+
+        for _ in range(3):
+            for i in range(15):
+                self.assertEqual(c.get_tile(i, (0, 0, 0, 0), (1, 1, 1, 1)),
+                                 i)
+        # each file is opened only once
+        self.assertEqual(c.handle_cache.misses, 15)
+        self.assertEqual(c.handle_cache.hits, 30)
+        self.assertEqual(c.handle_cache.n_open_files, 15)
+
+        c.handle_cache.configure(max_open_files=5)
+        self.assertEqual(len(c.handle_cache), 5)
+
+        # files are checked for modifications only once per check_interval
+        with mock.patch('os.stat', wraps=os.stat) as m:
+            for _ in range(3):
+                c.get_tile(14, (0, 0, 0, 0), (1, 1, 1, 1))
+            m.assert_not_called()
+
+        # modified files are opened again after expiration of file stats
+        imwrite(os.path.join(img_path, 'img_14.tif'),
+                np.full((3, 4, 5), 100, dtype=np.uint8),
+                metadata={'axes': 'ZYX'})
+        c.handle_cache.expire_file_stats()
+        self.assertEqual(c.get_tile(14, (0, 0, 0, 0), (1, 1, 1, 1)), 100)
+
+    def test_dimensions_from_header(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+
+        with mock.patch.object(TiffConnector, '_open_image_file') as m:
+            c = TiffConnector(img_path, label_path)
+            self.assertEqual(c.image_dimensions(0), (3, 3, 40, 26))
+            m.assert_not_called()
+
+        with mock.patch.object(TiffConnector, '_open_label_file') as m:
+            c.check_label_matrix_dimensions()
+            self.assertEqual(c.label_matrix_dimensions(0), (1, 3, 40, 26))
+            m.assert_not_called()
+
+    def test_tiff_metadata(self):
+        path = os.path.join(self.tmpdir, 'czyx.tif')
+        imwrite(path, np.zeros((4, 2, 5, 6), dtype='>u2'),
+                metadata={'axes': 'CZYX'})
+
+        meta = tc.tiff_metadata(path)
+        self.assertEqual(meta.shape, (4, 2, 5, 6))
+        self.assertEqual(meta.axes, 'CZYX')
+        self.assertEqual(meta.dtype, np.dtype('>u2'))
+        self.assertIsNotNone(meta.offset)
+        self.assertEqual(meta.zyxc_shape, (2, 5, 6, 4))
+
+        imwrite(path, np.zeros((3, 5), dtype='uint8'), compression='zlib')
+        meta = tc.tiff_metadata(path)
+        self.assertIsNone(meta.offset)
+        self.assertEqual(meta.zyxc_shape, (1, 3, 5, 1))
@@ -392,6 +392,34 @@ class TestTrainingBatch(TestCase):
         m.augment_by_flipping(False)
         self.assertEqual(m.augmentation, {'rotate', 'shear'})
 
+        m.augment_fast_affine(True)
+        self.assertEqual(m.augmentation, {'rotate', 'shear', 'fast_affine'})
+        self.assertTrue(m._augment_params()['fast_affine'])
+
+    def test_set_interpolation_order(self):
+
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(base_path,
+                                  '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c)
+
+        m = TrainingBatch(d, (1, 3, 4), padding_zxy=(0, 2, 2))
+        m.augment_by_rotation(True, rotation_range=(10, 40))
+        self.assertNotIn('interpolation_order', m._augment_params())
+
+        next(m)
+        assert_array_equal(m._pixels, np.round(m._pixels))
+
+        m.set_interpolation_order(1)
+        self.assertEqual(m._augment_params()['interpolation_order'], 1)
+
+        next(m)
+        # pixels are interpolated, labels are not
+        self.assertFalse(np.all(m._pixels == np.round(m._pixels)))
+        self.assertEqual(set(np.unique(m._weights)) - {0, 1}, set())
+        self.assertEqual(m.split(0.5).interpolation_order, 1)
+
     def test_set_pixel_dimension_order(self):
 
         img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
@@ -78,6 +78,36 @@ class TestTransformations(TestCase):
         assert_array_equal(rot.astype(int), val)
         self.assertEqual(len(rot.shape), 3)
 
+    def test_warp_image_2d_stack_order(self):
+
+        im = np.zeros((2, 9, 9))
+        im[:, 4, :] = [[1], [3]]
+
+        nearest = tf.warp_image_2d_stack(im, 20, 0)
+        linear = tf.warp_image_2d_stack(im, 20, 0, order=1)
+
+        self.assertEqual(set(np.unique(nearest[0])), {0, 1})
+        self.assertGreater(len(np.unique(linear[0])), 2)
+        assert_array_equal(linear[1], 3 * linear[0])
+
+    def test_affine_gather(self):
+
+        np.random.seed(42)
+        im = np.random.rand(2, 3, 30, 36)
+        for rotation_angle, shear_angle in ((30, 0), (12, 4), (0, 5)):
+            grid = tf.affine_sampling_grid((10, 12), rotation_angle,
+                                           shear_angle)
+            for order in (0, 1):
+                lo, hi = tf.affine_support(grid, order=order)
+                self.assertTrue((lo >= -10).all() and (hi <= (20, 24)).all())
+
+                val = tf.warp_image_2d_stack(im, rotation_angle,
+                                             shear_angle, order=order)
+                res = tf.affine_gather(im, grid + [[[10]], [[12]]],
+                                       order=order)
+                np.testing.assert_allclose(res, val[..., 10:20, 12:24])
+        np.random.seed(None)
+
     @pytest.mark.skipif(sys.platform != 'linux', reason="Linux tests")
     def test_warp_image_2d_stack_4d(self):
         rotation_angle = 45
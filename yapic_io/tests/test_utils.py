@@ -191,3 +191,72 @@ class TestUtils(TestCase):
 
         pairs = ut.find_best_matching_pairs(a, b)
         self.assertEqual(pairs, val)
+
+    def test_find_best_matching_pairs_large(self):
+        a = ['img_{:04d}.tif'.format(i) for i in range(2000)]
+        b = ['img_{:04d}_Labels.tif'.format(i) for i in range(1999, 0, -2)]
+        pairs = ut.find_best_matching_pairs(a, b)
+
+        self.assertEqual(len(pairs), 2000)
+        for i, (img, lbl) in enumerate(pairs):
+            self.assertEqual(img, a[i])
+            if i % 2:
+                self.assertEqual(lbl, 'img_{:04d}_Labels.tif'.format(i))
+            else:
+                self.assertIsNone(lbl)
+
+    def test_find_best_matching_pairs_mixed(self):
+        # exact matches are found first, the rest is matched fuzzy
+        a = ['hund.tif', 'katze.tif', 'maus.tif']
+        b = ['mauser.tif', 'hund.tif', 'kater.tif']
+        val = [['hund.tif', 'hund.tif'], ['katze.tif', 'kater.tif'],
+               ['maus.tif', 'mauser.tif']]
+        self.assertEqual(ut.find_best_matching_pairs(a, b), val)
+
+    def test_find_best_matching_pairs_pair_by(self):
+        a = ['exp1_well_B02.tif', 'exp1_well_A01.tif', 'exp1_well_C03.tif']
+        b = ['A01_annotated.tif', 'B02_annotated.tif']
+        val = [['exp1_well_B02.tif', 'B02_annotated.tif'],
+               ['exp1_well_A01.tif', 'A01_annotated.tif'],
+               ['exp1_well_C03.tif', None]]
+
+        pairs = ut.find_best_matching_pairs(a, b, pair_by=r'([A-Z]\d\d)')
+        self.assertEqual(pairs, val)
+
+        def well(name):
+            return ''.join(c for c in name if c.isupper() or c.isdigit())[-3:]
+        pairs = ut.find_best_matching_pairs(a, b, pair_by=well)
+        self.assertEqual(pairs, val)
+
+    def test_label_histogram(self):
+        lbl = np.zeros((3, 20, 10, 2), dtype=np.uint16)
+        lbl[0, 2:5, 1:3, 0] = 2
+        lbl[2, :, 0, 0] = 300
+        lbl[1:, 10:, :, 1] = 1
+
+        expected = [{2: 6, 300: 20}, {1: 200}]
+        self.assertEqual(ut.label_histogram(lbl), expected)
+        # small blocks give the same result
+        self.assertEqual(ut.label_histogram(lbl, max_block_bytes=20), expected)
+        self.assertEqual(ut.label_histogram(lbl.astype(np.float32)), expected)
+        self.assertEqual(ut.label_histogram(lbl.astype(np.int64) * 10**7),
+                         [{2 * 10**7: 6, 300 * 10**7: 20}, {10**7: 200}])
+
+        # float and negative label values are kept as they are
+        lbl = np.zeros((1, 3, 4, 1), dtype=np.float32)
+        lbl[0, 0, :2, 0] = 1.5
+        lbl[0, 1, :, 0] = 2
+        lbl[0, 2, 0, 0] = -1
+        self.assertEqual(ut.label_histogram(lbl), [{-1: 1, 1.5: 2, 2: 4}])
+        self.assertEqual(ut.label_histogram(lbl.astype(np.int16) * 2),
+                         [{-2: 1, 2: 2, 4: 4}])
+
+    def test_iter_zy_blocks(self):
+        data = np.arange(4 * 6 * 5 * 1).reshape((4, 6, 5, 1))
+        blocks = list(ut.iter_zy_blocks(data, max_block_bytes=data[0].nbytes))
+
+        self.assertEqual(len(blocks), 4)
+        assert_array_equal(np.concatenate(blocks), data)
+
+        blocks = list(ut.iter_zy_blocks(data, max_block_bytes=1))
+        self.assertEqual(len(blocks), 24)
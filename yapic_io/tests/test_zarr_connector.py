@@ -0,0 +1,170 @@
+from unittest import TestCase
+import os
+import numpy as np
+from numpy.testing import assert_array_equal
+from pathlib import Path
+import pytest
+from tifffile import imread
+from yapic_io.tiff_connector import TiffConnector
+from yapic_io.connector import io_connector
+
+zarr = pytest.importorskip('zarr')
+from yapic_io.zarr_connector import ZarrConnector  # noqa: E402
+
+base_path = os.path.dirname(__file__)
+img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+lbl_path = os.path.join(base_path, '../test_data/tiffconnector_1/labels/')
+lbl_multi_path = os.path.join(base_path,
+                              '../test_data/tiffconnector_1/labels_multichannel/')
+
+
+def tif_to_zarr(tif_folder, out_folder, axes, chunks, suffix='.zarr'):
+    '''
+    writes all tif files of a folder as zarr stores with given axes order
+    '''
+    os.makedirs(out_folder, exist_ok=True)
+    for fname in sorted(Path(tif_folder).glob('*.tif')):
+        data = imread(str(fname))
+        if axes == 'CZYX':
+            # tif data is zyxc (pixels) or zyx (labels)
+            data = np.moveaxis(data, -1, 0) if data.ndim == 4 \
+                else data[np.newaxis]
+        path = os.path.join(out_folder, fname.stem + suffix)
+        store = zarr.N5Store(path) if suffix == '.n5' else path
+        z = zarr.open(store, mode='w', shape=data.shape, dtype=data.dtype,
+                      chunks=chunks[-data.ndim:])
+        z[:] = data
+        z.attrs['_ARRAY_DIMENSIONS'] = list(axes.lower())
+
+
+class TestZarrConnector(TestCase):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmpdir):
+        self.tmpdir = tmpdir.strpath
+        self.img_zarr = os.path.join(self.tmpdir, 'im')
+        self.lbl_zarr = os.path.join(self.tmpdir, 'labels')
+        tif_to_zarr(img_path, self.img_zarr, 'CZYX', (1, 2, 7, 5))
+        tif_to_zarr(lbl_path, self.lbl_zarr, 'CZYX', (1, 2, 7, 5))
+
+        self.t = TiffConnector(img_path, lbl_path)
+
+    def test_filenames(self):
+        c = ZarrConnector(self.img_zarr, self.lbl_zarr)
+
+        self.assertEqual(c.image_count(), 3)
+        self.assertEqual([str(p.img) for p in c.filenames],
+                         [Path(str(p.img)).stem + '.zarr'
+                          for p in self.t.filenames])
+        self.assertEqual(
+            [p.lbl is None for p in c.filenames],
+            [p.lbl is None for p in self.t.filenames])
+
+    def test_single_store(self):
+        path = os.path.join(self.img_zarr, '6width4height3slices_rgb.zarr')
+        c = ZarrConnector(path, 'path/to/nowhere')
+        self.assertEqual(c.image_count(), 1)
+        self.assertEqual(c.image_dimensions(0), (3, 3, 6, 4))
+
+    def test_image_dimensions(self):
+        c = ZarrConnector(self.img_zarr, self.lbl_zarr)
+        for i in range(c.image_count()):
+            self.assertEqual(c.image_dimensions(i),
+                             self.t.image_dimensions(i))
+
+    def test_get_tile(self):
+        c = ZarrConnector(self.img_zarr, self.lbl_zarr)
+
+        pos = (1, 1, 3, 2)
+        size = (2, 2, 20, 17)
+        assert_array_equal(c.get_tile(1, pos, size),
+                           self.t.get_tile(1, pos, size))
+
+    def test_label_values_and_counts(self):
+        c = ZarrConnector(self.img_zarr, self.lbl_zarr)
+
+        self.assertEqual(c.labelvalue_mapping, self.t.labelvalue_mapping)
+        for i in range(c.image_count()):
+            self.assertEqual(c.label_count_for_image(i),
+                             self.t.label_count_for_image(i))
+
+    def test_label_counts_not_from_stats_cache(self):
+        c = ZarrConnector(self.img_zarr, self.lbl_zarr, stats_cache=True)
+        image_nr = [i for i in range(c.image_count())
+                    if c.label_count_for_image(i)][0]
+        counts = c.label_count_for_image(image_nr)
+
+        # rewrite one chunk, store directory keeps its modification time
+        store = os.path.join(self.lbl_zarr, c.filenames[image_nr].lbl)
+        st = os.stat(store)
+        z = zarr.open(store, mode='r+')
+        z[0, 0, :7, :5] = 91
+        os.utime(store, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+        c2 = ZarrConnector(self.img_zarr, self.lbl_zarr, stats_cache=True)
+        counts2 = c2.label_count_for_image(image_nr)
+        self.assertNotEqual(counts2, counts)
+        self.assertEqual(sum(counts2.values()),
+                         np.count_nonzero(z[:]))
+
+    def test_label_tile(self):
+        c = ZarrConnector(self.img_zarr, self.lbl_zarr)
+
+        pos_zxy = (0, 2, 3)
+        size_zxy = (3, 25, 20)
+        for label_value in (1, 2, 3):
+            assert_array_equal(
+                c.label_tile(0, pos_zxy, size_zxy, label_value),
+                self.t.label_tile(0, pos_zxy, size_zxy, label_value))
+
+    def test_multichannel_labels_zyxc_axes(self):
+        lbl_zarr = os.path.join(self.tmpdir, 'labels_multichannel')
+        tif_to_zarr(lbl_multi_path, lbl_zarr, 'ZCYX', (1, 1, 8, 8))
+        img_zarr = os.path.join(self.tmpdir, 'im_zyxc')
+        tif_to_zarr(img_path, img_zarr, 'ZYXC', (2, 8, 8, 3))
+
+        c = ZarrConnector(img_zarr, lbl_zarr)
+        t = TiffConnector(img_path, lbl_multi_path)
+
+        self.assertEqual(c.labelvalue_mapping, t.labelvalue_mapping)
+        self.assertEqual(c.label_matrix_dimensions(0),
+                         t.label_matrix_dimensions(0))
+        assert_array_equal(c.label_tile(0, (0, 0, 0), (3, 40, 26), 4),
+                           t.label_tile(0, (0, 0, 0), (3, 40, 26), 4))
+
+    def test_n5(self):
+        img_n5 = os.path.join(self.tmpdir, 'im_n5')
+        lbl_n5 = os.path.join(self.tmpdir, 'labels_n5')
+        tif_to_zarr(img_path, img_n5, 'CZYX', (1, 2, 7, 5), suffix='.n5')
+        tif_to_zarr(lbl_path, lbl_n5, 'CZYX', (1, 2, 7, 5), suffix='.n5')
+
+        c = ZarrConnector(img_n5, lbl_n5, axes='CZYX')
+
+        self.assertEqual(c.labelvalue_mapping, self.t.labelvalue_mapping)
+        pos = (0, 0, 0, 0)
+        size = (3, 3, 40, 26)
+        assert_array_equal(c.get_tile(0, pos, size),
+                           self.t.get_tile(0, pos, size))
+
+    def test_split(self):
+        c = ZarrConnector(self.img_zarr, self.lbl_zarr)
+        c1, c2 = c.split(0.5)
+
+        self.assertIsInstance(c1, ZarrConnector)
+        self.assertIsInstance(c2, ZarrConnector)
+        self.assertEqual(c1.image_count() + c2.image_count(), 3)
+        self.assertEqual(c1.labelvalue_mapping, c.labelvalue_mapping)
+
+    def test_put_tile(self):
+        c = ZarrConnector(self.img_zarr, self.lbl_zarr, savepath=self.tmpdir)
+        pixels = np.ones((2, 3, 4), dtype=np.float32)
+        c.put_tile(pixels, (0, 1, 1), 0, 1)
+
+        probmap = imread(os.path.join(self.tmpdir,
+                                      '40width26height3slices_rgb_class_1.tif'))
+        self.assertEqual(probmap[0:2, 1:5, 1:4].sum(), 24)
+
+    def test_io_connector(self):
+        c = io_connector(os.path.join(self.img_zarr, '*.zarr'),
+                         os.path.join(self.lbl_zarr, '*.zarr'))
+        self.assertIsInstance(c, ZarrConnector)
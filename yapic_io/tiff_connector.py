@@ -1,6 +1,7 @@
 import logging
 import os
 import collections
+import copy
 from functools import lru_cache
 import yapic_io.utils as ut
 import numpy as np
@@ -9,6 +10,12 @@ import warnings
 from itertools import zip_longest
 from pathlib import Path
 from yapic_io.connector import Connector
+from yapic_io.lazy_array import TiffSegmentArray, ZYXCView
+from yapic_io.cache import decoded_segment_cache, handle_cache
+from yapic_io.stats_cache import get_stats_cache
+from yapic_io.coordinate_index import (LabelCoordinateIndex,
+                                      get_coordinate_index_dir)
+from yapic_io.probmap_sinks import TiffSink
 
 from tifffile import memmap, TiffFile
 
@@ -17,6 +24,67 @@ logger = logging.getLogger(os.path.basename(__file__))
 FilePair = collections.namedtuple('FilePair', ['img', 'lbl'])
 
 
+def _translate_axes(axes):
+    '''
+    The letter to represent each dimension may change depending on the
+    file generation. We transform this representation to Z, Y, X, C to
+    generalize the process.
+    '''
+    dims_dict = {'T': 'Z', 'S': 'C', 'Q': 'C'}
+    if 'S' in axes and 'Z' not in axes:
+        # e.g. rgb z-stacks without metadata (QYXS)
+        dims_dict['Q'] = 'Z'
+    return axes.translate(axes.maketrans(dims_dict))
+
+
+class TiffMetadata(collections.namedtuple(
+        'TiffMetadata', ['shape', 'dtype', 'axes', 'offset'])):
+    '''
+    Header information of the first image series of a tiff file.
+
+    Attributes
+    ----------
+    shape : tuple
+        Shape of the image data as stored in the file.
+    dtype : numpy.dtype
+        Data type (including byte order).
+    axes : str
+        Dimension order as stored in the file, e.g. `'ZCYX'`.
+    offset : int or None
+        Byte offset of contiguous image data, None if the image data
+        can not be memory mapped (e.g. compressed or tiled files).
+    '''
+    __slots__ = ()
+
+    @property
+    def zyxc_shape(self):
+        '''Shape in the order (Z, Y, X, C)'''
+        axes = _translate_axes(self.axes)
+        return tuple(int(self.shape[axes.index(a)]) if a in axes else 1
+                     for a in 'ZYXC')
+
+
+def tiff_metadata(path):
+    '''
+    Returns TiffMetadata of a tiff file without reading image data.
+
+    The header is parsed only once per file, results are cached as long
+    as size and modification time of the file are unchanged.
+    '''
+    st = os.stat(str(path))
+    return _read_tiff_metadata(str(path), st.st_size, st.st_mtime_ns)
+
+
+@lru_cache(maxsize=4096)
+def _read_tiff_metadata(path, size, mtime_ns):
+    with TiffFile(path) as tif:
+        series = tif.series[0]
+        return TiffMetadata(shape=tuple(series.shape),
+                            dtype=np.dtype(tif.byteorder + series.dtype.char),
+                            axes=series.axes,
+                            offset=series.dataoffset)
+
+
 def _handle_img_filenames(img_filepath):
     '''
     - checks if list of image filepaths, a single wildcard filepath
@@ -80,6 +148,31 @@ class TiffConnector(Connector):
     savepath : str, optional
         Directory to save pixel classifiaction results as probability
         images.
+    stats_cache : bool or str, optional
+        Persist label values, label counts and image dimensions of each
+        file in a json sidecar file. Unchanged files (same path, size and
+        modification time) are not scanned again when a connector is
+        created the next time. If True, the sidecar file is stored in the
+        label folder. A path defines a custom sidecar file location.
+    n_workers : int, optional
+        Number of threads for scanning image and label files (dimensions,
+        label values and label counts) at construction. Speeds up
+        construction for large datasets, especially on network storage.
+        Files are scanned serially by default.
+    pair_by : str or callable, optional
+        Rule for assigning label files to pixel files: a regular
+        expression (e.g. `r'(\d+)'`, the first group or the whole match is
+        compared) or a function mapping a filename to a key. By default,
+        files are paired by name (see utils.find_best_matching_pairs).
+    coordinate_index : bool or str, optional
+        Index coordinates of all labeled voxels (int32 zyx coordinates
+        per label value) while counting labels. Training tiles are then
+        fetched by label coordinate (see label_index_to_coordinate())
+        instead of random polling, which is much faster for sparse
+        labels in large images. The index is persisted in npz files next
+        to the label files (True) or in a custom folder (path) and is
+        rebuilt for modified label files. Recommended for sparse labels
+        only, since it takes 12 bytes per labeled voxel.
 
     Notes
     -----
@@ -91,6 +184,13 @@ class TiffConnector(Connector):
     output layer. Different labels from different channels can overlap
     (can share identical xyz positions).
 
+    Opened files are kept open in `yapic_io.cache.handle_cache`, which
+    is shared by all connectors. Its limits (nr of handles, open files
+    and memory mapped bytes) can be adjusted with
+    `handle_cache.configure()`. Files are checked for modifications
+    at most every `handle_cache.check_interval` seconds and when a new
+    connector is created.
+
     Examples
     --------
     Create a TiffConnector object with pixel and label data.
@@ -110,10 +210,15 @@ class TiffConnector(Connector):
     --------
     yapic_io.ilastik_connector.IlastikConnector
     '''
+    # cache for opened image, label and probability map files
+    handle_cache = handle_cache
 
-    def __init__(self, img_filepath, label_filepath, savepath=None):
+    def __init__(self, img_filepath, label_filepath, savepath=None,
+                 stats_cache=None, n_workers=None, pair_by=None,
+                 coordinate_index=None):
 
-        self.img_path, img_filenames = _handle_img_filenames(img_filepath)
+        self.img_path, img_filenames = self._handle_img_filenames(
+            img_filepath)
         self.label_path, lbl_filenames = self._handle_lbl_filenames(
             label_filepath)
 
@@ -123,7 +228,8 @@ class TiffConnector(Connector):
         if lbl_filenames is None or len(lbl_filenames) == 0:
             pairs = [(img, None) for img in img_filenames]
         else:
-            pairs = ut.find_best_matching_pairs(img_filenames, lbl_filenames)
+            pairs = ut.find_best_matching_pairs(img_filenames, lbl_filenames,
+                                                pair_by=pair_by)
 
         self._assemble_filenames(pairs)
 
@@ -132,6 +238,20 @@ class TiffConnector(Connector):
                               for pair in self.filenames))
 
         self.savepath = Path(savepath) if savepath is not None else None
+        # output format of probability maps (see yapic_io.probmap_sinks)
+        self.output_sink = TiffSink()
+        self.stats_cache = get_stats_cache(stats_cache, self.label_path)
+        self.n_workers = n_workers
+        self.pair_by = pair_by
+        self.coordinate_index_dir = get_coordinate_index_dir(
+            coordinate_index, self.label_path)
+        # label coordinate index per label file (shared by views)
+        self._coordinate_indices = {}
+        self.handle_cache.expire_file_stats()
+
+        # connector this is a view of (see _view)
+        self._parent = None
+        self._parent_image_nrs = None
 
         original_labels = self.original_label_values_for_all_images()
         self.labelvalue_mapping = self.calc_label_values_mapping(
@@ -139,13 +259,53 @@ class TiffConnector(Connector):
 
         self.check_label_matrix_dimensions()
 
+        if self.stats_cache is not None:
+            self.stats_cache.save()
+
     def _assemble_filenames(self, pairs):
         self.filenames = [FilePair(Path(img), Path(lbl) if lbl else None)
                           for img, lbl in pairs]
 
+    def _handle_img_filenames(self, img_filepath):
+        return _handle_img_filenames(img_filepath)
+
     def _handle_lbl_filenames(self, label_filepath):
         return _handle_img_filenames(label_filepath)
 
+    def _view(self, image_nrs):
+        '''
+        Returns a connector for a subset of images (used by split() and
+        filter_labeled()).
+
+        The view shares settings, labelvalue mapping and scan results
+        (label counts) with this connector, so nothing is scanned again.
+        '''
+        view = copy.copy(self)
+        view.filenames = [self.filenames[i] for i in image_nrs]
+
+        if self._parent is None:
+            view._parent = self
+            view._parent_image_nrs = [int(i) for i in image_nrs]
+        else:  # view of a view: refer to the original connector
+            view._parent_image_nrs = [self._parent_image_nrs[i]
+                                      for i in image_nrs]
+        return view
+
+    def _cached_stat(self, path, name, compute):
+        '''
+        Returns a scan result for a file from the stats cache. If not
+        cached, it is computed with `compute()` (must return a json
+        serializable value) and stored in the cache.
+        '''
+        if self.stats_cache is None:
+            return compute()
+
+        value = self.stats_cache.get(path, name)
+        if value is None:
+            value = compute()
+            self.stats_cache.put(path, **{name: value})
+        return value
+
     def __repr__(self):
 
         infostring = \
@@ -168,14 +328,9 @@ class TiffConnector(Connector):
         TiffConnector
             Connector object containing only images with labels.
         '''
-        img_fnames = [self.img_path / img for img, lbl in self.filenames
-                      if lbl is not None]
-
-        lbl_fnames = [self.label_path / lbl
-                      for img, lbl in self.filenames
-                      if lbl is not None]
-
-        return TiffConnector(img_fnames, lbl_fnames, savepath=self.savepath)
+        image_nrs = [i for i, (img, lbl) in enumerate(self.filenames)
+                     if lbl is not None]
+        return self._view(image_nrs)
 
     def _split_img_fnames(self, fraction, random_seed=42):
         # i took this out from the split method to be used in split method
@@ -225,24 +380,12 @@ class TiffConnector(Connector):
         connector_1, connector_2
         '''
 
-        img_fnames1, img_fnames2, mask = self._split_img_fnames(
-            fraction,
-            random_seed=random_seed)
-
-        lbl_fnames1 = [self.label_path / lbl if lbl is not None else None
-                       for img, lbl in itertools.compress(self.filenames,
-                                                          mask)]
-        lbl_fnames2 = [self.label_path / lbl if lbl is not None else None
-                       for img, lbl in itertools.compress(self.filenames,
-                                                          ~mask)]
-
-        conn1 = TiffConnector(img_fnames1, lbl_fnames1, savepath=self.savepath)
-        conn2 = TiffConnector(img_fnames2, lbl_fnames2, savepath=self.savepath)
+        _, _, mask = self._split_img_fnames(fraction,
+                                            random_seed=random_seed)
 
-        # ensures that both resulting tiff_connectors have the same
-        # labelvalue mapping (issue #1)
-        conn1.labelvalue_mapping = self.labelvalue_mapping
-        conn2.labelvalue_mapping = self.labelvalue_mapping
+        # both connectors share the labelvalue mapping (issue #1)
+        conn1 = self._view(np.flatnonzero(mask))
+        conn2 = self._view(np.flatnonzero(~mask))
 
         # np.random.seed(None)
         return conn1, conn2
@@ -250,28 +393,30 @@ class TiffConnector(Connector):
     def image_count(self):
         return len(self.filenames)
 
-    @lru_cache(maxsize=10)
     def _open_probability_map_file(self,
                                    image_nr,
                                    label_value,
                                    multichannel=False):
-        # memmap is slow, so we must cache it to be fast!
         fname = self.filenames[image_nr].img
         if multichannel:
-            fname = Path('{}.tif'.format(fname.stem))
+            stem = fname.stem
             n_classes = multichannel
             C = n_classes
         else:
-            fname = Path('{}_class_{}.tif'.format(fname.stem, label_value))
+            stem = '{}_class_{}'.format(fname.stem, label_value)
             C = 1  # channel in output probmap
 
-        path = self.savepath / fname
+        path = self.savepath / (stem + self.output_sink.extension)
+        _, Z, X, Y = self.image_dimensions(image_nr)
+        return self.output_sink.open(path, (Z, Y, X, C))
 
-        if not path.exists():  # created "empty" tif of shape
-            _, Z, X, Y = self.image_dimensions(image_nr)
-            return memmap(path, shape=(Z, Y, X, C), dtype='float32')
+    def _open_segmentation_file(self, image_nr, dtype):
+        fname = self.filenames[image_nr].img
+        stem = '{}_segmentation'.format(fname.stem)
 
-        return memmap(path)
+        path = self.savepath / (stem + self.output_sink.extension)
+        _, Z, X, Y = self.image_dimensions(image_nr)
+        return self.output_sink.open(path, (Z, Y, X, 1), dtype=dtype)
 
     def put_tile(self,
                  pixels,
@@ -283,7 +428,7 @@ class TiffConnector(Connector):
         assert self.savepath is not None
         np.testing.assert_equal(len(pos_zxy), 3)
         np.testing.assert_equal(len(pixels.shape), 3)
-        pixels = np.array(pixels, dtype=np.float32)
+        pixels = self.output_sink.quantize(pixels)
 
         slices = self._open_probability_map_file(image_nr,
                                                  label_value,
@@ -292,6 +437,46 @@ class TiffConnector(Connector):
         C = 0
         if multichannel:
             C = label_value - 1
+        self._write_tile(slices, pixels, pos_zxy, C)
+
+    def put_segmentation_tile(self, pixels, pos_zxy, image_nr):
+        '''
+        Puts classification result as label values (e.g. argmax of
+        probabilities) to a label image with suffix _segmentation.
+
+        Parameters
+        ----------
+        pixels : numpy.ndarray
+            3D tile of label values (z, x, y), the integer dtype of pixels
+            (e.g. uint8 or uint16) is the dtype of the label image.
+        pos_zxy : (z, x, y)
+            Upper left position of tile.
+        image_nr : int
+            Index of image.
+        '''
+        assert self.savepath is not None
+        np.testing.assert_equal(len(pos_zxy), 3)
+        np.testing.assert_equal(len(pixels.shape), 3)
+
+        slices = self._open_segmentation_file(image_nr, pixels.dtype)
+        self._write_tile(slices, pixels, pos_zxy, 0)
+
+    def flush(self):
+        '''
+        Writes pending probability map data to disk. Output files are kept
+        open.
+        '''
+        self.output_sink.flush()
+
+    def close(self):
+        '''
+        Writes pending probability map data and closes all output files.
+        Output files are reopened if more tiles are put.
+        '''
+        self.output_sink.close()
+
+    @staticmethod
+    def _write_tile(slices, pixels, pos_zxy, C):
         Z, X, Y = pos_zxy
         ZZ, XX, YY = np.array(pos_zxy) + pixels.shape
 
@@ -321,16 +506,10 @@ class TiffConnector(Connector):
         connector_1, connector_2
         """
         # target dims (Z,Y,X,C)
-        with TiffFile(path) as tif:
-            axes = tif.series[0].axes
+        axes = tiff_metadata(path).axes
 
         # Adding the missed axis
-        dims_dict = {'T': 'Z', 'S': 'C', 'Q': 'C'}
-        # The letter to represent each dimension may change depending on the
-        # file generation.
-        # We will transform this representation to Z, Y, X, C to generalize
-        # the process
-        axes = axes.translate(axes.maketrans(dims_dict))
+        axes = _translate_axes(axes)
         if 'C' not in axes:
             memmap_array = np.expand_dims(memmap_array, axis=-1)
             axes += 'C'
@@ -343,21 +522,58 @@ class TiffConnector(Connector):
         memmap_array = np.moveaxis(memmap_array, (0, 1, 2, 3), dim_map)
         return memmap_array
 
-    @lru_cache(maxsize=10)
+    @staticmethod
+    def _open_tiff(path):
+        '''
+        Returns array-like object with shape: z, y, x, c
+
+        Uncompressed tiffs are memory mapped. Compressed or tiled tiffs
+        can not be memory mapped, for these only the strips or tiles
+        overlapping a requested region are decoded (and cached).
+        '''
+        meta = tiff_metadata(path)
+        if meta.offset is None:
+            logger.debug('%s is not memory-mappable, decoding strips/tiles '
+                         'on demand', path)
+            data = TiffSegmentArray(path, cache=decoded_segment_cache)
+            return ZYXCView(data, _translate_axes(data.axes))
+
+        # same as tifffile.memmap, but without parsing the header again
+        data = np.memmap(str(path), dtype=meta.dtype, mode='r+',
+                         offset=meta.offset, shape=meta.shape)
+        return TiffConnector.fix_dims(data, path)
+
     def _open_image_file(self, image_nr):
         """Returns memmap object with shape: z, y, x, c"""
         # memmap is slow, so we must cache it to be fast!
         path = self.img_path / self.filenames[image_nr].img
-        im_data = memmap(path)
-        return self.fix_dims(im_data, path)  # shape order: z, y, x, c
+        # shape order: z, y, x, c
+        return self.handle_cache.get_file(path, lambda: self._open_tiff(path))
 
     def image_dimensions(self, image_nr):
         """returns a tuple representing the size of the image in the
         order of: C, Z, X, Y"""
-        img = self._open_image_file(image_nr)
-        Z, Y, X, C = img.shape
+        path = self.img_path / self.filenames[image_nr].img
+        Z, Y, X, C = self._cached_stat(
+            path, 'shape', lambda: list(self._image_file_shape(image_nr)))
         return (C, Z, X, Y)
 
+    def _image_file_shape(self, image_nr):
+        '''
+        Returns shape (Z, Y, X, C) of a pixel image (read from the file
+        header, no pixel data is read).
+        '''
+        path = self.img_path / self.filenames[image_nr].img
+        return tiff_metadata(path).zyxc_shape
+
+    def _label_file_shape(self, image_nr):
+        '''
+        Returns shape (Z, Y, X, C) of a label image (read from the file
+        header, no label data is read).
+        '''
+        path = self.label_path / self.filenames[image_nr].lbl
+        return tiff_metadata(path).zyxc_shape
+
     def label_matrix_dimensions(self, image_nr):
         '''
         Get dimensions of the label image.
@@ -373,11 +589,12 @@ class TiffConnector(Connector):
         (nr_channels, nr_zslices, nr_x, nr_y)
             Labelmatrix shape.
         '''
-        lbl = self._open_label_file(image_nr)
-        if lbl is None:
+        if self.filenames[image_nr].lbl is None:
             return
 
-        Z, Y, X, C = lbl.shape
+        path = self.label_path / self.filenames[image_nr].lbl
+        Z, Y, X, C = self._cached_stat(
+            path, 'shape', lambda: list(self._label_file_shape(image_nr)))
         return (C, Z, X, Y)
 
     def check_label_matrix_dimensions(self):
@@ -392,9 +609,13 @@ class TiffConnector(Connector):
         '''
         N_channels = None
 
+        dims = ut.parallel_map(
+            lambda i: (self.image_dimensions(i),
+                       self.label_matrix_dimensions(i)),
+            range(self.image_count()), self.n_workers)
+
         for i, (img_fname, lbl_fname) in enumerate(self.filenames):
-            img_dim = self.image_dimensions(i)
-            lbl_dim = self.label_matrix_dimensions(i)
+            img_dim, lbl_dim = dims[i]
 
             msg = 'Dimensions for image #{}: img.shape={}, lbl.shape={}'
             logger.debug(msg.format(i, img_dim, lbl_dim))
@@ -441,25 +662,46 @@ class TiffConnector(Connector):
         return tile.astype('float')
 
     def label_tile(self, image_nr, pos_zxy, size_zxy, label_value):
-        Z, X, Y = pos_zxy
-        ZZ, XX, YY = np.array(pos_zxy) + size_zxy
         C, original_label_value = self._mapped_label_value_to_original(
             label_value)
+        tile = self.label_value_tile(image_nr, pos_zxy, size_zxy, C)
+        return tile == original_label_value
+
+    def label_value_tile(self, image_nr, pos_zxy, size_zxy, channel=0):
+        '''
+        Get 3d zxy matrix of original label values of one label channel.
+        All labels of a tile are read at once (compare label_tile).
+
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+        pos_zxy : (zslice, x, y)
+            Upper left position of subsection.
+        size_zxy : (nr_zslices, nr_x, nr_y)
+            Size of subsection.
+        channel : int
+            Label channel (see labelvalue_mapping).
+
+        Returns
+        -------
+        numpy.ndarray
+            3D subsection of label channel with original label values in
+            dimension order (z, x, y). 0 means unlabeled.
+        '''
+        Z, X, Y = pos_zxy
+        ZZ, XX, YY = np.array(pos_zxy) + size_zxy
 
         slices = self._open_label_file(image_nr)
         if slices is None:
-            # return tile with False values
-            return np.zeros(size_zxy) != 0
+            # return tile without labels
+            return np.zeros(size_zxy, dtype=np.uint8)
 
-        tile = np.array(slices[Z: ZZ, Y: YY, X: XX, C])
-        tile = np.moveaxis(tile, (0, 1, 2), (0, 2, 1))
-        tile = (tile == original_label_value)
-        return tile
+        tile = np.array(slices[Z: ZZ, Y: YY, X: XX, channel])
+        return np.moveaxis(tile, (0, 1, 2), (0, 2, 1))
 
-    @lru_cache(maxsize=10)
     def _open_label_file(self, image_nr):
         # memmap is slow, so we must cache it to be fast!
-        path = self.img_path / self.filenames[image_nr].img
         label_filename = self.filenames[image_nr].lbl
 
         if label_filename is None:
@@ -470,9 +712,67 @@ class TiffConnector(Connector):
         path = self.label_path / label_filename
         logger.debug('Trying to load labelmat %s', path)
 
-        lbl_data = memmap(path)
+        # shape order: z, y, x, c
+        return self.handle_cache.get_file(path, lambda: self._open_tiff(path))
+
+    def has_label_coordinates(self):
+        return self.coordinate_index_dir is not None
 
-        return self.fix_dims(lbl_data, path)  # shape order: z, y, x, c
+    def _label_coordinate_index(self, image_nr):
+        '''
+        Returns the LabelCoordinateIndex of the label file of an image.
+        The index is read from its npz file or built and saved (if the
+        npz file does not exist or is outdated).
+        '''
+        label_filename = self.filenames[image_nr].lbl
+        path = self.label_path / label_filename
+        index = self._coordinate_indices.get(path)
+        if index is not None:
+            return index
+
+        index_path = self.coordinate_index_dir / (str(label_filename) +
+                                                  '.npz')
+        index = LabelCoordinateIndex.load(index_path, path)
+        if index is None:
+            logger.debug('Building label coordinate index for %s', path)
+            index = LabelCoordinateIndex.from_label_data(
+                self._open_label_file(image_nr))
+            index.save(index_path, path)
+
+        self._coordinate_indices[path] = index
+        return index
+
+    def label_index_to_coordinate(self, image_nr, label_value, label_index):
+        '''
+        Get image coordinate for specific label (only available with
+        `coordinate_index`).
+
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+        label_value : int
+            Id of the label (mapped label value).
+        label_index: int
+            Value between 0 and count[label_value].
+            Label count can be retrieved with self.label_count_for_image
+            method.
+
+        Returns
+        -------
+        ndarray
+            czxy coordinate of a specific label (specified by the
+            label index) with labelvalue label_value (mapped label value).
+        '''
+        assert self.has_label_coordinates(), \
+            'Label coordinates are not indexed, set coordinate_index'
+        C, original_label_value = self._mapped_label_value_to_original(
+            label_value)
+        coords = self._label_coordinate_index(image_nr).coordinates(
+            C, original_label_value)
+        z, y, x = coords[label_index]
+
+        return np.array([C, z, x, y])
 
     @staticmethod
     def calc_label_values_mapping(original_labels):
@@ -527,15 +827,15 @@ class TiffConnector(Connector):
         '''
         labels_per_channel = []
 
-        for image_nr in range(self.image_count()):
-            slices = self._open_label_file(image_nr)
-            if slices is None:
+        # values and counts are collected in the same pass over the
+        # label data, counts are needed later anyway
+        all_counts = ut.parallel_map(self._original_label_count_for_image,
+                                     range(self.image_count()),
+                                     self.n_workers)
+        for counts in all_counts:
+            if counts is None:
                 continue
-
-            C = slices.shape[-1]
-            labels = [np.unique(slices[..., c]) for c in range(C)]
-
-            labels = [set(labels) - {0} for labels in labels]
+            labels = [set(cnt.keys()) for cnt in counts]
 
             labels_per_channel = [l1.union(l2)
                                   for l1, l2 in zip_longest(labels_per_channel,
@@ -558,18 +858,39 @@ class TiffConnector(Connector):
         -------
         dict
         '''
-        slices = self._open_label_file(image_nr)
-        if slices is None:
-            return None
-
-        C = slices.shape[-1]
-        labels = [np.unique(slices[..., c]) for c in range(C)]
+        if self._parent is not None:
+            return self._parent.label_count_for_image(
+                self._parent_image_nrs[image_nr])
 
-        original_label_count = [{l: np.count_nonzero(slices[..., c] == l)
-                                 for l in labels[c] if l > 0}
-                                for c in range(C)]
+        original_label_count = self._original_label_count_for_image(image_nr)
+        if original_label_count is None:
+            return None
 
         label_count = {self.labelvalue_mapping[c][l]: count
                        for c, orig in enumerate(original_label_count)
                        for l, count in orig.items()}
         return label_count
+
+    @lru_cache(maxsize=1500)
+    def _original_label_count_for_image(self, image_nr):
+        '''
+        Returns for each label channel a dict with original label values
+        as keys and label counts as values.
+        '''
+        if self.filenames[image_nr].lbl is None:
+            return None
+
+        def count_labels():
+            if self.has_label_coordinates():
+                # coordinates are indexed in the same pass
+                histogram = self._label_coordinate_index(
+                    image_nr).label_histogram()
+            else:
+                histogram = ut.label_histogram(
+                    self._open_label_file(image_nr))
+            return [[[l, n] for l, n in cnt.items()] for cnt in histogram]
+
+        path = self.label_path / self.filenames[image_nr].lbl
+        counts = self._cached_stat(path, 'label_counts', count_labels)
+        return [{l: n for l, n in counts_per_channel}
+                for counts_per_channel in counts]
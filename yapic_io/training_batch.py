@@ -85,6 +85,7 @@ class TrainingBatch(Minibatch):
         self.augment_by_flipping(True)
         self.rotation_range = None
         self.shear_range = None
+        self.interpolation_order = 0
         self._pixels = None
         self._weights = None
 
@@ -124,15 +125,17 @@ class TrainingBatch(Minibatch):
         were not labeled. It must be used only when the pixel_connector
         is NapariConnector."""
         labeled_slices = self.dataset.pixel_connector.effective_slices()
-        # list of tuples with (img_id, z_slice)
-        slices_with_ids = []
-        for img_id, value in labeled_slices.items():
-            tmp = [(img_id, v) for v in value]
-            slices_with_ids += tmp
+        # set of tuples with (img_id, z_slice)
+        slices_with_ids = set((img_id, z)
+                              for img_id, value in labeled_slices.items()
+                              for z in value)
+        size_z = self.tile_size_zxy[0]
         output = dict()
         for label_id, tiles in self.tile_pos_for_label.items():
             output[label_id] = [
-                tile for tile in tiles if tile[:2] in slices_with_ids]
+                tile for tile in tiles
+                if any((tile[0], z) in slices_with_ids
+                       for z in range(tile[1], tile[1] + size_z))]
         return output
 
     def augment_by_flipping(self, flip_on):
@@ -185,6 +188,39 @@ class TrainingBatch(Minibatch):
         else:
             self.augmentation.discard('shear')
 
+    def set_interpolation_order(self, order):
+        '''
+        Data augmentation setting. Interpolation order of pixels for
+        rotation and shear. Labels are always interpolated with nearest
+        neighbour.
+
+        Parameters
+        ----------
+        order: int
+            0: nearest neighbour (default), 1: bilinear, 3: bicubic.
+            The fast affine method supports orders 0 and 1 only (see
+            augment_fast_affine()).
+        '''
+        self.interpolation_order = int(order)
+
+    def augment_fast_affine(self, fast_on):
+        '''
+        Data augmentation setting. Rotation and shear are computed with
+        a faster method: only the image region needed for the sampled
+        angles is read, and all channels and z-slices are sampled at once.
+        Results are the same as with the default method, as long as the
+        rotated tile lies within the 3 times larger default region.
+
+        Parameters
+        ----------
+        fast_on: bool
+            If ``True``, rotation and shear use the fast method.
+        '''
+        if fast_on:
+            self.augmentation.add('fast_affine')
+        else:
+            self.augmentation.discard('fast_affine')
+
     def pixels(self):
         pix = self._normalize(self._pixels).astype(self.float_data_type)
 
@@ -255,16 +291,24 @@ class TrainingBatch(Minibatch):
         if 'shear' in self.augmentation:
             augment_params['shear_angle'] = random.uniform(*self.shear_range)
 
+        if 'fast_affine' in self.augmentation:
+            augment_params['fast_affine'] = True
+
+        if self.interpolation_order != 0:
+            augment_params['interpolation_order'] = self.interpolation_order
+
         return augment_params
 
     def remove_unlabeled_tiles(self):
         '''
-        Scans all pixels and labels for all tiles. Removes all tile positions
-        that do not contain labels.
+        Removes all tile positions that do not contain labels.
+        Labels of all tiles are counted with the summed-area tables of
+        the dataset (see Dataset.label_count_in_tile), pixels are not read.
+        With binned tables (default), some tiles close to labels may be
+        kept. They are removed when drawn by _random_tile().
         '''
 
         labels = np.array(sorted(self.labels))
-        channels = np.array(sorted(self.channels))
 
         # Removing tiles from unlabeled slices
         if type(self.dataset.pixel_connector) == NapariConnector:
@@ -275,26 +319,20 @@ class TrainingBatch(Minibatch):
             positions = self.tile_pos_for_label[label]
             n_pos = len(positions)
 
-            for i, pos in enumerate(positions):
-                image_nr = pos[0]
-                pos_zxy = pos[1:]
+            pos = np.array(positions, dtype=np.int64).reshape(-1, 4)
+            is_labeled = np.zeros(n_pos, dtype=bool)
+            for image_nr in np.unique(pos[:, 0]):
+                is_img = pos[:, 0] == image_nr
+                is_labeled[is_img] = self.dataset.label_count_in_tile(
+                    image_nr, pos[is_img, 1:], self.tile_size_zxy, label) > 0
 
-                tile_data = self.dataset.training_tile(
-                    image_nr,
-                    pos_zxy,
-                    self.tile_size_zxy,
-                    channels,
-                    labels,
-                    pixel_padding=self.padding_zxy,
-                    augment_params=None)
-
-                if not _are_weights_in_tile(tile_data, label):
-                    # remove tile position for the label, since no labels here
-                    self.tile_pos_for_label[label].pop(i)
-            n_pos_after = len(self.tile_pos_for_label[label])
+            self.tile_pos_for_label[label] = [
+                p for p, keep in zip(positions, is_labeled) if keep]
+            n_removed = n_pos - len(self.tile_pos_for_label[label])
 
             logger.info('removed {} tiles of {} for label {} ({}%)'.format(
-                n_pos_after, n_pos, label, round(n_pos_after/n_pos*100., 2)))
+                n_removed, n_pos, label,
+                round(n_removed/max(n_pos, 1)*100., 2)))
 
     def split(self, fraction):
         '''
@@ -378,6 +416,7 @@ class TrainingBatch(Minibatch):
         out.augmentation = self.augmentation
         out.rotation_range = self.rotation_range
         out.shear_range = self.shear_range
+        out.interpolation_order = self.interpolation_order
 
         out.tile_pos_for_label = tile_pos_for_label_out
 
@@ -390,6 +429,7 @@ class TrainingBatch(Minibatch):
 
         # random pollng loop
         counter = 0
+        tile_data = None
         while counter <= len(self.tile_pos_for_label[for_label]):
             counter += 1
             pos = self.tile_pos_for_label[for_label]
@@ -403,6 +443,12 @@ class TrainingBatch(Minibatch):
             image_nr = pos_selected[0]
             pos_zxy = pos_selected[1:]
 
+            if not self.dataset.label_count_in_tile(
+                    image_nr, pos_zxy, self.tile_size_zxy, for_label):
+                # no labels here, skip reading pixels
+                self.tile_pos_for_label[for_label].pop(choice)
+                continue
+
             labels = np.array(sorted(self.labels))
             channels = np.array(sorted(self.channels))
             tile_data = self.dataset.training_tile(
@@ -430,6 +476,17 @@ class TrainingBatch(Minibatch):
                'within {} trials').format(for_label, counter)
         logger.warning(msg)
 
+        if tile_data is None:
+            # all checked positions without labels
+            tile_data = self.dataset.training_tile(
+                image_nr,
+                pos_zxy,
+                self.tile_size_zxy,
+                np.array(sorted(self.channels)),
+                np.array(sorted(self.labels)),
+                pixel_padding=self.padding_zxy,
+                augment_params=self._augment_params())
+
         return tile_data
 
 
@@ -2,6 +2,7 @@
 matrix transformation functions
 '''
 
+from functools import lru_cache
 import numpy as np
 from skimage import transform as tf
 import logging
@@ -30,7 +31,11 @@ def get_transform(image, rotation_angle, shear_angle):
         msg = 'Image has {} dimensions, must have 2.'.format(image.ndim)
         raise ValueError(msg)
 
-    shift_y, shift_x = np.array(image.shape[:2]) / 2.
+    return _centered_transform(image.shape, rotation_angle, shear_angle)
+
+
+def _centered_transform(shape, rotation_angle, shear_angle):
+    shift_y, shift_x = np.array(shape[:2]) / 2.
     tf_rotate_shear = tf.AffineTransform(rotation=np.deg2rad(rotation_angle),
                                          shear=np.deg2rad(shear_angle))
     tf_shift = tf.AffineTransform(translation=[-shift_x, -shift_y])
@@ -40,7 +45,7 @@ def get_transform(image, rotation_angle, shear_angle):
     return tf_center_rot
 
 
-def warp_image_2d(image, rotation_angle, shear_angle):
+def warp_image_2d(image, rotation_angle, shear_angle, order=0):
     '''
     Warps 2d matrix with affine transform.
 
@@ -55,6 +60,8 @@ def warp_image_2d(image, rotation_angle, shear_angle):
         angle in degrees
     shear_angle: float
         angle in degrees
+    order : int, optional
+        Interpolation order (0: nearest neighbour, 1: bilinear, ...).
 
     Returns
     -------
@@ -66,9 +73,11 @@ def warp_image_2d(image, rotation_angle, shear_angle):
         raise ValueError(msg)
 
     t = get_transform(image, rotation_angle, shear_angle)
-    return tf.warp(image, t, order=0, mode='symmetric', preserve_range=True)
+    return tf.warp(image, t, order=order, mode='symmetric',
+                   preserve_range=True)
 
-def warp_image_2d_stack(image, rotation_angle, shear_angle):
+
+def warp_image_2d_stack(image, rotation_angle, shear_angle, order=0):
     '''
     Warps a 3d or 4d matrix with affine transform.
 
@@ -84,27 +93,150 @@ def warp_image_2d_stack(image, rotation_angle, shear_angle):
         angle in degrees
     shear_angle : float
         angle in degrees
+    order : int, optional
+        Interpolation order (0: nearest neighbour, 1: bilinear, ...).
 
     Returns
     -------
     nump.ndarray
         transformed 3d matrix
     '''
-
-    if image.ndim == 3:
-        return np.array([warp_image_2d(z_slice, rotation_angle, shear_angle)
-                         for z_slice in image])
-
-    elif image.ndim == 4:
-        out = []
-        for image_zxy in image:
-            out.append([warp_image_2d(z_slice, rotation_angle, shear_angle)
-                        for z_slice in image_zxy])
-        return np.array(out)
+    if image.ndim in (3, 4):
+        # same transform for all slices
+        t = get_transform(image.reshape((-1,) + image.shape[-2:])[0],
+                          rotation_angle, shear_angle)
+        out = [tf.warp(z_slice, t, order=order, mode='symmetric',
+                       preserve_range=True)
+               for z_slice in image.reshape((-1,) + image.shape[-2:])]
+        return np.array(out).reshape(image.shape)
     msg = 'Image has {} dimensions, must have 3 or 4.'.format(image.ndim)
     raise ValueError(msg)
 
 
+@lru_cache(maxsize=8)
+def _index_grid(shape_xy):
+    grid = np.indices(shape_xy, dtype=np.float64).reshape(2, -1)
+    grid.flags.writeable = False
+    return grid
+
+
+def affine_sampling_grid(shape_xy, rotation_angle, shear_angle):
+    '''
+    Returns source coordinates of all pixels of a 2D matrix for a
+    centered rotation and shear (same transform as warp_image_2d).
+
+    Angles are sampled continuously during training, so grids are not
+    cached per angle. Only the pixel index grid is cached per shape, and
+    source coordinates are computed with one affine matrix product.
+
+    Parameters
+    ----------
+    shape_xy : (nr_x, nr_y)
+        Shape of the transformed matrix.
+    rotation_angle : float
+        Angle in degrees.
+    shear_angle : float
+        Angle in degrees.
+
+    Returns
+    -------
+    numpy.ndarray
+        Source coordinates with shape (2, nr_x, nr_y). Coordinates may be
+        negative or exceed shape_xy.
+
+    Examples
+    --------
+    >>> from yapic_io.transformations import affine_sampling_grid
+    >>> grid = affine_sampling_grid((3, 4), 90, 0)
+    >>> grid.shape
+    (2, 3, 4)
+    >>> grid[:, 0, 0]
+    array([3.5, 0.5])
+    '''
+    shape_xy = tuple(int(s) for s in shape_xy)
+    t = _centered_transform(shape_xy, rotation_angle, shear_angle)
+    # skimage transforms take (col, row) coordinates, i.e. (y, x)
+    m = t.params[[1, 0]][:, [1, 0, 2]]
+    grid = m[:, :2].dot(_index_grid(shape_xy)) + m[:, 2:]
+    grid = np.round(grid, 10)  # remove numerical noise before rounding
+    return grid.reshape((2,) + shape_xy)
+
+
+def affine_support(grid, order=0):
+    '''
+    Returns the region (lower and upper bounds in x and y) of a source
+    matrix that is read by affine_gather() with a sampling grid.
+
+    Parameters
+    ----------
+    grid : numpy.ndarray
+        Source coordinates with shape (2, nr_x, nr_y).
+    order : int
+        Interpolation order (0 or 1).
+
+    Returns
+    -------
+    tuple
+        lower bounds (x, y), upper bounds (x, y) (exclusive)
+    '''
+    flat = grid.reshape(2, -1)
+    if order == 0:
+        lo = np.floor(flat.min(axis=1) + 0.5)
+        hi = np.floor(flat.max(axis=1) + 0.5) + 1
+    else:
+        lo = np.floor(flat.min(axis=1))
+        hi = np.floor(flat.max(axis=1)) + 2
+    return lo.astype(int), hi.astype(int)
+
+
+def affine_gather(image, grid, order=0):
+    '''
+    Samples the last two dimensions of a stack at the coordinates of a
+    sampling grid (see affine_sampling_grid), for all slices at once.
+
+    Coordinates outside the matrix are clipped to the matrix border,
+    i.e. the matrix should cover affine_support(grid, order).
+
+    Parameters
+    ----------
+    image : numpy.ndarray
+        Matrix with at least 2 dimensions.
+    grid : numpy.ndarray
+        Source coordinates with shape (2, nr_x, nr_y).
+    order : int
+        Interpolation order, 0 (nearest neighbour) or 1 (bilinear).
+
+    Returns
+    -------
+    numpy.ndarray
+        Matrix with shape image.shape[:-2] + (nr_x, nr_y). Data type is
+        preserved for nearest neighbour interpolation.
+    '''
+    nx, ny = image.shape[-2:]
+    if order == 0:
+        # round half up, same as skimage.transform.warp
+        x = np.clip(np.floor(grid[0] + 0.5).astype(np.intp), 0, nx - 1)
+        y = np.clip(np.floor(grid[1] + 0.5).astype(np.intp), 0, ny - 1)
+        return image[..., x, y]
+
+    if order == 1:
+        x0 = np.floor(grid[0])
+        y0 = np.floor(grid[1])
+        fx = grid[0] - x0
+        fy = grid[1] - y0
+        x0 = np.clip(x0.astype(np.intp), 0, nx - 1)
+        y0 = np.clip(y0.astype(np.intp), 0, ny - 1)
+        x1 = np.minimum(x0 + 1, nx - 1)
+        y1 = np.minimum(y0 + 1, ny - 1)
+        return ((image[..., x0, y0] * (1 - fy)
+                 + image[..., x0, y1] * fy) * (1 - fx)
+                + (image[..., x1, y0] * (1 - fy)
+                   + image[..., x1, y1] * fy) * fx)
+
+    raise ValueError('Interpolation order {} not supported, '
+                     'must be 0 or 1.'.format(order))
+
+
 def flip_image_2d_stack(image, fliplr=False, flipud=False, rot90=0):
     '''
     Flips and rotates a zxy stack in xy with fast numpy operations.
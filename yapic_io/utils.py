@@ -2,6 +2,9 @@ import numpy as np
 import logging
 import os
 import itertools
+import collections
+import re
+from concurrent.futures import ThreadPoolExecutor
 from difflib import SequenceMatcher
 from munkres import Munkres
 import sys
@@ -172,6 +175,157 @@ def segregate_tile_pos(pos, shape, choices):
     return [tuple(e) for e in p1], [tuple(e) for e in p2]
 
 
+def parallel_map(func, items, n_workers=None):
+    '''
+    Applies func to all items, optionally in a thread pool.
+
+    Threads are used (rather than processes), since per-file scans are
+    dominated by file access and decompression, which release the GIL,
+    and results are memoized in caches of the calling object.
+
+    Parameters
+    ----------
+    func : callable
+        Function with one argument.
+    items : iterable
+        Arguments for func.
+    n_workers : int, optional
+        Number of worker threads. If None or 1, items are processed
+        serially.
+
+    Returns
+    -------
+    list
+        Results of func in the order of items.
+
+    Examples
+    --------
+    >>> from yapic_io.utils import parallel_map
+    >>> parallel_map(abs, [-1, 2, -3], n_workers=2)
+    [1, 2, 3]
+    '''
+    if n_workers is None or n_workers <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(func, items))
+
+
+def _align_to_chunks(n, chunk):
+    return max(chunk, n // chunk * chunk)
+
+
+def iter_zy_blocks(data, max_block_bytes=2**26):
+    '''
+    Iterates over blocks of z-slices (and y-rows if a single z-slice is
+    too large) of a (z, y, x, c) array.
+
+    Block boundaries are aligned to the chunks of chunked arrays (e.g.
+    zarr arrays or compressed tiffs), such that each chunk is decoded only
+    once.
+
+    Parameters
+    ----------
+    data : array_like
+        4D array with dimension order (z, y, x, c), e.g. a numpy.memmap
+        or a lazy array.
+    max_block_bytes : int
+        Approximate maximum size of one block in bytes.
+
+    Yields
+    ------
+    numpy.ndarray
+        Block of shape (nr_zslices, nr_y, x, c)
+    '''
+    for _, block in iter_zy_blocks_with_offsets(data, max_block_bytes):
+        yield block
+
+
+def iter_zy_blocks_with_offsets(data, max_block_bytes=2**26):
+    '''
+    Same as iter_zy_blocks, but yields tuples ((z, y), block) with the
+    position of each block.
+    '''
+    Z, Y, X, C = data.shape
+    chunks = getattr(data, 'chunks', None) or (1, 1, 1, 1)
+    itemsize = np.dtype(data.dtype).itemsize
+
+    slice_bytes = max(1, Y * X * C * itemsize)
+    if slice_bytes <= max_block_bytes:
+        zs = _align_to_chunks(max_block_bytes // slice_bytes, chunks[0])
+        ys = Y
+    else:
+        zs = chunks[0]
+        row_bytes = max(1, zs * X * C * itemsize)
+        ys = _align_to_chunks(max_block_bytes // row_bytes, chunks[1])
+
+    for z in range(0, Z, zs):
+        for y in range(0, Y, ys):
+            yield (z, y), np.asarray(data[z: z + zs, y: y + ys, :, :])
+
+
+def _value_counts(a):
+    '''
+    Returns unique values and their counts of an array.
+    Uses bincount for small non-negative integers, which is much faster
+    than sorting based np.unique. Other values (e.g. floats) are counted
+    with np.unique.
+    '''
+    if a.size == 0:
+        return np.array([], dtype='int64'), np.array([], dtype='int64')
+    if a.dtype.kind == 'b':
+        a = a.view('uint8')
+    if a.dtype.kind in 'ui':
+        lo, hi = a.min(), a.max()
+        if lo >= 0 and hi < 2**20:
+            counts = np.bincount(a.ravel(), minlength=int(hi) + 1)
+            values = np.flatnonzero(counts)
+            return values, counts[values]
+    return np.unique(a, return_counts=True)
+
+
+def label_histogram(label_data, max_block_bytes=2**26):
+    '''
+    Counts all label values per channel of a label image in one pass.
+
+    The label image is read block by block (see iter_zy_blocks), so
+    memory consumption is bounded and each voxel is read only once.
+
+    Parameters
+    ----------
+    label_data : array_like
+        4D label array with dimension order (z, y, x, c).
+    max_block_bytes : int
+        Approximate maximum size of blocks read at once.
+
+    Returns
+    -------
+    list
+        One dict per label channel with label values as keys and label
+        counts as values. Label value 0 (unlabeled) is omitted.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.utils import label_histogram
+    >>> lbl = np.zeros((2, 4, 4, 2), dtype='uint8')  # z, y, x, c
+    >>> lbl[0, :2, :2, 0] = 3
+    >>> lbl[1, 0, :, 1] = 7
+    >>> label_histogram(lbl)
+    [{3: 4}, {7: 4}]
+    '''
+    C = label_data.shape[-1]
+    counts = [collections.Counter() for _ in range(C)]
+
+    for block in iter_zy_blocks(label_data, max_block_bytes):
+        for c in range(C):
+            values, n = _value_counts(block[..., c])
+            counts[c].update(dict(zip(values.tolist(), n.tolist())))
+
+    return [{l: n for l, n in sorted(cnt.items()) if l != 0}
+            for cnt in counts]
+
+
 def _compute_str_dist_matrix(s1, s2):
     '''
     - compute matrix of string distances for two lists of strings
@@ -188,30 +342,15 @@ def _compute_str_dist_matrix(s1, s2):
     return mat, s1, s2
 
 
-def find_best_matching_pairs(s1, s2):
+def _fuzzy_matching_pairs(s1, s2):
     '''
     Find global minimum for pairwise assignment of strings
-    by using the munkres (hungarian) algorithmself.
-
-    Parameters
-    ----------
-    s1 : array_like
-        List of strings.
-    s2 : array_like
-       List of strings.
-
-    Notes
-    -----
-    Counts of non-empty elements must be equal for s1 and s2.
+    by using the munkres (hungarian) algorithm.
     '''
-
-    # remove empties
-    s1 = list(filter(None, s1))
-    s2 = list(filter(None, s2))
-
     if len(s1) == 0:
-        assert len(s2) == 0
         return []
+    if len(s2) == 0:
+        return [[a, None] for a in s1]
 
     mat, s1norm, s2norm = _compute_str_dist_matrix(s1, s2)
 
@@ -229,3 +368,142 @@ def find_best_matching_pairs(s1, s2):
             pair[1] = None
 
     return [pair for pair in pairs if pair[0] is not None]
+
+
+_SEPARATORS = '_-. '
+
+
+def _stem(name):
+    return os.path.splitext(os.path.basename(name))[0].lower()
+
+
+def _cut_at_separator(affix):
+    idx = max(affix.rfind(c) for c in _SEPARATORS)
+    return affix[:idx + 1]
+
+
+def _affix_free_keys(names):
+    '''
+    Lowercase filename stems without the prefix and suffix common to
+    all names (cut at separators like `_` or `-`), e.g.
+    `['img_01_raw.tif', 'img_02_raw.tif']` gives `['01', '02']`.
+    '''
+    stems = [_stem(n) for n in names]
+    prefix = _cut_at_separator(os.path.commonprefix(stems))
+    stems = [st[len(prefix):] for st in stems]
+    suffix = _cut_at_separator(
+        os.path.commonprefix([st[::-1] for st in stems]))
+    return [st[:len(st) - len(suffix)] for st in stems]
+
+
+def _pattern_key(pattern):
+    '''
+    Returns key function for a regular expression: the first group (or
+    the whole match if there are no groups), None if not matching.
+    '''
+    regex = re.compile(pattern)
+
+    def key(name):
+        match = regex.search(name)
+        if match is None:
+            return None
+        return match.group(1 if regex.groups else 0)
+    return key
+
+
+def _match_by_keys(s1, keys1, s2, keys2):
+    '''
+    Pairs strings with identical keys. Keys that are None or not unique
+    are ignored.
+    '''
+    def unique(strings, keys):
+        cnt = collections.Counter(keys)
+        return {k: s for s, k in zip(strings, keys)
+                if k is not None and k != '' and cnt[k] == 1}
+
+    u1 = unique(s1, keys1)
+    u2 = unique(s2, keys2)
+    return {u1[k]: u2[k] for k in u1.keys() & u2.keys()}
+
+
+def find_best_matching_pairs(s1, s2, pair_by=None):
+    '''
+    Pairwise assignment of strings (e.g. pixel and label filenames).
+
+    Strings are matched in stages, each stage only handles strings not
+    matched before:
+
+    1. identical strings
+    2. identical filename stems (case insensitive)
+    3. identical filename stems after removing a prefix and suffix
+       common to all strings of a list (e.g. `img_01.tif` and
+       `lbl_01.tif` for lists `img_*.tif` and `lbl_*.tif`)
+    4. global minimum for pairwise assignment of the remaining strings by
+       string similarity using the munkres (hungarian) algorithm.
+
+    Stages 1-3 are linear in the number of strings, so large collections
+    of consistently named files are paired quickly. Only the remaining
+    strings are matched by the expensive stage 4 (cubic runtime).
+
+    Parameters
+    ----------
+    s1 : array_like
+        List of strings.
+    s2 : array_like
+       List of strings.
+    pair_by : str or callable, optional
+        Custom pairing rule: a function mapping a string to a key or a
+        regular expression, e.g. `r'(\d+)'` (the first group or the whole
+        match is the key). Strings with identical keys are paired, no
+        other matching is done.
+
+    Returns
+    -------
+    list
+        One pair `[a, b]` for each non-empty element `a` of s1 (in order
+        of s1). `b` is None if no match was found.
+
+    Examples
+    --------
+    >>> from yapic_io.utils import find_best_matching_pairs
+    >>> find_best_matching_pairs(['im_2.tif', 'im_1.tif', 'im_3.tif'],
+    ...                          ['lbl_1.tif', 'lbl_2.tif'])
+    [['im_2.tif', 'lbl_2.tif'], ['im_1.tif', 'lbl_1.tif'], ['im_3.tif', None]]
+    >>> find_best_matching_pairs(['A-1.tif', 'B-7.tif'],
+    ...                          ['7.tif', '1.tif'], pair_by=r'(\d+)\.tif')
+    [['A-1.tif', '1.tif'], ['B-7.tif', '7.tif']]
+    '''
+
+    # remove empties
+    s1 = list(filter(None, s1))
+    s2 = list(filter(None, s2))
+
+    if pair_by is not None:
+        key = _pattern_key(pair_by) if isinstance(pair_by, str) else pair_by
+        matches = _match_by_keys(s1, [key(a) for a in s1],
+                                 s2, [key(b) for b in s2])
+        return [[a, matches.get(a)] for a in s1]
+
+    keys1 = _affix_free_keys(s1) if s1 else []
+    keys2 = _affix_free_keys(s2) if s2 else []
+    key_pairs = [(s1, s2),
+                 ([_stem(a) for a in s1], [_stem(b) for b in s2]),
+                 (keys1, keys2)]
+
+    matches = {}
+    for k1, k2 in key_pairs:
+        todo1 = [(a, k) for a, k in zip(s1, k1) if a not in matches]
+        matched2 = set(matches.values())
+        todo2 = [(b, k) for b, k in zip(s2, k2) if b not in matched2]
+        if not todo1 or not todo2:
+            break
+        matches.update(_match_by_keys(*zip(*todo1), *zip(*todo2)))
+
+    matched2 = set(matches.values())
+    left1 = [a for a in s1 if a not in matches]
+    left2 = [b for b in s2 if b not in matched2]
+    if left1:
+        logger.debug('%s strings left for fuzzy matching', len(left1))
+    matches.update(dict(_fuzzy_matching_pairs(left1, left2)))
+
+    return [[a, matches[a]] for a in s1]
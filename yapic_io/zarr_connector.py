@@ -0,0 +1,233 @@
+import logging
+import os
+from functools import lru_cache
+from pathlib import Path
+import zarr
+import yapic_io.utils as ut
+from yapic_io.tiff_connector import TiffConnector, _handle_img_filenames
+from yapic_io.lazy_array import ZYXCView
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+STORE_SUFFIXES = ('.zarr', '.n5')
+
+
+def _is_store(path):
+    path = Path(path)
+    if not path.is_dir():
+        return False
+    if path.suffix.lower() in STORE_SUFFIXES:
+        return True
+    markers = ('.zarray', '.zgroup', 'attributes.json')
+    return any((path / m).exists() for m in markers)
+
+
+def _handle_store_filenames(filepath):
+    '''
+    Like _handle_img_filenames, but for zarr/n5 stores, which are
+    directories themselves.
+
+    - a single store path is handled like a single image file
+    - a directory that is not a store is searched for stores
+    '''
+    if type(filepath) in (str, Path):
+        if _is_store(filepath):
+            filepath = [filepath]
+        elif os.path.isdir(filepath):
+            stores = sorted(p for p in Path(filepath).expanduser().iterdir()
+                            if _is_store(p))
+            if len(stores) == 0:
+                logger.info('0 image files detected.')
+                return Path(filepath).expanduser().resolve(), []
+            filepath = stores
+
+    return _handle_img_filenames(filepath)
+
+
+def _axes_from_attrs(attrs):
+    '''
+    Reads dimension names from xarray style (`_ARRAY_DIMENSIONS`) or
+    OME-Zarr style (`multiscales`) attributes.
+    '''
+    if '_ARRAY_DIMENSIONS' in attrs:
+        return ''.join(attrs['_ARRAY_DIMENSIONS'])
+
+    multiscales = attrs.get('multiscales')
+    if multiscales and 'axes' in multiscales[0]:
+        axes = multiscales[0]['axes']
+        return ''.join(a['name'] if isinstance(a, dict) else a for a in axes)
+
+    return None
+
+
+def open_zarr_array(path, array_path=None):
+    '''
+    Opens the array of a zarr or n5 store in read only mode.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path to a zarr or n5 store.
+    array_path : str, optional
+        Key of the array within the store. If not given, the store itself
+        must be an array, or a group with OME-Zarr `multiscales` metadata
+        (highest resolution level is used), or a group containing exactly
+        one array.
+
+    Returns
+    -------
+    zarr.Array, str or None
+        The array and dimension names found in the store metadata.
+    '''
+    path = Path(path)
+    store = zarr.N5Store(str(path)) if path.suffix.lower() == '.n5' \
+        else str(path)
+    node = zarr.open(store, mode='r')
+
+    if isinstance(node, zarr.Array):
+        return node, _axes_from_attrs(node.attrs)
+
+    if array_path is None:
+        multiscales = node.attrs.get('multiscales')
+        if multiscales:
+            array_path = multiscales[0]['datasets'][0]['path']
+        else:
+            keys = list(node.array_keys())
+            msg = 'Could not determine array in {}, found {}'.format(path,
+                                                                     keys)
+            assert len(keys) == 1, msg
+            array_path = keys[0]
+
+    array = node[array_path]
+    axes = _axes_from_attrs(array.attrs) or _axes_from_attrs(node.attrs)
+    return array, axes
+
+
+class ZarrConnector(TiffConnector):
+    '''
+    Implementation of Connector for chunked pixel and label images stored
+    as zarr_ or n5 containers.
+
+    Only chunks overlapping requested tiles are read and decompressed.
+    Thus, images can be much larger than memory and do not have to be
+    stored uncompressed.
+
+    .. _zarr: https://zarr.readthedocs.io
+
+    Parameters
+    ----------
+    img_filepath : str or list of str
+        Path to source pixel stores (use wildcards for filtering, e.g.
+        `*.zarr`), a folder containing stores, or a list of store paths.
+    label_filepath : str or list of str
+        Path to label stores (use wildcards for filtering)
+        or a list of store paths.
+    savepath : str, optional
+        Directory to save pixel classifiaction results as probability
+        images.
+    array_path : str, optional
+        Key of the array inside each store, e.g. `'0'` for the highest
+        resolution level of an OME-Zarr image.
+    axes : str, optional
+        Dimension order of the arrays, e.g. `'CZYX'`. If not given, it is
+        read from the store metadata (OME-Zarr `multiscales` or xarray
+        `_ARRAY_DIMENSIONS` attributes). Without metadata, the OME-Zarr
+        order `'CZYX'` is assumed (`'ZYX'` for 3D, `'YX'` for 2D arrays).
+    stats_cache : bool or str, optional
+        Persist image dimensions in a json sidecar file (see
+        TiffConnector). Label statistics of stores are always recomputed,
+        since a store's modification time does not reflect changes of
+        its chunks.
+    n_workers : int, optional
+        Number of threads for scanning stores at construction
+        (see TiffConnector).
+    pair_by : str or callable, optional
+        Rule for assigning label stores to pixel stores
+        (see TiffConnector).
+
+    Notes
+    -----
+    Label images and pixel images have to be equal in zxy dimensions,
+    but can differ in nr of channels.
+
+    Probability maps are written as tiff files, as with the TiffConnector.
+
+    See Also
+    --------
+    yapic_io.tiff_connector.TiffConnector
+    '''
+
+    def __init__(self, img_filepath, label_filepath, savepath=None,
+                 array_path=None, axes=None, stats_cache=None,
+                 n_workers=None, pair_by=None):
+        self.array_path = array_path
+        self.axes = axes
+
+        super().__init__(img_filepath, label_filepath, savepath=savepath,
+                         stats_cache=stats_cache, n_workers=n_workers,
+                         pair_by=pair_by)
+
+    def _handle_img_filenames(self, img_filepath):
+        return _handle_store_filenames(img_filepath)
+
+    def _handle_lbl_filenames(self, label_filepath):
+        return _handle_store_filenames(label_filepath)
+
+    def __repr__(self):
+        infostring = \
+            'ZarrConnector object\n' \
+            'image filepath: {}\n' \
+            'label filepath: {}\n'\
+            'nr of images: {}\n'\
+            'labelvalue_mapping: {}'.format(self.img_path,
+                                            self.label_path,
+                                            self.image_count(),
+                                            self.labelvalue_mapping)
+        return infostring
+
+    def _open_store(self, path):
+        '''Returns lazy array view with shape: z, y, x, c'''
+        array, axes = open_zarr_array(path, array_path=self.array_path)
+        axes = self.axes or axes or 'CZYX'[-array.ndim:]
+        return ZYXCView(array, axes)
+
+    def _open_cached_store(self, path):
+        return self.handle_cache.get_file(path,
+                                          lambda: self._open_store(path),
+                                          self.array_path, self.axes)
+
+    def _open_image_file(self, image_nr):
+        path = self.img_path / self.filenames[image_nr].img
+        return self._open_cached_store(path)
+
+    def _image_file_shape(self, image_nr):
+        return self._open_image_file(image_nr).shape
+
+    def _label_file_shape(self, image_nr):
+        return self._open_label_file(image_nr).shape
+
+    def _open_label_file(self, image_nr):
+        label_filename = self.filenames[image_nr].lbl
+
+        if label_filename is None:
+            logger.warning(
+                'no label matrix file found for image file %s', str(image_nr))
+            return None
+
+        path = self.label_path / label_filename
+        logger.debug('Trying to load labelmat %s', path)
+
+        return self._open_cached_store(path)
+
+    @lru_cache(maxsize=1500)
+    def _original_label_count_for_image(self, image_nr):
+        '''
+        Returns for each label channel a dict with original label values
+        as keys and label counts as values.
+
+        Counts are not taken from the stats cache, since a store's
+        modification time does not change if chunks are rewritten.
+        '''
+        if self.filenames[image_nr].lbl is None:
+            return None
+        return ut.label_histogram(self._open_label_file(image_nr))